@@ -0,0 +1,189 @@
+"""
+Suggests indexes from the queries that were actually made.
+
+Set `INDEX_ADVISOR_WINDOW` (in seconds) on the mongodb database and the
+shape of every filter and sort is counted, see
+django_mongokit.mongodb.monitoring.QueryShapes. `recommend_indexes()` then
+compares those shapes with the indexes of the collections that registered
+DjangoDocument classes use:
+
+    >>> from django_mongokit.advisor import recommend_indexes
+    >>> for recommendation in recommend_indexes():
+    ...     print recommendation['action'], recommendation['key'],
+    ...     print recommendation['count'], recommendation['time']
+    create [('tags', 1), ('when', -1)] 1204 38.2
+    drop [('topic', 1)] 0 0.0
+
+An index is recommended for every shape that no existing index serves,
+built equality fields first, then the sort, then range fields. An index is
+reported unused if no counted shape filters or sorts on its first field.
+Unique and TTL indexes are never reported as unused since they do more
+than speed up queries.
+"""
+
+from document import document_classes
+from indexes import get_collection, server_indexes
+
+# operators that can't be answered by an index prefix the way equality can
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists',
+                   '$regex', '$not', '$mod', '$type')
+
+
+def _unique(fields):
+    seen = []
+    for field in fields:
+        if field not in seen:
+            seen.append(field)
+    return seen
+
+
+def analyse_shape(filter_shape, sort=None):
+    """return (equality, ranges, sort) where the first two are lists of
+    the fields `filter_shape` matches exactly or by range"""
+    equality = []
+    ranges = []
+
+    def walk(shape):
+        for key, value in shape.items():
+            if key == '$and':
+                for sub_shape in value:
+                    walk(sub_shape)
+            elif key.startswith('$'):
+                # $or, $nor, $where, $text etc. don't make one index
+                continue
+            elif (isinstance(value, dict) and value and
+                  [op for op in value if op.startswith('$')]):
+                if [op for op in value if op in RANGE_OPERATORS]:
+                    ranges.append(key)
+                else:
+                    equality.append(key)
+            else:
+                equality.append(key)
+
+    walk(filter_shape)
+    equality = sorted(_unique(equality))
+    sort = [(field, direction) for field, direction in sort or []
+            if field not in equality]
+    sorted_fields = [field for field, __ in sort]
+    ranges = [field for field in _unique(ranges)
+              if field not in equality and field not in sorted_fields]
+    return equality, ranges, sort
+
+
+def suggest_index(equality, ranges, sort):
+    """equality, sort, range"""
+    return ([(field, 1) for field in equality] + list(sort) +
+            [(field, 1) for field in ranges])
+
+
+def serves(key, equality, ranges, sort):
+    """whether an index on `key` can answer a query on these fields without
+    scanning more than it returns (much)"""
+    fields = [field for field, __ in key]
+    if set(fields[:len(equality)]) != set(equality):
+        return False
+    rest = key[len(equality):]
+    if sort:
+        head = rest[:len(sort)]
+        if [field for field, __ in head] != [field for field, __ in sort]:
+            return False
+        same = [direction == sort_direction for (__, direction),
+                (__, sort_direction) in zip(head, sort)]
+        # an index can be walked backwards but not half backwards
+        return all(same) or not any(same)
+    if not equality:
+        return bool(ranges) and fields[0] in ranges
+    return True
+
+
+def _document_collections(classes):
+    collections = {}
+    for document_class in classes:
+        collection = get_collection(document_class)
+        if collection is None:
+            continue
+        if collection.full_name not in collections:
+            collections[collection.full_name] = (collection, [])
+        collections[collection.full_name][1].append(document_class.__name__)
+    return collections
+
+
+def recommend_indexes(shapes=None, using='mongodb', classes=None):
+    """
+    Return a list of recommendations, the most time consuming first. Each
+    is a dict of 'action' ('create' or 'drop'), 'collection' (full name),
+    'documents' (the DjangoDocument classes using it), 'key', 'name',
+    'count' and 'time' (the number of queries and total seconds the index
+    would have helped) and 'shapes' (the filters and sorts it's for).
+
+    `shapes` defaults to what was counted on the `using` database.
+    """
+    if shapes is None:
+        from django.db import connections
+        shapes = connections[using].query_shapes()
+    if classes is None:
+        classes = document_classes
+    collections = _document_collections(classes)
+
+    by_collection = {}
+    for shape in shapes:
+        full_name = '%s.%s' % (shape['database'], shape['collection'])
+        if full_name in collections:
+            by_collection.setdefault(full_name, []).append(shape)
+
+    recommendations = []
+    for full_name, collection_shapes in sorted(by_collection.items()):
+        collection, names = collections[full_name]
+        existing = server_indexes(collection)
+        key_options = [[('_id', 1)]] + [index['key'] for index in existing]
+        used = set()
+        missing = {}
+        for shape in collection_shapes:
+            equality, ranges, sort = analyse_shape(shape['filter'],
+                                                   shape['sort'])
+            if not equality and not ranges and not sort:
+                continue
+            queried = set(equality + ranges + [field for field, __ in sort])
+            for index in existing:
+                if index['key'][0][0] in queried:
+                    used.add(index['name'])
+            if [key for key in key_options
+                if serves(key, equality, ranges, sort)]:
+                continue
+            key = suggest_index(equality, ranges, sort)
+            if tuple(key) not in missing:
+                missing[tuple(key)] = {
+                    'action': 'create',
+                    'collection': full_name,
+                    'documents': names,
+                    'key': key,
+                    'name': None,
+                    'count': 0,
+                    'time': 0.0,
+                    'shapes': [],
+                }
+            recommendation = missing[tuple(key)]
+            recommendation['count'] += shape['count']
+            recommendation['time'] += shape['time']
+            recommendation['shapes'].append({'filter': shape['filter'],
+                                             'sort': shape['sort']})
+        recommendations.extend(missing.values())
+
+        for index in existing:
+            if (index['name'] in used or index['unique'] or
+                index['expireAfterSeconds'] is not None):
+                continue
+            recommendations.append({
+                'action': 'drop',
+                'collection': full_name,
+                'documents': names,
+                'key': index['key'],
+                'name': index['name'],
+                'count': 0,
+                'time': 0.0,
+                'shapes': [],
+            })
+
+    recommendations.sort(key=lambda each: (each['time'], each['count']),
+                         reverse=True)
+    return recommendations
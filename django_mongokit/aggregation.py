@@ -0,0 +1,176 @@
+"""
+Building aggregation pipelines for the collection of a DjangoDocument and
+streaming through their results.
+
+    >>> from django_mongokit.aggregation import Sum
+    >>> tags = (collection.Talk.aggregate()
+    ...         .unwind('tags')
+    ...         .group('tags', talks=Sum(1))
+    ...         .sort('-talks'))
+    >>> for tag in tags:
+    ...     print tag['_id'], tag['talks']
+
+In field positions strings are field names, with or without the `$`
+MongoDB wants in front of them, and dicts are passed on as they are. The
+results are read through a cursor, a batch at a time, so they can be
+bigger than the 16MB a single reply can hold. That needs MongoDB 2.6 or
+later.
+"""
+
+from bson.son import SON
+from pymongo import ASCENDING, DESCENDING
+
+from query import lookups_to_spec, _and
+from records import freeze
+
+
+def F(name):
+    """a reference to the field `name`, e.g. F('author.name') is
+    '$author.name'"""
+    if name.startswith('$'):
+        return name
+    return '$' + name
+
+
+def _value(value):
+    # strings are fields, everything else is a literal or an expression
+    if isinstance(value, basestring):
+        return F(value)
+    return value
+
+
+def _accumulator(operator):
+    def accumulator(value):
+        return {operator: _value(value)}
+    accumulator.__name__ = operator[1:].capitalize()
+    accumulator.__doc__ = ("e.g. `%s('duration')` for the %s of a field "
+                           "in group()" % (accumulator.__name__, operator))
+    return accumulator
+
+Sum = _accumulator('$sum')
+Avg = _accumulator('$avg')
+Min = _accumulator('$min')
+Max = _accumulator('$max')
+First = _accumulator('$first')
+Last = _accumulator('$last')
+Push = _accumulator('$push')
+AddToSet = _accumulator('$addToSet')
+
+
+class Aggregation(object):
+    """
+    An aggregation pipeline for a registered document, e.g.
+    `collection.Talk`, that's built up lazily like a QuerySet. Every
+    method returns a new Aggregation and nothing is sent to the database
+    until it's iterated over.
+    """
+
+    def __init__(self, document, pipeline=None):
+        self.document = document
+        self.pipeline = list(pipeline or [])
+        self._allow_disk_use = False
+        self._batch_size = None
+        self._as_records = False
+
+    def __repr__(self):
+        return '<Aggregation %r>' % self.pipeline
+
+    def __iter__(self):
+        return self.iterator()
+
+    def _clone(self, *stages):
+        clone = self.__class__(self.document, self.pipeline + list(stages))
+        clone._allow_disk_use = self._allow_disk_use
+        clone._batch_size = self._batch_size
+        clone._as_records = self._as_records
+        return clone
+
+    def match(self, *specs, **lookups):
+        """only carry on with the documents that match. Takes MongoDB spec
+        dicts, Django style keyword lookups or both, like filter()"""
+        specs = list(specs)
+        if lookups:
+            specs.append(lookups_to_spec(lookups))
+        return self._clone({'$match': _and(specs)})
+
+    def group(self, _id, **accumulators):
+        """
+        One result per distinct value of `_id`, a field name, a dict of
+        them (e.g. `{'year': 'year', 'room': 'room'}`) or None for a
+        single result. The accumulators are like `count=Sum(1)` or
+        `longest=Max('duration')`.
+        """
+        if isinstance(_id, dict):
+            _id = dict((key, _value(value)) for key, value in _id.items())
+        else:
+            _id = _value(_id)
+        group = SON([('_id', _id)])
+        for name, accumulator in sorted(accumulators.items()):
+            group[name] = accumulator
+        return self._clone({'$group': group})
+
+    def unwind(self, field):
+        """one result per item in the array `field`"""
+        return self._clone({'$unwind': F(field)})
+
+    def sort(self, *keys):
+        """e.g. `sort('-count', '_id')`"""
+        ordering = SON()
+        for key in keys:
+            if key.startswith('-'):
+                ordering[key[1:]] = DESCENDING
+            else:
+                ordering[key] = ASCENDING
+        return self._clone({'$sort': ordering})
+
+    def project(self, *fields, **expressions):
+        """keep only `fields` and add `expressions`, e.g.
+        `project('topic', speaker='author.name', _id=False)`"""
+        projection = SON((field, 1) for field in fields)
+        for name, expression in sorted(expressions.items()):
+            if isinstance(expression, bool):
+                projection[name] = int(expression)
+            else:
+                projection[name] = _value(expression)
+        return self._clone({'$project': projection})
+
+    def skip(self, number):
+        return self._clone({'$skip': number})
+
+    def limit(self, number):
+        return self._clone({'$limit': number})
+
+    def allow_disk_use(self, allow=True):
+        """let the server write temporary files for stages, like $group and
+        $sort, that need more than 100MB of memory"""
+        clone = self._clone()
+        clone._allow_disk_use = allow
+        return clone
+
+    def batch_size(self, size):
+        """how many results the server sends at a time"""
+        clone = self._clone()
+        clone._batch_size = size
+        return clone
+
+    def records(self):
+        """return read-only Records, with the fields as attributes, instead
+        of dicts"""
+        clone = self._clone()
+        clone._as_records = True
+        return clone
+
+    def iterator(self):
+        """stream the results from the server"""
+        cursor_options = {}
+        if self._batch_size is not None:
+            cursor_options['batchSize'] = self._batch_size
+        kwargs = {'cursor': cursor_options}
+        if self._allow_disk_use:
+            kwargs['allowDiskUse'] = True
+        cursor = self.document.collection.aggregate(self.pipeline, **kwargs)
+        if self._batch_size is not None:
+            cursor.batch_size(self._batch_size)
+        if not self._as_records:
+            return iter(cursor)
+        return (freeze(result) for result in cursor)
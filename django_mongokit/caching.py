@@ -0,0 +1,172 @@
+"""
+Caching documents by `_id` with Django's cache framework.
+
+    class Talk(DjangoDocument):
+        class Meta:
+            cache_timeout = 60 * 5  # seconds
+            cache_alias = 'default'
+
+Documents of such classes loaded with `one({'_id': ...})`, `find_one()`
+by `_id` or `get_from_id()` come from the cache, stored as BSON, and are
+taken out of it again by the `post_save` and `post_delete` signals. If a
+document isn't cached only one process loads it from the database while
+the others wait a little for it to be cached. Documents that change are
+replaced with a marker for a few seconds, rather than just deleted, so
+that a load that started before the change can't cache what it read.
+
+With `Meta.count_cache_timeout` the counts of querysets are cached too.
+Every save or delete of a document of the collection makes all of them
+stale at once by changing the collection's count "generation", which is
+part of their keys.
+"""
+
+import hashlib
+import time
+
+import bson
+from django.db.models import signals
+
+KEY_PREFIX = 'django_mongokit'
+
+# the most seconds one process may spend loading a document before others
+# load it too
+LOCK_TIMEOUT = 10
+
+# how long the others wait for it to be cached and how often they look
+WAIT_TIME = 1.0
+WAIT_INTERVAL = 0.05
+
+# seconds that documents that don't exist are remembered as such
+MISSING_TIMEOUT = 10
+
+# cached in place of documents that don't exist
+MISSING = ''
+
+# cached for LOCK_TIMEOUT seconds in place of documents that just changed;
+# BSON never looks like this
+INVALIDATED = '-'
+
+
+def get_cache(alias=None):
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        # Django < 1.7
+        from django.core.cache import get_cache
+        return get_cache(alias or 'default')
+    return caches[alias or 'default']
+
+
+def _digest(value):
+    return hashlib.md5(bson.BSON.encode(value)).hexdigest()
+
+
+def cache_key(collection, _id):
+    """the key of a document that's the same for the same _id of the same
+    type, e.g. 'django_mongokit:example.talks:<md5>'"""
+    return '%s:%s:%s' % (KEY_PREFIX, collection.full_name,
+                         _digest({'_id': _id}))
+
+
+def get_count(cache, collection, spec, skip, limit, count, timeout):
+    """the number of documents `count()` returns for a query of
+    `collection`, from `cache` if it was counted since the collection last
+    changed"""
+    generation_key = '%s:%s:counts' % (KEY_PREFIX, collection.full_name)
+    generation = cache.get(generation_key)
+    if generation is None:
+        # a different one every time it's lost, so old counts can't come
+        # back
+        cache.add(generation_key, int(time.time() * 1000))
+        generation = cache.get(generation_key)
+        if generation is None:
+            # e.g. the dummy cache
+            return count()
+    key = '%s:%s:count:%s:%s' % (KEY_PREFIX, collection.full_name,
+                                 generation,
+                                 _digest({'spec': spec, 'skip': skip,
+                                          'limit': limit}))
+    number = cache.get(key)
+    if number is None:
+        number = count()
+        cache.set(key, number, timeout)
+    return number
+
+
+def invalidate_counts(cache, collection):
+    """make the cached counts of `collection` stale"""
+    try:
+        cache.incr('%s:%s:counts' % (KEY_PREFIX, collection.full_name))
+    except ValueError:
+        # nothing has been counted
+        pass
+
+
+def get_or_load(cache, key, load, timeout):
+    """return the BSON of a document from `cache` or else from `load()` and
+    cache it. None means there's no such document."""
+    data = cache.get(key)
+    if data == INVALIDATED:
+        # it just changed and loads from before that may still be running
+        return load()
+    if data is not None:
+        return data or None
+
+    lock_key = key + ':lock'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # someone else is loading it
+        waited = 0.0
+        while waited < WAIT_TIME:
+            time.sleep(WAIT_INTERVAL)
+            waited += WAIT_INTERVAL
+            data = cache.get(key)
+            if data == INVALIDATED:
+                break
+            if data is not None:
+                return data or None
+        return _load_and_add(cache, key, load, timeout)
+
+    try:
+        return _load_and_add(cache, key, load, timeout)
+    finally:
+        cache.delete(lock_key)
+
+
+def _load_and_add(cache, key, load, timeout):
+    # add() so that it can't replace the INVALIDATED marker of a change
+    # made while it was loading
+    data = load()
+    if data is None:
+        cache.add(key, MISSING, min(timeout, MISSING_TIMEOUT))
+    else:
+        cache.add(key, data, timeout)
+    return data
+
+
+def invalidate_documents(cache, collection, ids):
+    """take the documents with `ids` out of the cache after they changed"""
+    cache.set_many(dict((cache_key(collection, _id), INVALIDATED)
+                        for _id in ids), LOCK_TIMEOUT)
+
+
+def invalidate(sender, instance, **kwargs):
+    """take a saved or deleted document out of the cache and make the
+    cached counts of its collection stale"""
+    meta = getattr(sender, '_meta', None)
+    if (getattr(meta, 'cache_timeout', None) is None and
+        getattr(meta, 'count_cache_timeout', None) is None):
+        return
+    collection = getattr(instance, 'collection', None)
+    if collection is None:
+        return
+    cache = get_cache(meta.cache_alias)
+    if meta.count_cache_timeout is not None:
+        invalidate_counts(cache, collection)
+    _id = instance.get('_id')
+    if meta.cache_timeout is not None and _id is not None:
+        invalidate_documents(cache, collection, [_id])
+
+signals.post_save.connect(invalidate,
+                          dispatch_uid='django_mongokit.caching.invalidate')
+signals.post_delete.connect(invalidate,
+                            dispatch_uid='django_mongokit.caching.invalidate')
@@ -1,5 +1,14 @@
+import atexit
 import sys
 import re
+import threading
+import weakref
+from copy import deepcopy
+import bson
+try:
+    from bson import ObjectId
+except ImportError:  # old pymongo
+    from pymongo.objectid import ObjectId
 from mongokit.document import DocumentProperties
 try:
     from mongokit.connection import CallableMixin
@@ -7,10 +16,155 @@ except ImportError:
     # mongokit < 0.6
     from mongokit.document import CallableMixin
 from mongokit import Document
+from pymongo.errors import OperationFailure
+from django.core.signals import request_finished
 from django.db.models import signals
 model_names = []
+# every (non abstract) DjangoDocument class, e.g. for sync_mongo_indexes
+document_classes = []
 
 from shortcut import connection
+from query import Manager
+from aggregation import Aggregation
+from indexes import normalize_index
+from caching import (
+    cache_key,
+    get_cache,
+    get_or_load,
+    invalidate_counts,
+    invalidate_documents,
+)
+from identity import identity_map
+
+# where documents of classes with a Meta.schema_version keep their version
+SCHEMA_VERSION_FIELD = 'schema_version'
+
+# ways upgraded documents can be written back
+UPGRADE_WRITE_BACKS = (None, 'immediate', 'batched')
+
+# documents loaded with only some of their fields fetch the rest this many
+# at a time
+DEFERRED_BATCH_SIZE = 1000
+
+# mongokit asks the server for its version every time a document is
+# validated. That can't change for the lifetime of a connection so it's
+# remembered here per connection.
+_size_limits = weakref.WeakKeyDictionary()
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _changed_paths(old, new, prefix=''):
+    """return a tuple of (changed, removed) dotted paths between two
+    versions of the same document. Embedded documents are compared key by
+    key so that only the bits that changed need to be $set."""
+    changed = []
+    removed = []
+    for key, value in new.iteritems():
+        path = prefix + key
+        if key not in old:
+            changed.append(path)
+        elif old[key] != value:
+            if (isinstance(value, dict) and value and
+                isinstance(old[key], dict) and old[key]):
+                _changed, _removed = _changed_paths(old[key], value,
+                                                    path + '.')
+                changed.extend(_changed)
+                removed.extend(_removed)
+            else:
+                changed.append(path)
+    for key in old:
+        if key not in new:
+            removed.append(prefix + key)
+    return changed, removed
+
+
+def _to_object_id(value):
+    # string versions of ObjectIds, like the `pk` property returns
+    if isinstance(value, basestring) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def _for_instances(spec, instances):
+    # only touch the documents signals were sent for
+    ids = {'_id': {'$in': [instance['_id'] for instance in instances]}}
+    if not spec:
+        return ids
+    return {'$and': [spec, ids]}
+
+
+def _affected(result, so_far=0):
+    """the number of documents a write touched or None if the write wasn't
+    acknowledged"""
+    if result is None:
+        return None
+    return so_far + result.get('n', 0)
+
+
+def _id_lookup(args, kwargs):
+    """the _id, as an ObjectId if it's the string version of one, if the
+    arguments of find_one() or one() are nothing but an _id, otherwise
+    None"""
+    if len(args) != 1 or kwargs:
+        return None
+    spec = args[0]
+    if isinstance(spec, dict):
+        if spec.keys() != ['_id'] or isinstance(spec['_id'], dict):
+            return None
+        spec = spec['_id']
+    return _to_object_id(spec)
+
+
+def _fill(document, loaded):
+    # copy what `document` doesn't have from `loaded`, embedded documents
+    # included, without touching what it has
+    for key, value in loaded.iteritems():
+        if key not in document:
+            document[key] = value
+        elif isinstance(value, dict) and isinstance(document[key], dict):
+            _fill(document[key], value)
+
+
+def _fill_lists(document, snapshot, loaded, stored):
+    # Projecting into a list, like `comments.author`, leaves lists that
+    # _fill() can't complete item by item. Take them whole from `loaded`,
+    # and from `stored` for the snapshot, unless they changed since they
+    # were loaded and return the paths of the ones that did.
+    changed = []
+    for key, value in loaded.iteritems():
+        if key not in document:
+            continue
+        current = document[key]
+        before = snapshot.get(key) if snapshot is not None else None
+        if isinstance(value, dict) and isinstance(current, dict):
+            if not isinstance(before, dict):
+                before = None
+            changed.extend('%s.%s' % (key, path) for path in
+                           _fill_lists(current, before, value,
+                                       stored.get(key) or {}))
+        elif isinstance(value, list) and current != value:
+            if snapshot is None or current != before:
+                changed.append(key)
+            else:
+                document[key] = value
+                snapshot[key] = stored.get(key)
+    return changed
+
+
+def _get_path(document, path):
+    for key in path.split('.'):
+        document = document[key]
+    return document
 
 
 class _PK(object):
@@ -21,6 +175,13 @@ class _Meta(object):
     def __init__(self, model_name, verbose_name, verbose_name_plural,
                  module_name=None,
                  app_label=None,
+                 indexes=None,
+                 schema_version=None,
+                 upgrades=None,
+                 upgrade_write_back=None,
+                 cache_timeout=None,
+                 cache_alias=None,
+                 count_cache_timeout=None,
                  ):
         self.model_name = model_name
         self.verbose_name = (
@@ -31,9 +192,40 @@ class _Meta(object):
                                     self.verbose_name + 's')
         self.module_name = module_name
         self.app_label = app_label
+        self.indexes = [normalize_index(index) for index in indexes or []]
+        self.schema_version = schema_version
+        # {version: function} where the function takes a document as it's
+        # stored in that version and returns it in the next version
+        self.upgrades = upgrades or {}
+        if upgrade_write_back not in UPGRADE_WRITE_BACKS:
+            raise ValueError("upgrade_write_back must be one of %r" %
+                             (UPGRADE_WRITE_BACKS,))
+        self.upgrade_write_back = upgrade_write_back
+        # documents are cached by _id for this many seconds if it's not None
+        self.cache_timeout = cache_timeout
+        self.cache_alias = cache_alias
+        # QuerySet counts are cached for this many seconds if it's not None
+        self.count_cache_timeout = count_cache_timeout
         self.pk = _PK()  # needed for haystack
         model_names.append((model_name, self.verbose_name))
 
+    def needs_upgrade(self, son):
+        return (self.schema_version is not None and
+                (son.get(SCHEMA_VERSION_FIELD) or 1) < self.schema_version)
+
+    def upgrade(self, son):
+        """return `son`, a document as it's stored, upgraded to
+        `schema_version`. Versions without an upgrade function are just
+        skipped and documents without a version are version 1."""
+        version = son.get(SCHEMA_VERSION_FIELD) or 1
+        while version < self.schema_version:
+            upgrade = self.upgrades.get(version)
+            if upgrade is not None:
+                son = upgrade(son)
+            version += 1
+        son[SCHEMA_VERSION_FIELD] = version
+        return son
+
     def __repr__(self):
         return "<Meta %s %r, %r>" % (self.model_name,
                                      self.verbose_name,
@@ -42,6 +234,15 @@ class _Meta(object):
 
 class DjangoDocumentMetaClass(DocumentProperties):
     def __new__(cls, name, bases, attrs):
+        declared = attrs.get('Meta')
+        schema_version = declared and getattr(declared, 'schema_version', None)
+        if schema_version is not None:
+            # new documents are saved with the version they're created in
+            attrs['structure'] = dict(attrs.get('structure') or {})
+            attrs['structure'][SCHEMA_VERSION_FIELD] = int
+            attrs['default_values'] = dict(attrs.get('default_values') or {})
+            attrs['default_values'][SCHEMA_VERSION_FIELD] = schema_version
+
         new_class = (super(DjangoDocumentMetaClass, cls)
                      .__new__(cls, name, bases, attrs))
 
@@ -63,7 +264,18 @@ class DjangoDocumentMetaClass(DocumentProperties):
         verbose_name_plural = (meta and
                                getattr(meta, 'verbose_name_plural', None)
                                or None)
-        meta = _Meta(name, verbose_name, verbose_name_plural)
+        options = {}
+        for option in ('indexes', 'schema_version', 'upgrades',
+                       'upgrade_write_back', 'cache_timeout', 'cache_alias',
+                       'count_cache_timeout'):
+            options[option] = meta and getattr(meta, option, None)
+            if options[option] is None:
+                # inherited from the document class this one extends
+                for base in bases:
+                    if getattr(base, '_meta', None):
+                        options[option] = getattr(base._meta, option)
+                        break
+        meta = _Meta(name, verbose_name, verbose_name_plural, **options)
 
         model_module = sys.modules[new_class.__module__]
         try:
@@ -72,15 +284,165 @@ class DjangoDocumentMetaClass(DocumentProperties):
             meta.app_label = model_module.__name__
 
         new_class._meta = meta
+        document_classes.append(new_class)
         return new_class
 
 
+class _UpgradeWriter(object):
+    """Collects documents that were upgraded when they were loaded and
+    writes them back in batches, at the latest when a request finishes."""
+
+    batch_size = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def add(self, collection, spec, son):
+        self.lock.acquire()
+        try:
+            self.pending.append((collection, spec, son))
+            full = len(self.pending) >= self.batch_size
+        finally:
+            self.lock.release()
+        if full:
+            self.flush()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            pending, self.pending = self.pending, []
+        finally:
+            self.lock.release()
+        by_collection = {}
+        for collection, spec, son in pending:
+            if collection.full_name not in by_collection:
+                by_collection[collection.full_name] = (collection, [])
+            by_collection[collection.full_name][1].append((spec, son))
+        for collection, replacements in by_collection.values():
+            _write_back(collection, replacements)
+
+
+def _write_back(collection, replacements):
+    """replace documents as long as they still match their spec"""
+    try:
+        bulk = collection.initialize_unordered_bulk_op()
+    except AttributeError:
+        # pymongo < 2.7
+        for spec, son in replacements:
+            collection.update(spec, son)
+        return
+    for spec, son in replacements:
+        bulk.find(spec).replace_one(son)
+    bulk.execute()
+
+
+_upgrade_writer = _UpgradeWriter()
+
+
+def flush_upgrades(**kwargs):
+    """write back the upgraded documents that are waiting to be"""
+    _upgrade_writer.flush()
+
+request_finished.connect(flush_upgrades)
+# e.g. management commands and the shell, which never finish a request
+atexit.register(flush_upgrades)
+
+
+class _Loader(object):
+    """Used as the `wrap` of cursors so that documents coming out of the
+    database know what they looked like when they were loaded and are
+    upgraded if they were saved with an older Meta.schema_version."""
+
+    def __init__(self, document_class, partial=False):
+        self.document_class = document_class
+        self.type_field = document_class.type_field
+        # only some of the fields were loaded
+        self.partial = partial
+        self.collection = None
+        # the documents of the result set that haven't loaded the rest of
+        # their fields yet
+        self.deferred = weakref.WeakValueDictionary()
+
+    def __call__(self, son, collection=None):
+        meta = self.document_class._meta
+        stored = None
+        if not self.partial and meta.needs_upgrade(son):
+            stored = deepcopy(son)
+            son = meta.upgrade(son)
+            if meta.upgrade_write_back is not None and collection is not None:
+                # unless someone else got there first
+                spec = {'_id': son['_id'],
+                        SCHEMA_VERSION_FIELD: stored.get(SCHEMA_VERSION_FIELD)}
+                if meta.upgrade_write_back == 'immediate':
+                    _write_back(collection, [(spec, son)])
+                    stored = None
+                else:
+                    _upgrade_writer.add(collection, spec, deepcopy(son))
+        document = self.document_class(son, collection=collection)
+        if self.partial and '_id' in son:
+            self.collection = collection
+            document._partial = self
+            if self.document_class.load_deferred == 'batch':
+                self.deferred[id(document)] = document
+        # until it's written back save() has to send the upgrade too
+        document._take_snapshot(stored)
+        return document
+
+    def load_deferred(self, document):
+        """fetch the fields `document` was loaded without and, with the same
+        query, the ones of the rest of its result set"""
+        documents = [document]
+        for other in self.deferred.values():
+            if len(documents) >= DEFERRED_BATCH_SIZE:
+                break
+            if other is not document and other._partial is self:
+                documents.append(other)
+        by_id = {}
+        for each in documents:
+            each._partial = None
+            self.deferred.pop(id(each), None)
+            by_id[each['_id']] = each
+
+        meta = self.document_class._meta
+        for son in self.collection.find({'_id': {'$in': by_id.keys()}}):
+            each = by_id[son['_id']]
+            stored = deepcopy(son)
+            if meta.needs_upgrade(son):
+                son = meta.upgrade(son)
+            loaded = self.document_class(son, collection=self.collection)
+            each._incomplete = _fill_lists(each, each._snapshot, loaded,
+                                           stored)
+            if each._snapshot is not None:
+                _fill(each._snapshot, stored)
+            _fill(each, loaded)
+
+
 class DjangoDocument(Document):
     class Meta:
         abstract = True
 
     __metaclass__ = DjangoDocumentMetaClass
 
+    # When True, loaded documents remember their original values so that
+    # save() can send a $set/$unset of just what changed. That's a deep
+    # copy of every document loaded, so it's off unless a class asks for
+    # it. Partially loaded documents always remember them.
+    track_changes = False
+    _snapshot = None
+
+    # Documents loaded with only() / defer() (or `fields`) fetch the fields
+    # they're missing the first time one is looked up: 'batch' does it for
+    # the whole result set with one query, 'instance' for just the one.
+    load_deferred = 'batch'
+    # the _Loader that can fetch the rest of a partially loaded document
+    _partial = None
+    # the lists that were only partly loaded and have changed since, which
+    # can't be saved without losing the rest of them
+    _incomplete = ()
+
+    objects = Manager()
+
     ## XX Are these needed?
     def _get_pk_val(self, meta=None):
         if not meta:
@@ -92,17 +454,442 @@ class DjangoDocument(Document):
 
     pk = property(_get_pk_val, _set_pk_val)
 
+    def _get_size_limit(self):
+        try:
+            return _size_limits[self.connection]
+        except KeyError:
+            size_limit = super(DjangoDocument, self)._get_size_limit()
+            _size_limits[self.connection] = size_limit
+            return size_limit
+
+    def __missing__(self, key):
+        if self._partial is None:
+            raise KeyError(key)
+        self._partial.load_deferred(self)
+        return self[key]
+
+    def __getattr__(self, key):
+        if (self._partial is not None and self.use_dot_notation and
+            key in self.structure and key not in self):
+            self._partial.load_deferred(self)
+        return super(DjangoDocument, self).__getattr__(key)
+
+    def get(self, key, default=None):
+        if self._partial is not None and key not in self:
+            self._partial.load_deferred(self)
+        return super(DjangoDocument, self).get(key, default)
+
+    def find(self, *args, **kwargs):
+        partial = bool(kwargs.get('fields', args[1:2] and args[1]))
+        return self.collection.find(wrap=_Loader(self._obj_class, partial),
+                                    *args, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        _id = _id_lookup(args, kwargs)
+        if _id is not None:
+            if (self._meta.cache_timeout is not None or
+                identity_map.active):
+                return self._get_by_id(_id)
+            args = ({'_id': _id},)
+        partial = bool(kwargs.get('fields', args[1:2] and args[1]))
+        return self.collection.find_one(wrap=_Loader(self._obj_class,
+                                                     partial),
+                                        *args, **kwargs)
+
+    def one(self, *args, **kwargs):
+        _id = _id_lookup(args, kwargs)
+        if _id is not None:
+            if (self._meta.cache_timeout is not None or
+                identity_map.active):
+                return self._get_by_id(_id)
+            args = ({'_id': _id},)
+        return super(DjangoDocument, self).one(*args, **kwargs)
+
+    def _get_by_id(self, _id):
+        # from the identity map, the cache or the database
+        collection = self.collection
+        if identity_map.active:
+            document = identity_map.get(collection, _id)
+            # another class can be stored in the same collection
+            if isinstance(document, self._obj_class):
+                return document
+        if self._meta.cache_timeout is not None:
+            document = self.get_cached(_id)
+        else:
+            document = collection.find_one({'_id': _id},
+                                           wrap=_Loader(self._obj_class))
+        if document is not None and identity_map.active:
+            identity_map.add(collection, document)
+        return document
+
+    def get_cached(self, _id):
+        """
+        Load a document by `_id` (or its string version) through Django's
+        cache for `Meta.cache_timeout` seconds. Returns None if there's no
+        such document. `find_one()` and `one()` use it when given nothing
+        but an `_id` (and the document isn't in the identity map).
+        """
+        _id = _to_object_id(_id)
+        collection = self.collection
+
+        def load():
+            son = collection.find_one({'_id': _id})
+            if son is None:
+                return None
+            return bson.BSON.encode(son)
+
+        data = get_or_load(get_cache(self._meta.cache_alias),
+                           cache_key(collection, _id), load,
+                           self._meta.cache_timeout)
+        if data is None:
+            return None
+        tz_aware = getattr(collection.database.connection, 'tz_aware', False)
+        son = bson.BSON(data).decode(tz_aware=tz_aware)
+        return _Loader(self._obj_class)(son, collection=collection)
+
+    def aggregate(self):
+        """
+        Start building an aggregation pipeline on the collection::
+
+            from django_mongokit.aggregation import Sum
+            collection.Talk.aggregate().unwind('tags').group('tags',
+                                                             talks=Sum(1))
+
+        See `django_mongokit.aggregation.Aggregation`.
+        """
+        return Aggregation(self)
+
+    def estimated_count(self):
+        """
+        The number of documents in the collection as its metadata has it,
+        without counting them. It can be off after an unclean shutdown or,
+        on sharded clusters, while chunks are migrating.
+        """
+        collection = self.collection
+        try:
+            stats = collection.database.command('collstats', collection.name)
+        except OperationFailure, exception:
+            if 'ns not found' not in str(exception):
+                raise
+            # the collection hasn't been created yet
+            return 0
+        return int(stats['count'])
+
+    def _cached_ids(self, spec):
+        # before writes that don't send signals: the ids of the documents
+        # that will have to be taken out of the cache and the identity map
+        # afterwards
+        if self._meta.cache_timeout is None and not identity_map.active:
+            return []
+        return [each['_id'] for each in
+                self.collection.find(spec, fields=['_id'])]
+
+    def _invalidate_cache(self, ids):
+        # after writes that don't send signals
+        cache = get_cache(self._meta.cache_alias)
+        if self._meta.count_cache_timeout is not None:
+            invalidate_counts(cache, self.collection)
+        if ids and self._meta.cache_timeout is not None:
+            invalidate_documents(cache, self.collection, ids)
+        if identity_map.active:
+            for _id in ids:
+                identity_map.discard(self.collection, _id)
+
+    def _take_snapshot(self, stored=None):
+        # Remember what the document looked like in the database so that
+        # save() only has to send what changed.
+        if ((self.track_changes or self._partial is not None) and
+            self.get('_id') is not None):
+            self._snapshot = deepcopy(dict(stored or self))
+        else:
+            self._snapshot = None
+
+    def _get_changed_paths(self):
+        """return a tuple of (changed, removed) dotted paths since the
+        document was loaded or last saved or None if the whole document needs
+        to be written"""
+        if (self._snapshot is None or self.use_autorefs or
+            self._snapshot.get('_id') != self.get('_id')):
+            return None
+        return _changed_paths(self._snapshot, self)
+
+    def _get_update_document(self, paths):
+        changed, removed = paths
+        document = {}
+        if changed:
+            document['$set'] = dict((path, _get_path(self, path))
+                                    for path in changed)
+        if removed:
+            document['$unset'] = dict((path, 1) for path in removed)
+        return document
+
+    def reload(self):
+        super(DjangoDocument, self).reload()
+        self._partial = None
+        self._incomplete = ()
+        self._take_snapshot()
+
     def delete(self):
         signals.pre_delete.send(sender=self.__class__, instance=self)
         super(DjangoDocument, self).delete()
+        # if saved again it has to be written in full
+        self._snapshot = None
         signals.post_delete.send(sender=self.__class__, instance=self)
 
     def save(self, *args, **kwargs):
+        if self._partial is not None:
+            # validated and, without a snapshot, written in full
+            self._partial.load_deferred(self)
+        self._check_complete()
         signals.pre_save.send(sender=self.__class__, instance=self)
 
         _id_before = '_id' in self and self['_id'] or None
-        super(DjangoDocument, self).save(*args, **kwargs)
+        if self._snapshot is not None:
+            self._save_changes(*args, **kwargs)
+        else:
+            super(DjangoDocument, self).save(*args, **kwargs)
+        self._take_snapshot()
         _id_after = '_id' in self and self['_id'] or None
 
         signals.post_save.send(sender=self.__class__, instance=self,
                                created=bool(not _id_before and _id_after))
+
+    def _check_complete(self):
+        if self._incomplete:
+            raise ValueError("%s only had some of their fields loaded and "
+                             "were changed, saving would lose the rest" %
+                             ", ".join(sorted(self._incomplete)))
+
+    def _save_changes(self, uuid=False, validate=None, safe=True, **kwargs):
+        if validate is True or (validate is None and
+                                self.skip_validation is False):
+            self.validate(auto_migrate=False)
+        paths = self._get_changed_paths()
+        if paths is None:
+            super(DjangoDocument, self).save(uuid=uuid, validate=False,
+                                             safe=safe, **kwargs)
+            return
+        if not (paths[0] or paths[1]):
+            # nothing to do
+            return
+        self._process_custom_type('bson', self, self.structure)
+        try:
+            self.collection.update({'_id': self['_id']},
+                                   self._get_update_document(paths),
+                                   safe=safe, **kwargs)
+        finally:
+            self._process_custom_type('python', self, self.structure)
+
+    def bulk_save(self, documents, batch_size=1000, validate=None,
+                  safe=True):
+        """
+        Save many documents with as few round trips as possible.
+
+        Use it through the collection just like `find()`::
+
+            collection.Talk.bulk_save(talks, batch_size=500)
+
+        Every document is validated before anything is written. New
+        documents are inserted in batches of `batch_size` and documents that
+        already have an `_id` are updated in batches with only what changed.
+        The `pre_save` and `post_save` signals are still sent for every
+        document, right before and after its batch is written, and `created`
+        is only True for the ones that were inserted.
+        """
+        documents = list(documents)
+        for document in documents:
+            if document._partial is not None:
+                document._partial.load_deferred(document)
+            document._check_complete()
+        for document in documents:
+            if validate is True or (validate is None and
+                                    document.skip_validation is False):
+                document.validate(auto_migrate=False)
+
+        new_documents = []
+        updates = []
+        for document in documents:
+            if document.get('_id'):
+                updates.append(document)
+            else:
+                if '_id' in document:
+                    # let the driver generate it
+                    del document['_id']
+                new_documents.append(document)
+
+        for batch in _chunked(new_documents, batch_size):
+            self._save_batch(batch, True, safe=safe)
+        for batch in _chunked(updates, batch_size):
+            self._save_batch(batch, False, safe=safe)
+
+    def _save_batch(self, documents, created, safe=True):
+        # inserts new documents or updates saved ones with the signals
+        # around them
+        for document in documents:
+            signals.pre_save.send(sender=document.__class__,
+                                  instance=document)
+        if not created:
+            # after pre_save as receivers can change the documents
+            updates = [(document, document._get_changed_paths())
+                       for document in documents]
+        for document in documents:
+            document._process_custom_type('bson', document,
+                                          document.structure)
+        try:
+            if created:
+                self.collection.insert(documents, safe=safe)
+            else:
+                self._bulk_update(updates, safe=safe)
+        finally:
+            for document in documents:
+                document._process_custom_type('python', document,
+                                              document.structure)
+
+        for document in documents:
+            document._take_snapshot()
+            signals.post_save.send(sender=document.__class__,
+                                   instance=document, created=created)
+
+    def _bulk_update(self, updates, safe=True):
+        """`updates` is a list of (document, changed paths) where the paths
+        are None if the whole document needs to be written"""
+        try:
+            bulk = self.collection.initialize_ordered_bulk_op()
+        except AttributeError:
+            # pymongo < 2.7
+            bulk = None
+        operations = 0
+        for document, paths in updates:
+            if paths is None:
+                if bulk is None:
+                    self.collection.save(document, safe=safe)
+                else:
+                    (bulk.find({'_id': document['_id']})
+                     .upsert()
+                     .replace_one(document))
+                    operations += 1
+            elif paths[0] or paths[1]:
+                update = document._get_update_document(paths)
+                if bulk is None:
+                    self.collection.update({'_id': document['_id']}, update,
+                                           safe=safe)
+                else:
+                    bulk.find({'_id': document['_id']}).update_one(update)
+                    operations += 1
+        if not operations:
+            return
+        if safe:
+            bulk.execute()
+        else:
+            bulk.execute({'w': 0})
+
+    def get_many(self, ids, chunk_size=1000):
+        """
+        Fetch lots of documents by id with one `$in` query per `chunk_size`
+        ids. Ids can be ObjectIds or strings like the ones `pk` returns.
+
+        Returns a tuple of the documents, in the same order as `ids`, and a
+        list of the ids that weren't found::
+
+            talks, missing = collection.Talk.get_many(ids)
+        """
+        ids = list(ids)
+        object_ids = [_to_object_id(id_) for id_ in ids]
+        unique_ids = []
+        seen = set()
+        for object_id in object_ids:
+            if object_id not in seen:
+                seen.add(object_id)
+                unique_ids.append(object_id)
+
+        found = {}
+        for chunk in _chunked(unique_ids, chunk_size):
+            for document in self.find({'_id': {'$in': chunk}}):
+                found[document['_id']] = document
+
+        documents = []
+        missing = []
+        for id_, object_id in zip(ids, object_ids):
+            if object_id in found:
+                documents.append(found[object_id])
+            else:
+                missing.append(id_)
+        return documents, missing
+
+    def delete_where(self, spec, send_signals=False, chunk_size=1000):
+        """
+        Delete every document matching `spec` on the server without loading
+        them first. Returns the number of documents deleted (or None if the
+        write wasn't acknowledged).
+
+        Signals aren't sent unless `send_signals` is True. If they are, the
+        `pre_delete` and `post_delete` receivers get documents that only
+        have their `_id` loaded. Looking up any other field fetches the
+        rest, for up to DEFERRED_BATCH_SIZE of them at once, with one more
+        query.
+        """
+        if not send_signals:
+            ids = self._cached_ids(spec)
+            deleted = _affected(self.collection.remove(spec))
+            self._invalidate_cache(ids)
+            return deleted
+
+        deleted = 0
+        # read all the ids before writing so the cursor isn't affected
+        found = list(self.find(spec, fields=['_id']))
+        for instances in _chunked(found, chunk_size):
+            for instance in instances:
+                signals.pre_delete.send(sender=self._obj_class,
+                                        instance=instance)
+            result = self.collection.remove(_for_instances(spec, instances))
+            if deleted is not None:
+                deleted = _affected(result, deleted)
+            for instance in instances:
+                instance._snapshot = None
+                signals.post_delete.send(sender=self._obj_class,
+                                         instance=instance)
+        return deleted
+
+    def update_where(self, spec, changes, send_signals=False,
+                     chunk_size=1000):
+        """
+        Apply `changes` to every document matching `spec` on the server
+        without loading them first. `changes` is a MongoDB update document
+        like `{'$inc': {'views': 1}}`. A plain dict of values is treated as
+        a `$set` so documents never get replaced by accident. Returns the
+        number of documents updated (or None if the write wasn't
+        acknowledged).
+
+        Signals aren't sent unless `send_signals` is True. If they are, the
+        `pre_save` and `post_save` receivers get documents that only have
+        their `_id` loaded and `created` is always False. Looking up any
+        other field fetches the rest, for up to DEFERRED_BATCH_SIZE of them
+        at once, with one more query. They're fetched as they are at that
+        moment, so they can be from before or after the update.
+        """
+        if not [key for key in changes if key.startswith('$')]:
+            changes = {'$set': changes}
+
+        if not send_signals:
+            ids = self._cached_ids(spec)
+            updated = _affected(self.collection.update(spec, changes,
+                                                       multi=True))
+            self._invalidate_cache(ids)
+            return updated
+
+        updated = 0
+        # read all the ids before writing so updated documents that move
+        # don't come back out of the cursor
+        found = list(self.find(spec, fields=['_id']))
+        for instances in _chunked(found, chunk_size):
+            for instance in instances:
+                signals.pre_save.send(sender=self._obj_class,
+                                      instance=instance)
+            result = self.collection.update(_for_instances(spec, instances),
+                                            changes, multi=True)
+            if updated is not None:
+                updated = _affected(result, updated)
+            for instance in instances:
+                signals.post_save.send(sender=self._obj_class,
+                                       instance=instance, created=False)
+        return updated
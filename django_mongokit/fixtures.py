@@ -0,0 +1,157 @@
+"""
+Dumping and loading the collections of DjangoDocument classes as JSON
+Lines, one document per line:
+
+    {"model": "exampleapp.Talk", "document": {"_id": {"$oid": "4b87..."}}}
+
+ObjectIds, datetimes and the other BSON types are written the way
+bson.json_util does so they load back as they were. Only one batch of
+documents is held in memory at a time, however big the collection.
+"""
+
+import gzip
+import json
+
+from bson import json_util
+from bson.son import SON
+
+from document import document_classes as all_document_classes
+from indexes import get_collection
+
+BATCH_SIZE = 1000
+
+
+def document_label(document_class):
+    """e.g. 'exampleapp.Talk'"""
+    return '%s.%s' % (document_class._meta.app_label,
+                      document_class.__name__)
+
+
+def get_document_classes(labels=None):
+    """the DjangoDocument classes with a collection that `labels`, like
+    'exampleapp' or 'exampleapp.Talk', refer to or all of them if there are
+    no labels. Raises LookupError for labels that don't match anything."""
+    document_classes = [
+        document_class for document_class in all_document_classes
+        if get_collection(document_class) is not None
+    ]
+    if not labels:
+        return document_classes
+    found = []
+    for label in labels:
+        app_label, __, name = label.partition('.')
+        matching = [
+            document_class for document_class in document_classes
+            if document_class._meta.app_label == app_label and
+            (not name or document_class.__name__.lower() == name.lower())
+        ]
+        if not matching:
+            raise LookupError("No document with a collection matches %r" %
+                              label)
+        for document_class in matching:
+            if document_class not in found:
+                found.append(document_class)
+    return found
+
+
+def open_file(filename, mode='rb'):
+    """open `filename`, through gzip if it ends with .gz"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+def _decode(pairs):
+    # keeps the order of the keys
+    return json_util.object_hook(SON(pairs))
+
+
+try:
+    json.loads('{}', object_pairs_hook=SON)
+    _ordered_json = True
+except TypeError:
+    # Python 2.6's json can't keep the order of the keys
+    _ordered_json = False
+
+
+def _loads(text):
+    if _ordered_json:
+        return json.loads(text, object_pairs_hook=_decode)
+    return json.loads(text, object_hook=json_util.object_hook)
+
+
+def dump_documents(document_classes, stream, batch_size=BATCH_SIZE):
+    """write all the documents of `document_classes` to `stream` and return
+    a list of (label, count). Classes that share a collection with one
+    that came before are skipped."""
+    counts = []
+    dumped = set()
+    for document_class in document_classes:
+        collection = get_collection(document_class)
+        if collection.full_name in dumped:
+            continue
+        dumped.add(collection.full_name)
+        label = document_label(document_class)
+        count = 0
+        for document in collection.find(batch_size=batch_size).sort('_id'):
+            stream.write(json.dumps({'model': label, 'document': document},
+                                    default=json_util.default,
+                                    separators=(',', ':')))
+            stream.write('\n')
+            count += 1
+        counts.append((label, count))
+    return counts
+
+
+def load_documents(stream, batch_size=BATCH_SIZE):
+    """insert the documents dump_documents() wrote to `stream`, in batches,
+    replacing any with the same `_id`, and return a list of
+    (label, count)"""
+    labels = []
+    counts = {}
+    collections = {}
+    batch = []
+    batch_label = None
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        record = _loads(line)
+        label = record['model']
+        if label != batch_label or len(batch) >= batch_size:
+            if batch:
+                _replace(collections[batch_label], batch)
+                batch = []
+            batch_label = label
+        if label not in collections:
+            document_class = get_document_classes([label])[0]
+            collections[label] = get_collection(document_class)
+            labels.append(label)
+            counts[label] = 0
+        batch.append(record['document'])
+        counts[label] += 1
+    if batch:
+        _replace(collections[batch_label], batch)
+    return [(each, counts[each]) for each in labels]
+
+
+def _replace(collection, documents):
+    # every document is upserted on its own so that one that fails can't
+    # take the one it was replacing with it
+    try:
+        bulk = collection.initialize_unordered_bulk_op()
+    except AttributeError:
+        # pymongo < 2.7
+        bulk = None
+    operations = 0
+    for document in documents:
+        if '_id' not in document:
+            collection.insert(document, manipulate=False)
+        elif bulk is None:
+            collection.update({'_id': document['_id']}, document,
+                              upsert=True)
+        else:
+            bulk.find({'_id': document['_id']}).upsert().replace_one(document)
+            operations += 1
+    if operations:
+        bulk.execute()
@@ -6,6 +6,7 @@ from django.utils.datastructures import SortedDict
 from django.forms.util import ErrorList
 from django.forms.forms import BaseForm, get_declared_fields
 
+from django_mongokit.document import SCHEMA_VERSION_FIELD
 from fields import JsonField, JsonListField
 
 
@@ -135,9 +136,14 @@ def fields_for_document(document, fields=None, exclude=None,
     """
     field_list = []
     structure = document.structure
+    # the version of Meta.schema_version isn't for people to edit
+    versioned = getattr(getattr(document, '_meta', None), 'schema_version',
+                        None) is not None
     for field_name, field_type in structure.items():
         if fields and not field_name in fields:
             continue
+        if versioned and field_name == SCHEMA_VERSION_FIELD:
+            continue
         if exclude and field_name in exclude:
             continue
 
@@ -0,0 +1,53 @@
+"""
+A per thread identity map of documents loaded by `_id`, switched on for
+the length of each request by IdentityMapMiddleware.
+
+While it's active `one({'_id': ...})`, `find_one(_id)` and
+`get_from_id(_id)` return the document that was already loaded, the same
+instance, instead of loading it again.
+"""
+
+import threading
+
+from django.db.models import signals
+
+
+class IdentityMap(threading.local):
+
+    active = False
+
+    def __init__(self):
+        self.documents = {}
+
+    def start(self):
+        self.documents = {}
+        self.active = True
+
+    def stop(self):
+        self.documents = {}
+        self.active = False
+
+    def get(self, collection, _id):
+        return self.documents.get((collection.full_name, _id))
+
+    def add(self, collection, document):
+        self.documents[(collection.full_name, document['_id'])] = document
+
+    def discard(self, collection, _id):
+        self.documents.pop((collection.full_name, _id), None)
+
+
+identity_map = IdentityMap()
+
+
+def _forget_deleted(sender, instance, **kwargs):
+    if not identity_map.active:
+        return
+    collection = getattr(instance, 'collection', None)
+    if collection is not None and instance.get('_id') is not None:
+        identity_map.discard(collection, instance['_id'])
+
+signals.post_delete.connect(
+    _forget_deleted,
+    dispatch_uid='django_mongokit.identity._forget_deleted'
+)
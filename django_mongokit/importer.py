@@ -0,0 +1,306 @@
+"""
+Importing rows from CSV or JSON Lines files into the collection of a
+DjangoDocument class. See `./manage.py mongo_import`.
+
+Every value is converted to the type the document's `structure` asks
+for, e.g. "2010-03-01 18:30" to a datetime or "python, django" to
+`[u"python", u"django"]` for a `[unicode]`. Rows that can't be converted
+or don't validate are rejected and the others inserted in batches. With
+a `concurrency` above 1 the batches are converted, validated and
+inserted by that many worker processes.
+"""
+
+import csv
+import datetime
+import multiprocessing
+from collections import deque
+
+from bson.errors import InvalidId
+from pymongo.errors import OperationFailure
+
+try:
+    from django.utils.dateparse import parse_date, parse_datetime
+except ImportError:
+    # Django < 1.4, without time zone offsets
+    DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                        '%Y-%m-%d %H:%M')
+
+    def parse_datetime(value):
+        value = value.strip().replace('T', ' ', 1)
+        for format in DATETIME_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, format)
+            except ValueError:
+                pass
+        return None
+
+    def parse_date(value):
+        try:
+            return datetime.datetime.strptime(value.strip(),
+                                              '%Y-%m-%d').date()
+        except ValueError:
+            return None
+
+from document import _chunked
+from fixtures import _loads
+from indexes import get_collection
+from shortcut import connection
+
+BATCH_SIZE = 1000
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'on')
+FALSE_VALUES = ('0', 'false', 'f', 'no', 'n', 'off')
+
+
+def _parse_datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed = parse_date(value)
+        if parsed is not None:
+            parsed = datetime.datetime(parsed.year, parsed.month, parsed.day)
+    if parsed is None:
+        raise ValueError("%r isn't a date" % value)
+    return parsed
+
+
+def coerce_value(value, type_, list_separator=','):
+    """convert `value`, a string from a CSV file or anything from JSON, to
+    `type_` from a structure. Raises ValueError if it can't be done."""
+    if isinstance(type_, dict):
+        if isinstance(value, basestring):
+            value = _loads(value)
+        if not isinstance(value, dict):
+            raise ValueError("%r isn't an embedded document" % (value,))
+        return coerce_document(value, type_, list_separator)
+    if isinstance(type_, list):
+        if isinstance(value, basestring):
+            if value.startswith('['):
+                value = _loads(value)
+            elif value:
+                value = [each.strip() for each in value.split(list_separator)]
+            else:
+                value = []
+        if not isinstance(value, (list, tuple)):
+            raise ValueError("%r isn't a list" % (value,))
+        if not type_:
+            return list(value)
+        return [coerce_value(each, type_[0], list_separator)
+                for each in value]
+    if not isinstance(type_, type):
+        # e.g. custom types or OR(); left for validation
+        return value
+
+    if isinstance(value, type_) and not (isinstance(value, bool) and
+                                         type_ is not bool):
+        return value
+    if type_ in (unicode, basestring):
+        if isinstance(value, str):
+            return value.decode('utf-8')
+        return unicode(value)
+    if type_ is bool:
+        if isinstance(value, basestring):
+            if value.strip().lower() in TRUE_VALUES:
+                return True
+            if value.strip().lower() in FALSE_VALUES:
+                return False
+            raise ValueError("%r isn't a boolean" % value)
+        return bool(value)
+    if type_ in (int, long):
+        if isinstance(value, float) and value != int(value):
+            raise ValueError("%r isn't a whole number" % value)
+        return type_(value)
+    if type_ is datetime.datetime:
+        if isinstance(value, datetime.date):
+            return datetime.datetime(value.year, value.month, value.day)
+        return _parse_datetime(value)
+    return type_(value)
+
+
+def coerce_document(row, structure, list_separator=','):
+    """convert the values of `row` that are in `structure`. Empty values
+    are left out so that default values and required fields apply."""
+    document = {}
+    for key, value in row.items():
+        if value is None or value == '':
+            continue
+        if key in structure:
+            try:
+                value = coerce_value(value, structure[key], list_separator)
+            except (ValueError, TypeError, InvalidId), exception:
+                raise ValueError("%s: %s" % (key, exception))
+        document[key] = value
+    return document
+
+
+def _nest(row):
+    # 'author.name' columns become {'author': {'name': ...}}
+    nested = {}
+    for key, value in row.items():
+        parts = key.split('.')
+        container = nested
+        for part in parts[:-1]:
+            container = container.setdefault(part, {})
+            if not isinstance(container, dict):
+                raise ValueError("%s is both a value and a document" % part)
+        container[parts[-1]] = value
+    return nested
+
+
+def _merge(document, values):
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            _merge(document[key], value)
+        else:
+            document[key] = value
+
+
+def read_rows(stream, format):
+    """yield (line number, raw row) for every row of `stream`. For CSV the
+    raw row is a list of cells, the first one being the header, and for
+    JSON Lines it's the line itself."""
+    if format == 'csv':
+        reader = csv.reader(stream)
+        for cells in reader:
+            yield reader.line_num, cells
+    else:
+        number = 0
+        for line in stream:
+            number += 1
+            if line.strip():
+                yield number, line
+
+
+class Importer(object):
+    """converts, validates and inserts batches of raw rows into the
+    collection of `document_class`"""
+
+    def __init__(self, document_class, format, header=None,
+                 list_separator=','):
+        if format == 'csv' and not header:
+            raise ValueError("CSV files need a header")
+        self.document_class = document_class
+        self.format = format
+        if header:
+            self.header = [column.decode('utf-8').strip()
+                           for column in header]
+        self.list_separator = list_separator
+
+    def parse(self, raw):
+        if self.format == 'csv':
+            if len(raw) != len(self.header):
+                raise ValueError("Expected %d columns, not %d" %
+                                 (len(self.header), len(raw)))
+            row = _nest(dict(zip(self.header,
+                                 [cell.decode('utf-8') for cell in raw])))
+        else:
+            row = _loads(raw)
+            if not isinstance(row, dict):
+                raise ValueError("Not a JSON object")
+        return coerce_document(row, self.document_class.structure,
+                               self.list_separator)
+
+    def import_batch(self, batch):
+        """import a list of (line number, raw row) and return
+        (imported, rejected) where `rejected` is a list of
+        (line number, error, raw row)"""
+        # looked up every time as worker processes connect again
+        collection = get_collection(self.document_class)
+        name = self.document_class.__name__
+        if name not in connection._registered_documents:
+            connection.register([self.document_class])
+        document_factory = getattr(collection, name)
+
+        documents = []
+        rows = []
+        rejected = []
+        for line, raw in batch:
+            try:
+                # starts with the skeleton and default values
+                document = document_factory()
+                _merge(document, self.parse(raw))
+                document.validate(auto_migrate=False)
+            except Exception, exception:
+                # mongokit has lots of kinds of validation errors
+                rejected.append((line, '%s: %s' % (
+                    exception.__class__.__name__, exception), raw))
+                continue
+            document._process_custom_type('bson', document,
+                                          document.structure)
+            documents.append(document)
+            rows.append((line, raw))
+        # rows with an _id that's already taken, in the collection or by an
+        # earlier row, are rejected up front so that looking for the _ids
+        # after a failure tells which rows were inserted
+        taken = set(each['_id'] for each in collection.find(
+            {'_id': {'$in': [document['_id'] for document in documents
+                             if '_id' in document]}},
+            fields=['_id']
+        ))
+        unique = []
+        for document, (line, raw) in zip(documents, rows):
+            if '_id' in document:
+                if document['_id'] in taken:
+                    rejected.append((line, "DuplicateKeyError: _id %r "
+                                     "already exists" % (document['_id'],),
+                                     raw))
+                    continue
+                taken.add(document['_id'])
+            unique.append((document, (line, raw)))
+        documents = [document for document, _ in unique]
+        rows = [row for _, row in unique]
+        if not documents:
+            return 0, rejected
+
+        try:
+            collection.insert(documents, continue_on_error=True)
+        except OperationFailure, exception:
+            # e.g. duplicate keys, the rest were still inserted
+            inserted = set(each['_id'] for each in collection.find(
+                {'_id': {'$in': [document['_id'] for document in documents]}},
+                fields=['_id']
+            ))
+            failed = [(line, '%s: %s' % (exception.__class__.__name__,
+                                         exception), raw)
+                      for each, (line, raw) in zip(documents, rows)
+                      if each['_id'] not in inserted]
+            return len(documents) - len(failed), rejected + failed
+        return len(documents), rejected
+
+
+_worker_importer = None
+
+
+def _init_worker(importer):
+    global _worker_importer
+    _worker_importer = importer
+
+
+def _import_batch(batch):
+    return _worker_importer.import_batch(batch)
+
+
+def run_import(importer, rows, batch_size=BATCH_SIZE, concurrency=1):
+    """import `rows` (as returned by read_rows()) in batches and yield
+    (imported, rejected) for each batch as it's done"""
+    batches = _chunked(rows, batch_size)
+    if concurrency <= 1:
+        for batch in batches:
+            yield importer.import_batch(batch)
+        return
+
+    pool = multiprocessing.Pool(concurrency, _init_worker, (importer,))
+    try:
+        # only a few batches are read ahead so memory use stays flat
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_import_batch, (batch,)))
+            if len(pending) > concurrency * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    pool.join()
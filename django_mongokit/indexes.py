@@ -0,0 +1,169 @@
+"""
+Indexes declared on DjangoDocument classes and keeping the server in sync
+with them.
+
+    class Talk(DjangoDocument):
+        collection_name = 'talks'
+        class Meta:
+            indexes = [
+                {'fields': ['-when', '-_id']},
+                {'fields': ['slug'], 'unique': True},
+                {'fields': ['speaker.email'], 'sparse': True},
+                {'fields': ['created'], 'ttl': 60 * 60 * 24},
+            ]
+
+Fields are ordered like `order_by()`, a leading '-' meaning descending.
+Run `./manage.py sync_mongo_indexes` to create the indexes that are missing
+and drop the ones that are no longer declared.
+"""
+
+from pymongo import ASCENDING, DESCENDING
+
+from shortcut import connection, get_database
+
+# options that make two indexes on the same key different
+INDEX_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds')
+
+
+def _key(fields):
+    key = []
+    if isinstance(fields, basestring):
+        fields = [fields]
+    for field in fields:
+        if isinstance(field, (list, tuple)):
+            field, direction = field
+        elif field.startswith('-'):
+            field, direction = field[1:], DESCENDING
+        else:
+            direction = ASCENDING
+        key.append((field, direction))
+    return key
+
+
+def _direction(direction):
+    # the server can return 1.0 for 1 and there are also e.g. '2d' indexes
+    if isinstance(direction, (int, long, float)):
+        return int(direction)
+    return direction
+
+
+def index_name(key):
+    """the name MongoDB gives an index by default, e.g. 'when_-1__id_-1'"""
+    return '_'.join('%s_%s' % (field, direction) for field, direction in key)
+
+
+def normalize_index(declaration):
+    """turn one item of `Meta.indexes` into a dict of 'key', 'name',
+    'unique', 'sparse' and 'expireAfterSeconds'"""
+    if not isinstance(declaration, dict):
+        declaration = {'fields': declaration}
+    # an already normalized index has a 'key' instead
+    key = _key(declaration.get('fields', declaration.get('key')) or [])
+    if not key:
+        raise ValueError("An index needs at least one field")
+    ttl = declaration.get('ttl', declaration.get('expireAfterSeconds'))
+    if ttl is not None and len(key) > 1:
+        raise ValueError("TTL indexes can only have one field")
+    return {
+        'key': key,
+        'name': declaration.get('name') or index_name(key),
+        'unique': bool(declaration.get('unique', False)),
+        'sparse': bool(declaration.get('sparse', False)),
+        'expireAfterSeconds': ttl,
+    }
+
+
+def _signature(index):
+    key = tuple((field, _direction(direction))
+                for field, direction in index['key'])
+    options = []
+    for option in INDEX_OPTIONS:
+        value = index.get(option)
+        if option == 'expireAfterSeconds' and value is not None:
+            value = int(value)
+        elif option != 'expireAfterSeconds':
+            value = bool(value)
+        options.append(value)
+    return (key,) + tuple(options)
+
+
+def get_collection(document_class):
+    """the collection a DjangoDocument class is stored in or None if it
+    doesn't have a `collection_name` (or `__collection__`)"""
+    collection_name = (getattr(document_class, '__collection__', None) or
+                       getattr(document_class, 'collection_name', None))
+    if not collection_name:
+        return None
+    database_name = getattr(document_class, '__database__', None)
+    if database_name:
+        return connection[database_name][collection_name]
+    return get_database()[collection_name]
+
+
+def declared_indexes(document_classes):
+    """return a list of (collection, [index, ...]) for all the collections
+    that some of `document_classes` declare indexes for"""
+    by_collection = {}
+    for document_class in document_classes:
+        indexes = document_class._meta.indexes
+        if not indexes:
+            continue
+        collection = get_collection(document_class)
+        if collection is None:
+            continue
+        full_name = collection.full_name
+        if full_name not in by_collection:
+            by_collection[full_name] = (collection, [])
+        declared = by_collection[full_name][1]
+        for index in indexes:
+            if _signature(index) not in [_signature(i) for i in declared]:
+                declared.append(index)
+    return [by_collection[name] for name in sorted(by_collection)]
+
+
+def server_indexes(collection):
+    """the indexes on the server in the same form as normalize_index()"""
+    indexes = []
+    for name, info in collection.index_information().items():
+        if name == '_id_':
+            continue
+        indexes.append({
+            'key': [(field, _direction(direction))
+                    for field, direction in info['key']],
+            'name': name,
+            'unique': bool(info.get('unique', False)),
+            'sparse': bool(info.get('sparse', False)),
+            'expireAfterSeconds': info.get('expireAfterSeconds'),
+        })
+    return indexes
+
+
+def plan_indexes(collection, declared):
+    """return (to_create, to_drop). An index that exists with other
+    options is dropped and created again."""
+    existing = server_indexes(collection)
+    existing_signatures = [_signature(index) for index in existing]
+    declared_signatures = [_signature(index) for index in declared]
+    to_create = [index for index in declared
+                 if _signature(index) not in existing_signatures]
+    to_drop = [index for index in existing
+               if _signature(index) not in declared_signatures]
+    return to_create, to_drop
+
+
+def create_index(collection, index):
+    options = {
+        'name': index['name'],
+        'background': True,
+    }
+    if index['unique']:
+        options['unique'] = True
+    if index['sparse']:
+        options['sparse'] = True
+    if index['expireAfterSeconds'] is not None:
+        options['expireAfterSeconds'] = index['expireAfterSeconds']
+    return collection.create_index(index['key'], **options)
+
+
+def drop_index(collection, index):
+    collection.drop_index(index['name'])
@@ -0,0 +1,63 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_mongokit.fixtures import (
+    BATCH_SIZE,
+    dump_documents,
+    get_document_classes,
+    open_file,
+)
+
+
+class Command(BaseCommand):
+    help = ("Writes the documents of DjangoDocument collections as JSON "
+            "Lines that mongo_loaddata can load. Without labels all the "
+            "collections are dumped.")
+    args = '[app_label[.DocumentName] ...]'
+
+    # Django < 1.8
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('-o', '--output', dest='output', default=None,
+                    help="Write to this file instead of stdout, gzipped if "
+                         "it ends with .gz"),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=BATCH_SIZE,
+                    help="How many documents to read at a time"),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('args', metavar='app_label[.DocumentName]',
+                            nargs='*')
+        parser.add_argument('-o', '--output', dest='output', default=None,
+                            help="Write to this file instead of stdout, "
+                                 "gzipped if it ends with .gz")
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=BATCH_SIZE,
+                            help="How many documents to read at a time")
+
+    def handle(self, *labels, **options):
+        verbosity = int(options.get('verbosity', 1))
+        try:
+            document_classes = get_document_classes(labels)
+        except LookupError, exception:
+            raise CommandError(str(exception))
+
+        stdout = getattr(self, 'stdout', sys.stdout)
+        output = options.get('output')
+        if output:
+            stream = open_file(output, 'wb')
+        else:
+            stream = stdout
+        try:
+            counts = dump_documents(document_classes, stream,
+                                    batch_size=options['batch_size'])
+        finally:
+            if output:
+                stream.close()
+
+        if output and verbosity >= 1:
+            for label, count in counts:
+                stdout.write("Dumped %d document(s) of %s\n" %
+                             (count, label))
@@ -0,0 +1,145 @@
+import json
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_mongokit.fixtures import get_document_classes, open_file
+from django_mongokit.indexes import get_collection
+from django_mongokit.importer import (
+    BATCH_SIZE,
+    Importer,
+    read_rows,
+    run_import,
+)
+
+# how many rejected rows are printed
+SHOW_REJECTED = 10
+
+
+def _guess_format(filename):
+    if filename.endswith('.gz'):
+        filename = filename[:-3]
+    if filename.endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+class Command(BaseCommand):
+    help = ("Imports a CSV or JSON Lines file into the collection of a "
+            "DjangoDocument, converting the values to the types of its "
+            "structure. Rows that don't validate are rejected. No signals "
+            "are sent.")
+    args = '<app_label.DocumentName> <file>'
+
+    # Django < 1.8
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--format', dest='format', default=None,
+                    choices=('csv', 'jsonl'),
+                    help="csv or jsonl, guessed from the file name if left "
+                         "out"),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=BATCH_SIZE,
+                    help="How many rows to validate and insert at a time"),
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=1,
+                    help="How many processes import batches at the same "
+                         "time"),
+        make_option('--list-separator', dest='list_separator', default=',',
+                    help="What separates the items of lists in CSV cells"),
+        make_option('--rejects', dest='rejects', default=None,
+                    help="Write the rejected rows to this file as JSON Lines"),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('args', metavar='app_label.DocumentName file',
+                            nargs='*')
+        parser.add_argument('--format', dest='format', default=None,
+                            choices=('csv', 'jsonl'),
+                            help="csv or jsonl, guessed from the file name "
+                                 "if left out")
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=BATCH_SIZE,
+                            help="How many rows to validate and insert at a "
+                                 "time")
+        parser.add_argument('--concurrency', dest='concurrency', type=int,
+                            default=1,
+                            help="How many processes import batches at the "
+                                 "same time")
+        parser.add_argument('--list-separator', dest='list_separator',
+                            default=',',
+                            help="What separates the items of lists in CSV "
+                                 "cells")
+        parser.add_argument('--rejects', dest='rejects', default=None,
+                            help="Write the rejected rows to this file as "
+                                 "JSON Lines")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: mongo_import %s" % self.args)
+        label, filename = args
+        if '.' not in label:
+            raise CommandError("%r should be app_label.DocumentName" % label)
+        try:
+            [document_class] = get_document_classes([label])
+        except LookupError, exception:
+            raise CommandError(str(exception))
+        verbosity = int(options.get('verbosity', 1))
+        stdout = getattr(self, 'stdout', sys.stdout)
+        stderr = getattr(self, 'stderr', sys.stderr)
+        format = options.get('format') or _guess_format(filename)
+
+        if filename == '-':
+            stream = sys.stdin
+        else:
+            stream = open_file(filename, 'rb')
+        rejects = None
+        if options.get('rejects'):
+            rejects = open_file(options['rejects'], 'wb')
+        try:
+            rows = read_rows(stream, format)
+            header = None
+            if format == 'csv':
+                try:
+                    header = rows.next()[1]
+                except StopIteration:
+                    raise CommandError("%s is empty" % filename)
+            importer = Importer(document_class, format, header=header,
+                                list_separator=options['list_separator'])
+
+            t0 = time.time()
+            imported = rejected = 0
+            for batch_imported, batch_rejected in run_import(
+                    importer, rows, batch_size=options['batch_size'],
+                    concurrency=options['concurrency']):
+                imported += batch_imported
+                for line, error, raw in batch_rejected:
+                    rejected += 1
+                    if verbosity >= 1 and rejected <= SHOW_REJECTED:
+                        stderr.write("Rejected line %s: %s\n" % (line, error))
+                    if rejects is not None:
+                        if isinstance(raw, list):
+                            raw = [cell.decode('utf-8', 'replace')
+                                   for cell in raw]
+                        rejects.write(json.dumps({'line': line,
+                                                  'error': error,
+                                                  'row': raw}) + '\n')
+                if verbosity >= 2:
+                    stdout.write("%d imported, %d rejected so far\n" %
+                                 (imported, rejected))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if rejects is not None:
+                rejects.close()
+
+        if verbosity >= 1:
+            seconds = time.time() - t0
+            stdout.write(
+                "Imported %d document(s) into %s in %.1f seconds "
+                "(%d per second), %d row(s) rejected\n" % (
+                    imported, get_collection(document_class).full_name, seconds,
+                    imported / max(seconds, 0.001), rejected
+                )
+            )
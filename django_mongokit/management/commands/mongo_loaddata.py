@@ -0,0 +1,55 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_mongokit.fixtures import BATCH_SIZE, load_documents, open_file
+
+
+class Command(BaseCommand):
+    help = ("Loads files written by mongo_dumpdata (or '-' for stdin), "
+            "replacing documents with the same _id.")
+    args = 'file [file ...]'
+
+    # Django < 1.8
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=BATCH_SIZE,
+                    help="How many documents to insert at a time"),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('args', metavar='file', nargs='+')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=BATCH_SIZE,
+                            help="How many documents to insert at a time")
+
+    def handle(self, *filenames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if not filenames:
+            raise CommandError("Which files should be loaded?")
+        stdout = getattr(self, 'stdout', sys.stdout)
+
+        total = 0
+        for filename in filenames:
+            if filename == '-':
+                stream = sys.stdin
+            else:
+                stream = open_file(filename, 'rb')
+            try:
+                counts = load_documents(stream,
+                                        batch_size=options['batch_size'])
+            except LookupError, exception:
+                raise CommandError("%s: %s" % (filename, exception))
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+            for label, count in counts:
+                total += count
+                if verbosity >= 2:
+                    stdout.write("Loaded %d document(s) of %s from %s\n" %
+                                 (count, label, filename))
+
+        if verbosity >= 1:
+            stdout.write("Loaded %d document(s) from %d file(s)\n" %
+                         (total, len(filenames)))
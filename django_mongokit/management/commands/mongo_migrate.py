@@ -0,0 +1,85 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_mongokit.migrate import (
+    applied_migrations,
+    fake_migration,
+    get_migrations,
+    run_migration,
+)
+
+
+class Command(BaseCommand):
+    help = ("Applies the migrations in the mongo_migrations packages of the "
+            "installed apps that haven't been applied yet and carries on "
+            "with the ones that were interrupted.")
+    args = '[app_label ...]'
+
+    # Django < 1.8
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--list', action='store_true', dest='list',
+                    default=False,
+                    help="Only list the migrations and if they're applied"),
+        make_option('--fake', action='store_true', dest='fake',
+                    default=False,
+                    help="Mark the migrations as applied without running "
+                         "them"),
+        make_option('--workers', dest='workers', type='int', default=1,
+                    help="How many processes migrate a new migration, each "
+                         "a range of _ids"),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=None,
+                    help="How many documents to migrate at a time"),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('args', metavar='app_label', nargs='*')
+        parser.add_argument('--list', action='store_true', dest='list',
+                            default=False,
+                            help="Only list the migrations and if they're "
+                                 "applied")
+        parser.add_argument('--fake', action='store_true', dest='fake',
+                            default=False,
+                            help="Mark the migrations as applied without "
+                                 "running them")
+        parser.add_argument('--workers', dest='workers', type=int,
+                            default=1,
+                            help="How many processes migrate a new "
+                                 "migration, each a range of _ids")
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=None,
+                            help="How many documents to migrate at a time")
+
+    def handle(self, *app_labels, **options):
+        verbosity = int(options.get('verbosity', 1))
+        stdout = getattr(self, 'stdout', sys.stdout)
+        migrations = get_migrations(app_labels)
+        if app_labels and not migrations:
+            raise CommandError("No migrations in %s" % ', '.join(app_labels))
+        applied = applied_migrations()
+
+        if options.get('list'):
+            for name, migration in migrations:
+                stdout.write("[%s] %s\n" % (
+                    name in applied and 'X' or ' ', name
+                ))
+            return
+
+        for name, migration in migrations:
+            if name in applied:
+                continue
+            if options.get('batch_size'):
+                migration.batch_size = options['batch_size']
+            if options.get('fake'):
+                fake_migration(name)
+                if verbosity >= 1:
+                    stdout.write("Faked %s\n" % name)
+                continue
+            if verbosity >= 1:
+                stdout.write("Applying %s...\n" % name)
+            changed = run_migration(name, migration,
+                                    workers=options.get('workers') or 1)
+            if verbosity >= 1:
+                stdout.write("  %d document(s) changed\n" % changed)
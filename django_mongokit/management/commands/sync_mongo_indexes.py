@@ -0,0 +1,85 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_mongokit.document import document_classes
+from django_mongokit.indexes import (
+    create_index,
+    declared_indexes,
+    drop_index,
+    plan_indexes,
+)
+
+
+def _describe(index):
+    description = ', '.join('%s %s' % (field, direction)
+                            for field, direction in index['key'])
+    options = [option for option in ('unique', 'sparse') if index[option]]
+    if index['expireAfterSeconds'] is not None:
+        options.append('ttl %ss' % index['expireAfterSeconds'])
+    if options:
+        description += ' (%s)' % ', '.join(options)
+    return '%s [%s]' % (index['name'], description)
+
+
+class Command(BaseCommand):
+    help = ("Creates the indexes declared in the Meta.indexes of "
+            "DjangoDocument classes and drops the ones that aren't declared "
+            "any more. Only collections that declare indexes are touched.")
+
+    # Django < 1.8
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help="Only print what would be created and dropped"),
+        make_option('--no-drop', action='store_false', dest='drop',
+                    default=True,
+                    help="Don't drop indexes that aren't declared"),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            default=False,
+                            help="Only print what would be created and "
+                                 "dropped")
+        parser.add_argument('--no-drop', action='store_false', dest='drop',
+                            default=True,
+                            help="Don't drop indexes that aren't declared")
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run')
+        verbosity = int(options.get('verbosity', 1))
+        stdout = getattr(self, 'stdout', sys.stdout)
+        prefix = dry_run and 'Would ' or ''
+
+        for collection, declared in declared_indexes(document_classes):
+            to_create, to_drop = plan_indexes(collection, declared)
+            if not options.get('drop', True):
+                # an index that changed options still has to go
+                names = [index['name'] for index in to_create]
+                to_drop = [index for index in to_drop
+                           if index['name'] in names]
+            if not to_create and not to_drop:
+                if verbosity >= 2:
+                    stdout.write("%s is in sync\n" % collection.full_name)
+                continue
+
+            # drop first as a changed index keeps its name
+            for index in to_drop:
+                if verbosity >= 1:
+                    stdout.write("%s%s %s on %s\n" % (
+                        prefix, dry_run and 'drop' or 'Dropping',
+                        _describe(index), collection.full_name
+                    ))
+                if not dry_run:
+                    drop_index(collection, index)
+            for index in to_create:
+                if verbosity >= 1:
+                    stdout.write("%s%s %s on %s\n" % (
+                        prefix, dry_run and 'create' or 'Creating',
+                        _describe(index), collection.full_name
+                    ))
+                if not dry_run:
+                    # built in the background so the collection stays usable
+                    create_index(collection, index)
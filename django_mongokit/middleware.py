@@ -0,0 +1,31 @@
+from identity import identity_map
+
+
+class IdentityMapMiddleware(object):
+    """
+    Documents loaded by `_id` are only loaded once per request and the
+    same instance is returned every time after that::
+
+        MIDDLEWARE_CLASSES = (
+            ...
+            'django_mongokit.middleware.IdentityMapMiddleware',
+        )
+    """
+
+    def __init__(self, get_response=None):
+        # Django >= 1.10
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity_map.start()
+        try:
+            return self.get_response(request)
+        finally:
+            identity_map.stop()
+
+    def process_request(self, request):
+        identity_map.start()
+
+    def process_response(self, request, response):
+        identity_map.stop()
+        return response
@@ -0,0 +1,269 @@
+"""
+Migrating the documents of a collection when the `structure` of a
+DjangoDocument changes, in batches that can be resumed after a crash.
+
+Migrations are modules in a `mongo_migrations` package of an app in
+INSTALLED_APPS, applied in the order of their names, and each has a
+`Migration` class. Either the server changes the documents::
+
+    # exampleapp/mongo_migrations/0001_talk_duration.py
+    from django_mongokit.migrate import DocumentMigration
+    from exampleapp.models import Talk
+
+    class Migration(DocumentMigration):
+        document_class = Talk
+        spec = {'duration': {'$exists': False}}
+        update = {'$set': {'duration': 0.0}}
+
+or every document is changed in Python and written back::
+
+    class Migration(DocumentMigration):
+        document_class = Talk
+
+        def transform(self, document):
+            document['tags'] = [tag.lower() for tag in document['tags']]
+            return document
+
+The documents are migrated in order of `_id`, a batch at a time, and the
+last `_id` of every batch is saved in the `mongo_migrations` collection.
+A migration that was interrupted carries on from there the next time.
+It can also be split into ranges of `_id`s that are migrated by as many
+worker processes. Run them with `./manage.py mongo_migrate`.
+"""
+
+import datetime
+import multiprocessing
+import pkgutil
+try:
+    from importlib import import_module
+except ImportError:
+    # Python 2.6
+    from django.utils.importlib import import_module
+
+from django.conf import settings
+
+from indexes import get_collection
+from shortcut import get_database
+
+MIGRATIONS_MODULE = 'mongo_migrations'
+BOOKKEEPING_COLLECTION = 'mongo_migrations'
+
+
+class DocumentMigration(object):
+    """
+    One change to the documents of `document_class`. Set `update` to
+    modifiers the server applies (e.g. `{'$rename': {'title': 'topic'}}`)
+    or override `transform()`. Only the documents that match `spec` are
+    migrated.
+
+    A batch can be migrated again if the process died before its `_id`
+    was saved so the changes should be safe to apply twice, e.g. by
+    excluding documents that are already migrated in `spec`.
+
+    `transform(document)` returns the changed `document`, a plain dict, or
+    None to leave it as it is.
+    """
+
+    document_class = None
+    spec = None
+    update = None
+    transform = None
+    batch_size = 1000
+
+    def __init__(self):
+        if self.document_class is None:
+            raise ValueError("%s needs a document_class" %
+                             self.__class__.__name__)
+        if (self.update is None) == (self.transform is None):
+            raise ValueError("%s needs either an update or a transform()" %
+                             self.__class__.__name__)
+
+    def get_collection(self):
+        return get_collection(self.document_class)
+
+    def _range_spec(self, lower, upper):
+        # after `lower` and up to and including `upper`
+        ids = {}
+        if lower is not None:
+            ids['$gt'] = lower
+        if upper is not None:
+            ids['$lte'] = upper
+        if not ids:
+            return self.spec or {}
+        if not self.spec:
+            return {'_id': ids}
+        return {'$and': [self.spec, {'_id': ids}]}
+
+    def migrate_range(self, lower=None, upper=None):
+        """migrate the documents with an `_id` after `lower` and up to
+        `upper` (None for no limit) and yield (last _id, documents changed)
+        after every batch"""
+        collection = self.get_collection()
+        fields = self.update is not None and ['_id'] or None
+        while True:
+            batch = list(collection.find(self._range_spec(lower, upper),
+                                         fields=fields)
+                         .sort('_id', 1)
+                         .limit(self.batch_size))
+            if not batch:
+                return
+            last = batch[-1]['_id']
+            if self.update is not None:
+                result = collection.update(self._range_spec(lower, last),
+                                           self.update, multi=True)
+                changed = result and result.get('n', 0) or 0
+            else:
+                changed = self._transform_batch(collection, batch)
+            yield last, changed
+            lower = last
+
+    def _transform_batch(self, collection, batch):
+        try:
+            bulk = collection.initialize_unordered_bulk_op()
+        except AttributeError:
+            # pymongo < 2.7
+            bulk = None
+        changed = 0
+        for document in batch:
+            _id = document['_id']
+            document = self.transform(document)
+            if document is None:
+                continue
+            if bulk is None:
+                collection.update({'_id': _id}, document)
+            else:
+                bulk.find({'_id': _id}).replace_one(document)
+            changed += 1
+        if bulk is not None and changed:
+            bulk.execute()
+        return changed
+
+
+def get_migrations(app_labels=None):
+    """return a list of (name, migration) of all the migrations of the
+    INSTALLED_APPS (or just the ones in `app_labels`) in the order they
+    should be applied. The names are like 'exampleapp.0001_talk_duration'."""
+    migrations = []
+    for app in settings.INSTALLED_APPS:
+        app_label = app.split('.')[-1]
+        if app_labels and app_label not in app_labels:
+            continue
+        try:
+            package = import_module('%s.%s' % (app, MIGRATIONS_MODULE))
+        except ImportError:
+            continue
+        names = sorted(name for __, name, is_package
+                       in pkgutil.iter_modules(package.__path__)
+                       if not is_package)
+        for name in names:
+            module = import_module('%s.%s' % (package.__name__, name))
+            migrations.append(('%s.%s' % (app_label, name),
+                               module.Migration()))
+    return migrations
+
+
+def get_bookkeeping_collection():
+    return get_database()[BOOKKEEPING_COLLECTION]
+
+
+def applied_migrations():
+    """the names of the migrations that have been applied"""
+    return set(record['_id'] for record in
+               get_bookkeeping_collection().find({'applied': {'$ne': None}},
+                                                 fields=['_id']))
+
+
+def plan_ranges(migration, workers):
+    """split the `_id`s of the documents `migration` is for into about
+    `workers` equally big ranges of (lower, upper)"""
+    if workers <= 1:
+        return [(None, None)]
+    collection = migration.get_collection()
+    spec = migration.spec or {}
+    count = collection.find(spec).count()
+    boundaries = []
+    for worker in range(1, workers):
+        found = list(collection.find(spec, fields=['_id'])
+                     .sort('_id', 1)
+                     .skip(count * worker // workers)
+                     .limit(1))
+        if found and found[0]['_id'] not in boundaries:
+            boundaries.append(found[0]['_id'])
+    lowers = [None] + boundaries
+    uppers = boundaries + [None]
+    return zip(lowers, uppers)
+
+
+def _migrate_range(name, migration, index, range_):
+    bookkeeping = get_bookkeeping_collection()
+    lower = range_['checkpoint']
+    if lower is None:
+        lower = range_['lower']
+    for last, changed in migration.migrate_range(lower, range_['upper']):
+        bookkeeping.update({'_id': name}, {
+            '$set': {'ranges.%d.checkpoint' % index: last},
+            '$inc': {'documents': changed},
+        })
+    bookkeeping.update({'_id': name},
+                       {'$set': {'ranges.%d.done' % index: True}})
+
+
+def _migrate_range_in_worker(arguments):
+    name, index, range_, batch_size = arguments
+    migration = dict(get_migrations([name.split('.')[0]]))[name]
+    # e.g. from --batch-size
+    migration.batch_size = batch_size
+    _migrate_range(name, migration, index, range_)
+
+
+def run_migration(name, migration, workers=1):
+    """apply `migration`, or carry on where it was interrupted, and return
+    how many documents it changed"""
+    bookkeeping = get_bookkeeping_collection()
+    record = bookkeeping.find_one({'_id': name})
+    if record is None:
+        record = {
+            '_id': name,
+            'ranges': [{'lower': lower, 'upper': upper, 'checkpoint': None,
+                        'done': False}
+                       for lower, upper in plan_ranges(migration, workers)],
+            'documents': 0,
+            'started': datetime.datetime.utcnow(),
+            'applied': None,
+        }
+        bookkeeping.insert(record)
+    elif record.get('applied'):
+        return record['documents']
+
+    pending = [(name, index, range_, migration.batch_size)
+               for index, range_ in enumerate(record['ranges'])
+               if not range_['done']]
+    if workers > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(min(workers, len(pending)))
+        try:
+            pool.map(_migrate_range_in_worker, pending)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        pool.join()
+    else:
+        for name, index, range_, __ in pending:
+            _migrate_range(name, migration, index, range_)
+
+    bookkeeping.update({'_id': name}, {
+        '$set': {'applied': datetime.datetime.utcnow()},
+    })
+    return bookkeeping.find_one({'_id': name})['documents']
+
+
+def fake_migration(name):
+    """record `name` as applied without running it"""
+    now = datetime.datetime.utcnow()
+    get_bookkeeping_collection().update(
+        {'_id': name},
+        {'$set': {'applied': now, 'ranges': [], 'documents': 0,
+                  'started': now}},
+        upsert=True
+    )
@@ -2,6 +2,10 @@
 MongoKit (MongoDB) backend for Django.
 """
 
+import os
+import time
+from functools import partial
+
 from mongokit import Connection
 
 import django
@@ -27,8 +31,27 @@ else:
 
 from django.conf import settings
 
+from monitoring import (
+    SlowQueryLog,
+    describe,
+    get_query_log,
+    get_query_shapes,
+    get_written_collections,
+)
+from pool import PoolStats, StatsPool
+
 TEST_DATABASE_PREFIX = 'test_'
 
+# documents inserted at a time when cloning test databases
+CLONE_BATCH_SIZE = 1000
+
+# maps the keys of DATABASES['mongodb']['POOL'] to pymongo keyword arguments
+POOL_OPTIONS = {
+    'MAX_SIZE': 'max_pool_size',
+    'WAIT_QUEUE_TIMEOUT': 'waitQueueTimeoutMS',
+    'WAIT_QUEUE_MULTIPLE': 'waitQueueMultiple',
+}
+
 
 class UnsupportedConnectionOperation(Exception):
     pass
@@ -69,11 +92,30 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
         return []
     get_table_description = complain
     get_relations = complain
-    get_indexes = complain
+
+    def get_indexes(self, cursor, table_name):
+        """the single field indexes of a collection in the same form as
+        Django's SQL backends, e.g.
+        `{'_id': {'primary_key': True, 'unique': True}}`"""
+        settings_dict = self.connection.settings_dict
+        database = self.connection.connection[
+            settings_dict.get('NAME') or settings_dict['DATABASE_NAME']
+        ]
+        indexes = {}
+        for info in database[table_name].index_information().values():
+            if len(info['key']) != 1:
+                continue
+            field = info['key'][0][0]
+            indexes[field] = {
+                'primary_key': field == '_id',
+                'unique': field == '_id' or bool(info.get('unique')),
+            }
+        return indexes
 
 
 class DatabaseCreation(BaseDatabaseCreation):
-    def create_test_db(self, verbosity=1, autoclobber=False):
+    def create_test_db(self, verbosity=1, autoclobber=False, keepdb=False,
+                       serialize=True):
         # No need to create databases in mongoDB :)
         # but we can make sure that if the database existed is emptied
 
@@ -106,21 +148,86 @@ class DatabaseCreation(BaseDatabaseCreation):
             settings.DATABASES['mongodb']['NAME'] = test_database_name
         except AttributeError:
             settings.MONGO_DATABASE_NAME = test_database_name
+        else:
+            self.connection.settings_dict['NAME'] = test_database_name
 
         settings.DATABASE_SUPPORTS_TRANSACTIONS = False  # MongoDB :)
 
         # In this phase it will only drop the database if it already existed
         # which could potentially happen if the test database was created but
         # was never dropped at the end of the tests
-        self._drop_database(test_database_name)
+        if not keepdb:
+            self._drop_database(test_database_name)
         # if it didn't exist it will automatically be created by the
         # mongokit conncetion
-
-    def destroy_test_db(self, old_database_name, verbosity=1):
+        return test_database_name
+
+    # With `manage.py test --parallel` (Django >= 1.9) the test database is
+    # cloned once per worker process, e.g. test_example_1, test_example_2,
+    # and every worker then points the connection at its own clone with
+    # get_test_db_clone_settings() so that they don't clobber each other.
+
+    def get_test_db_clone_settings(self, suffix):
+        settings_dict = dict(self.connection.settings_dict)
+        settings_dict['NAME'] = '%s_%s' % (settings_dict['NAME'], suffix)
+        return settings_dict
+
+    def clone_test_db(self, suffix=None, verbosity=1, autoclobber=False,
+                      keepdb=False, number=None):
+        # Django 1.9 and 1.10 call it `number`
+        if suffix is None:
+            suffix = number
+        if verbosity >= 1:
+            print "Cloning test database for alias '%s'..." % (
+                self.connection.alias
+            )
+        self._clone_test_db(suffix, verbosity, keepdb)
+
+    def _clone_test_db(self, suffix, verbosity=1, keepdb=False):
+        client = self.connection.connection
+        source_database_name = self.connection.settings_dict['NAME']
+        target_database_name = self.get_test_db_clone_settings(suffix)['NAME']
+        if keepdb and target_database_name in client.database_names():
+            return
+        self._drop_database(target_database_name)
+
+        source = client[source_database_name]
+        target = client[target_database_name]
+        for name in source.collection_names(include_system_collections=False):
+            for index_name, info in source[name].index_information().items():
+                if index_name == '_id_':
+                    continue
+                options = dict(
+                    (key, value) for key, value in info.items()
+                    if key not in ('key', 'ns', 'v')
+                )
+                target[name].create_index(info['key'], name=index_name,
+                                          **options)
+            batch = []
+            for document in source[name].find(batch_size=CLONE_BATCH_SIZE):
+                batch.append(document)
+                if len(batch) == CLONE_BATCH_SIZE:
+                    target[name].insert(batch, check_keys=False)
+                    batch = []
+            if batch:
+                target[name].insert(batch, check_keys=False)
+
+    def destroy_test_db(self, old_database_name=None, verbosity=1,
+                        keepdb=False, suffix=None, number=None):
         """
         Destroy a test database, prompting the user for confirmation if the
         database already exists. Returns the name of the test database created.
         """
+        if suffix is None:
+            suffix = number
+        if suffix is not None:
+            # one of the clones made for --parallel, the settings still
+            # point at the test database in this process
+            if not keepdb:
+                self._drop_database(
+                    self.get_test_db_clone_settings(suffix)['NAME']
+                )
+            return
         if verbosity >= 1:
             print "Destroying test database '%s'..." % self.connection.alias
         if 'DATABASE_NAME' in self.connection.settings_dict:
@@ -128,13 +235,18 @@ class DatabaseCreation(BaseDatabaseCreation):
             test_database_name = settings.MONGO_DATABASE_NAME
         else:
             test_database_name = self.connection.settings_dict['NAME']
-        self._drop_database(test_database_name)
+        if not keepdb:
+            self._drop_database(test_database_name)
 
+        if old_database_name is None:
+            return
         try:
             settings.DATABASES['mongodb']['NAME'] = old_database_name
         except AttributeError:
             # Django <1.2
             settings.MONGO_DATABASE_NAME = old_database_name
+        else:
+            self.connection.settings_dict['NAME'] = old_database_name
 
     def _drop_database(self, database_name):
         if not database_name.startswith(TEST_DATABASE_PREFIX):
@@ -153,6 +265,9 @@ class DatabaseFeatures(BaseDatabaseFeatures):
     def __init__(self, connection):
         super(DatabaseFeatures, self).__init__(connection)
 
+    # see DatabaseCreation.clone_test_db()
+    can_clone_databases = True
+
     @property
     def supports_transactions(self):
         return False
@@ -178,6 +293,18 @@ class DatabaseWrapper(BaseDatabaseWrapper):
 
 
     def __init__(self, settings_dict, alias=None, *args, **kwargs):
+        # needed before BaseDatabaseWrapper.__init__ resets the queries
+        self._query_log = get_query_log(
+            alias or settings_dict.get('DATABASE_NAME'),
+            settings_dict
+        )
+        self._query_shapes = get_query_shapes(
+            alias or settings_dict.get('DATABASE_NAME'),
+            settings_dict
+        )
+        self._written_collections = get_written_collections(
+            alias or settings_dict.get('DATABASE_NAME')
+        )
         super(DatabaseWrapper, self).__init__(
             settings_dict,
             alias=alias,
@@ -191,7 +318,23 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             kwargs['port'] = int(settings_dict['PORT'])
         if 'OPTIONS' in settings_dict:
             kwargs.update(settings_dict['OPTIONS'])
-        self.connection = ConnectionWrapper(**kwargs)
+
+        # E.g. 'POOL': {'MAX_SIZE': 50, 'MIN_SIZE': 5, 'MAX_IDLE_TIME': 60,
+        #               'WAIT_QUEUE_TIMEOUT': 1000, 'WAIT_QUEUE_MULTIPLE': 2}
+        # MAX_IDLE_TIME is in seconds and WAIT_QUEUE_TIMEOUT in milliseconds.
+        pool_settings = settings_dict.get('POOL') or {}
+        for key, option in POOL_OPTIONS.items():
+            if pool_settings.get(key) is not None:
+                kwargs[option] = pool_settings[key]
+        self._pool_stats = PoolStats(
+            max_size=kwargs.get('max_pool_size',
+                                kwargs.get('maxPoolSize', 100)),
+            min_size=pool_settings.get('MIN_SIZE', 0),
+            max_idle_time=pool_settings.get('MAX_IDLE_TIME'),
+        )
+        kwargs['_pool_class'] = partial(StatsPool, stats=self._pool_stats)
+        self._connection_kwargs = kwargs
+        self._slow_query_log = SlowQueryLog(settings_dict)
 
         try:
             self.features = DatabaseFeatures(self.connection)
@@ -221,9 +364,91 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         # transaction related attributes
         self.transaction_state = None
 
+    _connection = None
+    _connection_pid = None
+
+    def _get_connection(self):
+        # The connection isn't made until it's first used and it's made again
+        # in forked processes (e.g. prefork workers) so that sockets are never
+        # shared between a process and its children.
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = self._new_connection()
+            connection.query_log = self._query_log
+            connection.slow_query_log = self._slow_query_log
+            connection.query_shapes = self._query_shapes
+            connection.written_collections = self._written_collections
+            if self._connection is not None:
+                # keep what was registered in the parent process
+                connection._registered_documents = \
+                  self._connection._registered_documents
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _set_connection(self, connection):
+        # BaseDatabaseWrapper.__init__ sets this to None
+        self._connection = connection
+        self._connection_pid = os.getpid()
+
+    connection = property(_get_connection, _set_connection)
+
+    def _new_connection(self):
+        return ConnectionWrapper(_connect=False, **self._connection_kwargs)
+
     def close(self):
         pass
 
+    def pool_stats(self):
+        """
+        Return a dict describing the connection pool::
+
+            max_size       the most sockets the pool will open
+            min_size       idle sockets are never closed below this
+            checked_out    sockets in use right now
+            idle           sockets waiting in the pool right now
+            checkouts      times a socket was taken out of the pool
+            created        sockets opened
+            waits          times a checkout had to wait for a free socket
+            wait_time      total seconds spent waiting
+            wait_timeouts  times waiting took longer than WAIT_QUEUE_TIMEOUT
+            reaped         idle sockets closed after MAX_IDLE_TIME
+
+        Everything but the first four is counted since the connection was
+        made or since `reset_pool_stats()` was last called.
+        """
+        return self._pool_stats.as_dict()
+
+    def reset_pool_stats(self):
+        self._pool_stats.reset()
+
+    # Like Django's `connection.queries` these are the operations sent to
+    # the server in this thread. Django empties them at the start of every
+    # request (`conn.queries = []` up to Django 1.7 and
+    # `conn.queries_log.clear()` after that).
+    def _get_queries(self):
+        return list(self._query_log.entries)
+
+    def _set_queries(self, queries):
+        self._query_log.entries = queries
+
+    queries = property(_get_queries, _set_queries)
+
+    def _get_queries_log(self):
+        return self._query_log.entries
+
+    queries_log = property(_get_queries_log, _set_queries)
+
+    def reset_queries(self):
+        self._query_log.reset()
+
+    def query_shapes(self):
+        """the shapes of the filters and sorts used in all threads over the
+        last `INDEX_ADVISOR_WINDOW` seconds. See django_mongokit.advisor"""
+        return self._query_shapes.summary()
+
+    def reset_query_shapes(self):
+        self._query_shapes.reset()
+
 
 class ConnectionWrapper(Connection):
     # Need to pretend we care about autocommit
@@ -231,9 +456,68 @@ class ConnectionWrapper(Connection):
     # set autocommit
     autocommit = True  # Needed attribute but its value is ignored
 
+    # set by the DatabaseWrapper
+    query_log = None
+    slow_query_log = None
+    query_shapes = None
+    written_collections = None
+
     def __init__(self, *args, **kwargs):
         super(ConnectionWrapper, self).__init__(*args, **kwargs)
 
+    def _send_message(self, message, *args, **kwargs):
+        if not self._monitoring():
+            return super(ConnectionWrapper, self)._send_message(
+                message, *args, **kwargs
+            )
+        t0 = time.time()
+        try:
+            return super(ConnectionWrapper, self)._send_message(
+                message, *args, **kwargs
+            )
+        finally:
+            self._monitor(message[1], time.time() - t0)
+
+    def _send_message_with_response(self, message, *args, **kwargs):
+        if not self._monitoring():
+            return super(ConnectionWrapper, self)._send_message_with_response(
+                message, *args, **kwargs
+            )
+        t0 = time.time()
+        response = None
+        try:
+            result = super(ConnectionWrapper, self)._send_message_with_response(
+                message, *args, **kwargs
+            )
+            # (None, (response, sock_info, pool))
+            response = result[1][0]
+            return result
+        finally:
+            self._monitor(message[1], time.time() - t0, response)
+
+    def _monitoring(self):
+        if self.slow_query_log is not None and self.slow_query_log.explaining:
+            return False
+        return ((self.query_log is not None and self.query_log.enabled) or
+                (self.slow_query_log is not None and
+                 self.slow_query_log.enabled) or
+                (self.query_shapes is not None and
+                 self.query_shapes.enabled) or
+                (self.written_collections is not None and
+                 self.written_collections.recording))
+
+    def _monitor(self, data, duration, response=None):
+        description = describe(data, duration, response)
+        if self.query_log is not None and self.query_log.enabled:
+            self.query_log.record(description)
+        if self.slow_query_log is not None and self.slow_query_log.enabled:
+            self.slow_query_log.check(self, description)
+        if self.query_shapes is not None and self.query_shapes.enabled:
+            self.query_shapes.record(description)
+        if (self.written_collections is not None and
+            self.written_collections.recording):
+            self.written_collections.record(description)
+
     def __repr__(self):
         return ('ConnectionWrapper: ' +
                 super(ConnectionWrapper, self).__repr__())
@@ -0,0 +1,493 @@
+"""
+Recording and timing what is sent to MongoDB.
+
+pymongo (2.x) has no hooks for this so ConnectionWrapper hands every
+message it sends to the server, along with how long the round trip took,
+to the QueryLog, SlowQueryLog and QueryShapes of its database alias. The
+message is parsed just enough to tell what the operation was, on which
+collection and with what filter.
+"""
+
+import logging
+import random
+import struct
+import threading
+import time
+from collections import deque
+
+import bson
+from bson.son import SON
+from django.conf import settings
+
+OP_UPDATE = 2001
+OP_INSERT = 2002
+OP_QUERY = 2004
+OP_GET_MORE = 2005
+OP_DELETE = 2006
+
+# commands whose value is the name of the collection they work on
+COLLECTION_COMMANDS = (
+    'count', 'distinct', 'aggregate', 'findandmodify', 'findAndModify',
+    'insert', 'update', 'delete', 'mapreduce', 'mapReduce', 'group',
+    'geoNear', 'text', 'parallelCollectionScan', 'createIndexes',
+    'dropIndexes', 'deleteIndexes', 'collStats', 'drop', 'create',
+)
+
+# how many entries are kept per thread like Django's queries_limit
+QUERIES_LIMIT = 9000
+
+# operations that can be explained with a find() on the same filter
+EXPLAINABLE = ('find', 'count', 'update', 'remove', 'delete',
+               'findandmodify', 'findAndModify')
+
+# operations whose filter and sort could use an index
+INDEXABLE = ('find', 'count', 'distinct', 'aggregate', 'update', 'remove',
+             'delete', 'findandmodify', 'findAndModify')
+
+# operations that change the documents or indexes of a collection
+WRITES = ('insert', 'update', 'remove', 'delete', 'findandmodify',
+          'findAndModify', 'create', 'createIndexes')
+
+logger = logging.getLogger('django_mongokit.slow_queries')
+
+
+def query_shape(value):
+    """replace all the values in a query with '?' so that queries that
+    only differ in values look the same.
+    E.g. `{'when': {'$gte': d}, 'tags': u"python"}` becomes
+    `{'when': {'$gte': '?'}, 'tags': '?'}`"""
+    if isinstance(value, dict):
+        shape = {}
+        for key, sub_value in value.items():
+            if (key in ('$and', '$or', '$nor') and
+                isinstance(sub_value, (list, tuple))):
+                shape[key] = [query_shape(each) for each in sub_value]
+            else:
+                shape[key] = query_shape(sub_value)
+        return shape
+    return '?'
+
+
+def _cstring(data, position):
+    end = data.index('\x00', position)
+    return data[position:end], end + 1
+
+
+def _document(data, position):
+    length = struct.unpack('<i', data[position:position + 4])[0]
+    return bson.BSON(data[position:position + length]).decode(as_class=SON)
+
+
+def _split_namespace(namespace):
+    database, __, collection = namespace.partition('.')
+    return database, collection
+
+
+def describe_message(data):
+    """return a dict of 'operation', 'database', 'collection', 'filter'
+    (the shape of the query), 'spec' (the query itself) and 'sort' for a
+    raw message on its way to the server"""
+    operation = struct.unpack('<i', data[12:16])[0]
+    namespace, position = _cstring(data, 20)
+    database, collection = _split_namespace(namespace)
+    description = {
+        'database': database,
+        'collection': collection,
+        'filter': None,
+        'spec': None,
+        'sort': None,
+    }
+
+    if operation == OP_QUERY:
+        # skip numberToSkip and numberToReturn
+        query = _document(data, position + 8)
+        if collection == '$cmd':
+            name = query.keys() and query.keys()[0] or 'command'
+            description['operation'] = name
+            if name in COLLECTION_COMMANDS:
+                description['collection'] = query[name]
+            else:
+                description['collection'] = None
+            spec = query.get('query') or query.get('q')
+            if name == 'update' and query.get('updates'):
+                spec = query['updates'][0].get('q')
+            elif name == 'delete' and query.get('deletes'):
+                spec = query['deletes'][0].get('q')
+            elif name == 'aggregate':
+                for stage in query.get('pipeline') or []:
+                    if '$match' in stage:
+                        spec = stage['$match']
+                        break
+            description['spec'] = spec
+            if query.get('sort'):
+                description['sort'] = query['sort'].items()
+        else:
+            description['operation'] = 'find'
+            if '$query' in query:
+                if query.get('$orderby'):
+                    description['sort'] = query['$orderby'].items()
+                query = query['$query']
+            description['spec'] = query
+    elif operation == OP_GET_MORE:
+        description['operation'] = 'getmore'
+    elif operation == OP_INSERT:
+        description['operation'] = 'insert'
+    elif operation == OP_UPDATE:
+        description['operation'] = 'update'
+        # skip the flags
+        description['spec'] = _document(data, position + 4)
+    elif operation == OP_DELETE:
+        description['operation'] = 'remove'
+        description['spec'] = _document(data, position + 4)
+    else:
+        description['operation'] = 'unknown'
+    if description['spec'] is not None:
+        description['filter'] = query_shape(description['spec'])
+    return description
+
+
+def describe(data, duration, response=None):
+    """like describe_message() but never fails and adds the 'duration' (in
+    seconds) and how many 'documents' a find or getmore returned"""
+    try:
+        description = describe_message(data)
+    except Exception:
+        # never break a query because it couldn't be described
+        description = {'operation': 'unknown', 'database': None,
+                       'collection': None, 'filter': None, 'spec': None,
+                       'sort': None}
+    description['duration'] = duration
+    description['documents'] = None
+    if (response is not None and
+        description['operation'] in ('find', 'getmore')):
+        description['documents'] = documents_returned(response)
+    return description
+
+
+def documents_returned(response):
+    """the numberReturned of a reply (with its header removed)"""
+    return struct.unpack('<i', response[16:20])[0]
+
+
+class QueryLog(object):
+    """
+    What has been sent to the server through one database alias. The
+    entries are kept per thread, like Django's `connection.queries`, and
+    each is a dict like::
+
+        {'operation': 'find', 'database': 'example', 'collection': 'talks',
+         'filter': {'_id': '?'}, 'sort': None, 'documents': 1,
+         'time': '0.001'}
+
+    Nothing is recorded unless the database has `'RECORD_QUERIES': True`
+    in its settings or, if it doesn't say, when `settings.DEBUG` is True.
+    """
+
+    def __init__(self, alias, settings_dict):
+        self.alias = alias
+        self.settings_dict = settings_dict
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self.settings_dict.get('RECORD_QUERIES', settings.DEBUG)
+
+    def _get_entries(self):
+        try:
+            return self._local.entries
+        except AttributeError:
+            self._local.entries = deque(maxlen=QUERIES_LIMIT)
+            return self._local.entries
+
+    def _set_entries(self, entries):
+        self._local.entries = deque(entries, maxlen=QUERIES_LIMIT)
+
+    entries = property(_get_entries, _set_entries)
+
+    def reset(self):
+        self.entries.clear()
+
+    def record(self, description):
+        """`description` as returned by describe()"""
+        entry = {'time': '%.3f' % description['duration']}
+        for key in ('operation', 'database', 'collection', 'filter', 'sort',
+                    'documents'):
+            entry[key] = description[key]
+        self.entries.append(entry)
+        return entry
+
+
+def index_used(explain):
+    """the name of the index an explain() shows was used or None if it was
+    a collection scan"""
+    cursor = explain.get('cursor')
+    if cursor is not None:
+        # MongoDB < 3.0, e.g. u'BtreeCursor when_-1'
+        if cursor.startswith('BtreeCursor '):
+            return cursor.split(' ', 1)[1]
+        return None
+    plan = explain.get('queryPlanner', {}).get('winningPlan')
+    while plan:
+        if plan.get('stage') == 'IXSCAN':
+            return plan.get('indexName')
+        plan = plan.get('inputStage')
+    return None
+
+
+class SlowQueryLog(object):
+    """
+    Logs every operation that takes longer than the database's
+    `SLOW_QUERY_TIME` (in milliseconds) to the
+    'django_mongokit.slow_queries' logger as a warning, with the shape of
+    its filter.
+
+    `SLOW_QUERY_EXPLAIN` is the fraction (0.0 to 1.0) of slow queries that
+    are run again with explain() to show if an index was used. The explain
+    is logged too and it is never timed or recorded itself.
+    """
+
+    def __init__(self, settings_dict):
+        self.settings_dict = settings_dict
+        self._local = threading.local()
+
+    @property
+    def threshold(self):
+        return self.settings_dict.get('SLOW_QUERY_TIME')
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    @property
+    def explaining(self):
+        return getattr(self._local, 'explaining', False)
+
+    def check(self, client, description):
+        """log `description` (as returned by describe()) if it was slow"""
+        duration = description['duration'] * 1000
+        if duration < self.threshold:
+            return False
+        explain = None
+        if (description['operation'] in EXPLAINABLE and
+            description['collection'] and
+            random.random() < self.settings_dict.get('SLOW_QUERY_EXPLAIN', 0)):
+            explain = self.explain(client, description)
+
+        message = 'Slow %s on %s.%s (%.1f ms) %r' % (
+            description['operation'],
+            description['database'],
+            description['collection'],
+            duration,
+            description['filter'],
+        )
+        if explain is not None:
+            message += ' using index %s' % index_used(explain)
+        logger.warning(message, extra={
+            'operation': description['operation'],
+            'database': description['database'],
+            'collection': description['collection'],
+            'filter': description['filter'],
+            'sort': description['sort'],
+            'duration': duration,
+            'explain': explain,
+        })
+        return True
+
+    def explain(self, client, description):
+        self._local.explaining = True
+        try:
+            collection = client[description['database']][
+                description['collection']
+            ]
+            cursor = collection.find(description['spec'] or {})
+            if description['sort']:
+                cursor.sort(description['sort'])
+            return cursor.explain()
+        except Exception:
+            logger.exception("Unable to explain %s on %s.%s" % (
+                description['operation'],
+                description['database'],
+                description['collection'],
+            ))
+            return None
+        finally:
+            self._local.explaining = False
+
+
+def _freeze(value):
+    # a hashable version of a query shape
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(sub_value))
+                            for key, sub_value in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(each) for each in value)
+    return value
+
+
+class QueryShapes(object):
+    """
+    Counts how often each shape of filter and sort was used on every
+    collection, and how long it took in total, over the last
+    `INDEX_ADVISOR_WINDOW` seconds. Nothing is counted unless that's set.
+    See django_mongokit.advisor for what to make of it.
+    """
+
+    # the window moves on this many seconds at a time
+    bucket_size = 60
+
+    def __init__(self, settings_dict):
+        self.settings_dict = settings_dict
+        self.lock = threading.Lock()
+        self._buckets = deque()
+
+    @property
+    def window(self):
+        return self.settings_dict.get('INDEX_ADVISOR_WINDOW')
+
+    @property
+    def enabled(self):
+        return self.window is not None
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self._buckets.clear()
+        finally:
+            self.lock.release()
+
+    def record(self, description, now=None):
+        """count `description` (as returned by describe())"""
+        if (description['operation'] not in INDEXABLE or
+            not description['collection']):
+            return
+        if not description['filter'] and not description['sort']:
+            # nothing an index could help with
+            return
+        if now is None:
+            now = time.time()
+        sort = [tuple(each) for each in description['sort'] or []]
+        key = (description['database'], description['collection'],
+               _freeze(description['filter'] or {}), tuple(sort))
+        self.lock.acquire()
+        try:
+            self._prune(now)
+            if (not self._buckets or
+                self._buckets[-1][0] + self.bucket_size <= now):
+                self._buckets.append((now, {}))
+            shapes = self._buckets[-1][1]
+            if key not in shapes:
+                shapes[key] = {
+                    'database': description['database'],
+                    'collection': description['collection'],
+                    'filter': description['filter'] or {},
+                    'sort': sort,
+                    'count': 0,
+                    'time': 0.0,
+                }
+            shapes[key]['count'] += 1
+            shapes[key]['time'] += description['duration']
+        finally:
+            self.lock.release()
+
+    def _prune(self, now):
+        while self._buckets and self._buckets[0][0] < now - self.window:
+            self._buckets.popleft()
+
+    def summary(self, now=None):
+        """return a list of dicts with 'database', 'collection', 'filter',
+        'sort', 'count' and 'time' (in seconds), the most time consuming
+        first"""
+        if now is None:
+            now = time.time()
+        totals = {}
+        self.lock.acquire()
+        try:
+            self._prune(now)
+            for __, shapes in self._buckets:
+                for key, shape in shapes.items():
+                    if key not in totals:
+                        totals[key] = dict(shape, count=0, time=0.0)
+                    totals[key]['count'] += shape['count']
+                    totals[key]['time'] += shape['time']
+        finally:
+            self.lock.release()
+        return sorted(totals.values(),
+                      key=lambda shape: (shape['time'], shape['count']),
+                      reverse=True)
+
+
+class WrittenCollections(object):
+    """
+    The collections written to through one database alias while
+    `recording`, as (database, collection) pairs. MongoTestCase uses it to
+    only empty what a test touched.
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.lock = threading.Lock()
+        self._collections = set()
+
+    def start(self):
+        self.lock.acquire()
+        try:
+            self._collections = set()
+            self.recording = True
+        finally:
+            self.lock.release()
+
+    def stop(self):
+        """stop recording and return what was written to"""
+        self.lock.acquire()
+        try:
+            self.recording = False
+            collections, self._collections = self._collections, set()
+        finally:
+            self.lock.release()
+        return collections
+
+    def record(self, description):
+        """remember the collection of `description` (as returned by
+        describe()) if it was written to"""
+        collection = description['collection']
+        if (description['operation'] not in WRITES or not collection or
+            collection.startswith('system.')):
+            return
+        self.lock.acquire()
+        try:
+            self._collections.add((description['database'], collection))
+        finally:
+            self.lock.release()
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(kind, alias, factory):
+    # Django creates a database wrapper per thread but they should all share
+    # one of each per database alias
+    _registry_lock.acquire()
+    try:
+        if (kind, alias) not in _registry:
+            _registry[(kind, alias)] = factory()
+        return _registry[(kind, alias)]
+    finally:
+        _registry_lock.release()
+
+
+def get_query_log(alias, settings_dict):
+    """the one QueryLog of a database alias"""
+    return _get_or_create('queries', alias,
+                          lambda: QueryLog(alias, settings_dict))
+
+
+def get_query_shapes(alias, settings_dict):
+    """the one QueryShapes of a database alias"""
+    return _get_or_create('shapes', alias,
+                          lambda: QueryShapes(settings_dict))
+
+
+def get_written_collections(alias):
+    """the one WrittenCollections of a database alias"""
+    return _get_or_create('written', alias, WrittenCollections)
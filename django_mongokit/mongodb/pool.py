@@ -0,0 +1,139 @@
+"""
+A pymongo connection pool that keeps statistics and closes sockets that
+have been idle for too long.
+
+pymongo (2.x) lets you swap the pool class with the `_pool_class` keyword
+argument. The DatabaseWrapper always does that so that `pool_stats()` has
+something to report. Idle sockets are closed as other sockets are returned
+to the pool so an entirely quiet pool keeps its sockets.
+"""
+
+import threading
+import time
+import weakref
+
+from pymongo import pool
+from pymongo.errors import ConnectionFailure
+
+
+class PoolStats(object):
+    """Counters shared by all the pools of one database alias. pymongo
+    creates a new pool after a disconnect so there might be more than one
+    over the lifetime of a connection."""
+
+    def __init__(self, max_size=None, min_size=0, max_idle_time=None):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.max_idle_time = max_idle_time
+        self.lock = threading.Lock()
+        self._pools = []
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.created = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.wait_timeouts = 0
+        self.reaped = 0
+
+    def add_pool(self, pool_):
+        self.lock.acquire()
+        try:
+            self._pools = [ref for ref in self._pools if ref() is not None]
+            self._pools.append(weakref.ref(pool_))
+        finally:
+            self.lock.release()
+
+    def increment(self, **counters):
+        self.lock.acquire()
+        try:
+            for key, value in counters.items():
+                setattr(self, key, getattr(self, key) + value)
+        finally:
+            self.lock.release()
+
+    def as_dict(self):
+        pools = [ref() for ref in self._pools]
+        pools = [pool_ for pool_ in pools if pool_ is not None]
+        return {
+            'max_size': self.max_size,
+            'min_size': self.min_size,
+            'checked_out': sum(pool_.checked_out() for pool_ in pools),
+            'idle': sum(len(pool_.sockets) for pool_ in pools),
+            'checkouts': self.checkouts,
+            'created': self.created,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'wait_timeouts': self.wait_timeouts,
+            'reaped': self.reaped,
+        }
+
+
+class StatsPool(pool.Pool):
+    """Use with functools.partial to pass in the `stats`."""
+
+    def __init__(self, *args, **kwargs):
+        self.stats = kwargs.pop('stats')
+        pool.Pool.__init__(self, *args, **kwargs)
+        self.stats.add_pool(self)
+
+    def checked_out(self):
+        # every socket that is out holds on to one semaphore slot
+        counter = getattr(self._socket_semaphore, 'counter', None)
+        if self.max_size is None or counter is None:
+            return 0
+        return self.max_size - counter
+
+    def connect(self):
+        sock_info = pool.Pool.connect(self)
+        self.stats.increment(created=1)
+        return sock_info
+
+    def get_socket(self, force=False):
+        waiting = (not force and self.max_size is not None and
+                   self.checked_out() >= self.max_size)
+        if not waiting:
+            sock_info = pool.Pool.get_socket(self, force=force)
+            self.stats.increment(checkouts=1)
+            return sock_info
+
+        t0 = time.time()
+        try:
+            sock_info = pool.Pool.get_socket(self, force=force)
+        except ConnectionFailure:
+            self.stats.increment(waits=1, wait_time=time.time() - t0,
+                                 wait_timeouts=1)
+            raise
+        self.stats.increment(checkouts=1, waits=1,
+                             wait_time=time.time() - t0)
+        return sock_info
+
+    def _return_socket(self, sock_info):
+        sock_info.last_returned = time.time()
+        pool.Pool._return_socket(self, sock_info)
+        self._reap_idle_sockets()
+
+    def _reap_idle_sockets(self):
+        if not self.stats.max_idle_time:
+            return
+        too_old = time.time() - self.stats.max_idle_time
+        self.lock.acquire()
+        try:
+            idle = sorted(
+                self.sockets,
+                key=lambda s: getattr(s, 'last_returned', s.last_checkout)
+            )
+            # never go below the minimum pool size
+            idle = idle[:max(len(idle) - self.stats.min_size, 0)]
+            reaped = [s for s in idle
+                      if getattr(s, 'last_returned', s.last_checkout) <
+                      too_old]
+            for sock_info in reaped:
+                self.sockets.discard(sock_info)
+        finally:
+            self.lock.release()
+        for sock_info in reaped:
+            sock_info.close()
+        if reaped:
+            self.stats.increment(reaped=len(reaped))
@@ -0,0 +1,65 @@
+"""
+In-memory MongoKit (MongoDB) backend for Django, e.g. for fast test runs.
+
+    DATABASES = {
+        ...
+        'mongodb': {
+            'ENGINE': 'django_mongokit.mongodb_memory',
+            'NAME': 'example',
+        },
+    }
+
+It works like `django_mongokit.mongodb` except that nothing leaves the
+process. What pymongo would have sent to mongod is answered by the
+MemoryServer instead and everything is gone when the process exits.
+"""
+
+from pymongo import helpers, message
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.mongo_client import MongoClient
+
+from django_mongokit.mongodb import base
+
+from server import server
+
+
+class MemoryClient(MongoClient):
+    """A MongoClient that never connects to anything"""
+
+    def _ensure_connected(self, sync=False):
+        pass
+
+    def alive(self):
+        return True
+
+    def _send_message(self, message, with_last_error=False, command=False):
+        response = server.process(message[1])
+        if not with_last_error:
+            return None
+        result = helpers._unpack_response(response)['data'][0]
+        error = result.get('err')
+        if error:
+            if result.get('code') in (11000, 11001, 12582):
+                raise DuplicateKeyError(error, result['code'], result)
+            raise OperationFailure(error, result.get('code'), result)
+        return result
+
+    def _send_message_with_response(self, message, _must_use_master=False,
+                                    **kwargs):
+        # there's no socket or pool to hand back
+        return (None, (server.process(message[1]), None, None))
+
+    def kill_cursors(self, cursor_ids):
+        if not isinstance(cursor_ids, list):
+            raise TypeError("cursor_ids must be a list")
+        server.process(message.kill_cursors(cursor_ids)[1])
+
+
+class ConnectionWrapper(base.ConnectionWrapper, MemoryClient):
+    pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _new_connection(self):
+        return ConnectionWrapper(_connect=False, **self._connection_kwargs)
@@ -0,0 +1,753 @@
+"""
+The query language of the in-memory engine: matching documents against a
+spec, sorting, projecting and applying update modifiers. It follows what
+MongoDB 2.x does closely enough for what pymongo, mongokit and
+django_mongokit send.
+"""
+
+import datetime
+import re
+from copy import deepcopy
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from bson.son import SON
+from bson.timestamp import Timestamp
+
+try:
+    from bson.regex import Regex
+except ImportError:  # pymongo < 2.7
+    Regex = None
+
+RE_TYPE = type(re.compile(''))
+
+# error codes the way the server sends them
+BAD_VALUE = 2
+DUPLICATE_KEY = 11000
+MOD_ON_ID = 10148
+COMMAND_NOT_FOUND = 59
+
+
+class EngineError(Exception):
+
+    def __init__(self, message, code=BAD_VALUE):
+        super(EngineError, self).__init__(message)
+        self.message = message
+        self.code = code
+
+
+def _is_number(value):
+    return (isinstance(value, (int, long, float)) and
+            not isinstance(value, bool))
+
+
+def _type_rank(value):
+    # the order MongoDB sorts values of different types in
+    if value is None:
+        return 1
+    if _is_number(value):
+        return 2
+    if isinstance(value, basestring):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, Binary):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, datetime.datetime):
+        return 9
+    if isinstance(value, Timestamp):
+        return 10
+    if isinstance(value, RE_TYPE) or (Regex and isinstance(value, Regex)):
+        return 11
+    return 12
+
+
+def sort_value(value):
+    rank = _type_rank(value)
+    if rank == 4:
+        return (rank, [(key, sort_value(sub_value))
+                       for key, sub_value in value.items()])
+    if rank == 5:
+        return (rank, [sort_value(each) for each in value])
+    if rank == 11:
+        return (rank, getattr(value, 'pattern', None))
+    if rank == 12:
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _compile(value, options=''):
+    if isinstance(value, RE_TYPE):
+        return value
+    if Regex and isinstance(value, Regex):
+        return value.try_compile()
+    flags = 0
+    for option, flag in (('i', re.I), ('m', re.M), ('s', re.S),
+                         ('x', re.X)):
+        if option in (options or ''):
+            flags |= flag
+    return re.compile(value, flags)
+
+
+def _is_regex(value):
+    return isinstance(value, RE_TYPE) or (Regex and isinstance(value, Regex))
+
+
+def resolve(value, parts):
+    """all the values at the dotted path `parts` in `value`. Arrays are
+    descended into so `tags.name` finds the name of every tag."""
+    if not parts:
+        return [value]
+    key, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if key in value:
+            return resolve(value[key], rest)
+        return []
+    if isinstance(value, list):
+        results = []
+        if key.isdigit() and int(key) < len(value):
+            results.extend(resolve(value[int(key)], rest))
+        for item in value:
+            if isinstance(item, dict):
+                results.extend(resolve(item, parts))
+        return results
+    return []
+
+
+def _expanded(values):
+    # a query on an array field also matches its elements
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _equals(a, b):
+    if _is_regex(b):
+        return isinstance(a, basestring) and bool(_compile(b).search(a))
+    if _is_number(a) and _is_number(b):
+        return a == b
+    if type(a) != type(b) and _type_rank(a) != _type_rank(b):
+        return False
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.items() == b.items()
+    return a == b
+
+
+def _compare(values, operand, test):
+    for value in _expanded(values):
+        if _type_rank(value) == _type_rank(operand) and \
+           test(sort_value(value), sort_value(operand)):
+            return True
+    return False
+
+
+def _matches_value(values, condition):
+    """whether `values` (as found by resolve()) satisfy `condition` which
+    is a value or a dict of operators"""
+    if (isinstance(condition, dict) and condition and
+        [key for key in condition if key.startswith('$')]):
+        for operator, operand in condition.items():
+            if not _operator(values, operator, operand, condition):
+                return False
+        return True
+    if condition is None:
+        return not values or None in _expanded(values)
+    return [value for value in _expanded(values)
+            if _equals(value, condition)] != []
+
+
+def _operator(values, operator, operand, condition):
+    if operator == '$eq':
+        return _matches_value(values, operand)
+    if operator == '$ne':
+        return not _matches_value(values, operand)
+    if operator == '$gt':
+        return _compare(values, operand, lambda a, b: a > b)
+    if operator == '$gte':
+        return _compare(values, operand, lambda a, b: a >= b)
+    if operator == '$lt':
+        return _compare(values, operand, lambda a, b: a < b)
+    if operator == '$lte':
+        return _compare(values, operand, lambda a, b: a <= b)
+    if operator == '$in':
+        return [each for each in operand
+                if _matches_value(values, each)] != []
+    if operator == '$nin':
+        return not [each for each in operand
+                    if _matches_value(values, each)]
+    if operator == '$all':
+        return bool(values) and not [each for each in operand
+                                     if not _matches_value(values, each)]
+    if operator == '$size':
+        return [value for value in values
+                if isinstance(value, list) and len(value) == operand] != []
+    if operator == '$exists':
+        return bool(values) == bool(operand)
+    if operator == '$regex':
+        regex = _compile(operand, condition.get('$options'))
+        return [value for value in _expanded(values)
+                if isinstance(value, basestring) and
+                regex.search(value)] != []
+    if operator == '$options':
+        return True
+    if operator == '$not':
+        return not _matches_value(values, operand)
+    if operator == '$mod':
+        divisor, remainder = operand
+        return [value for value in _expanded(values)
+                if _is_number(value) and
+                value % divisor == remainder] != []
+    if operator == '$elemMatch':
+        for value in values:
+            if not isinstance(value, list):
+                continue
+            for item in value:
+                if [key for key in operand if key.startswith('$')]:
+                    if _matches_value([item], operand):
+                        return True
+                elif isinstance(item, dict) and matches(item, operand):
+                    return True
+        return False
+    if operator == '$type':
+        return [value for value in _expanded(values)
+                if _bson_type(value) == operand] != []
+    raise EngineError("bad query: unknown operator %s" % operator)
+
+
+def _bson_type(value):
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, float):
+        return 1
+    if isinstance(value, basestring):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, Binary):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    if value is None:
+        return 10
+    if _is_regex(value):
+        return 11
+    if isinstance(value, int):
+        return 16
+    if isinstance(value, Timestamp):
+        return 17
+    if isinstance(value, long):
+        return 18
+    return None
+
+
+def matches(document, spec):
+    """whether `document` matches the query `spec`"""
+    for key, condition in spec.items():
+        if key == '$and':
+            if [sub_spec for sub_spec in condition
+                if not matches(document, sub_spec)]:
+                return False
+        elif key == '$or':
+            if not [sub_spec for sub_spec in condition
+                    if matches(document, sub_spec)]:
+                return False
+        elif key == '$nor':
+            if [sub_spec for sub_spec in condition
+                if matches(document, sub_spec)]:
+                return False
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            raise EngineError("bad query: %s is not supported" % key)
+        elif not _matches_value(resolve(document, key.split('.')),
+                                condition):
+            return False
+    return True
+
+
+def sort_documents(documents, sort):
+    """sort in place by a list of (key, direction)"""
+    # Python's sort is stable so sorting by the last key first works
+    for key, direction in reversed(list(sort)):
+        descending = direction < 0
+
+        def sort_key(document, key=key, descending=descending):
+            values = resolve(document, key.split('.'))
+            values = _expanded(values)
+            if not values:
+                return sort_value(None)
+            keys = [sort_value(value) for value in values]
+            # arrays sort by their smallest (or largest) element
+            return descending and max(keys) or min(keys)
+
+        documents.sort(key=sort_key, reverse=descending)
+    return documents
+
+
+def project(document, fields):
+    """a copy of `document` with only the fields that `fields` (a dict
+    like {'topic': 1} or {'tags': 0}) asks for"""
+    if not fields:
+        return document
+    fields = dict(fields)
+    include_id = fields.pop('_id', 1)
+    including = [value for value in fields.values() if value]
+    if including:
+        result = SON()
+        if include_id and '_id' in document:
+            result['_id'] = document['_id']
+        for path in fields:
+            _copy_path(document, result, path.split('.'))
+        return result
+    result = deepcopy(document)
+    if not include_id:
+        result.pop('_id', None)
+    for path in fields:
+        _remove_path(result, path.split('.'))
+    return result
+
+
+def _copy_path(source, target, parts):
+    key = parts[0]
+    if not isinstance(source, dict) or key not in source:
+        return
+    if len(parts) == 1:
+        target[key] = deepcopy(source[key])
+    elif isinstance(source[key], dict):
+        sub_target = target.setdefault(key, SON())
+        _copy_path(source[key], sub_target, parts[1:])
+    elif isinstance(source[key], list):
+        items = target.setdefault(key, [])
+        for i, item in enumerate(source[key]):
+            if isinstance(item, dict):
+                if len(items) <= i:
+                    items.append(SON())
+                _copy_path(item, items[i], parts[1:])
+
+
+def _remove_path(document, parts):
+    if isinstance(document, list):
+        for item in document:
+            _remove_path(item, parts)
+        return
+    if not isinstance(document, dict) or parts[0] not in document:
+        return
+    if len(parts) == 1:
+        del document[parts[0]]
+    else:
+        _remove_path(document[parts[0]], parts[1:])
+
+
+def _container(document, parts, create=True):
+    """return the dict (or list) that holds the last part of the path"""
+    for key in parts[:-1]:
+        if isinstance(document, list):
+            if not key.isdigit():
+                raise EngineError("can't append to array using string "
+                                  "field name [%s]" % key)
+            index = int(key)
+            while create and len(document) <= index:
+                document.append(None)
+            if index >= len(document):
+                return None
+            if document[index] is None and create:
+                document[index] = SON()
+            document = document[index]
+        elif isinstance(document, dict):
+            if key not in document:
+                if not create:
+                    return None
+                document[key] = SON()
+            document = document[key]
+        else:
+            if not create:
+                return None
+            raise EngineError("cannot use the part (%s) to traverse the "
+                              "element" % key)
+    return document
+
+
+def _get(document, path):
+    parts = path.split('.')
+    container = _container(document, parts, create=False)
+    key = parts[-1]
+    if isinstance(container, dict):
+        return container.get(key, None), key in container
+    if isinstance(container, list) and key.isdigit() and \
+       int(key) < len(container):
+        return container[int(key)], True
+    return None, False
+
+
+def _set(document, path, value):
+    parts = path.split('.')
+    container = _container(document, parts)
+    key = parts[-1]
+    if isinstance(container, list):
+        index = int(key)
+        while len(container) <= index:
+            container.append(None)
+        container[index] = value
+    else:
+        container[key] = value
+
+
+def _unset(document, path):
+    parts = path.split('.')
+    container = _container(document, parts, create=False)
+    key = parts[-1]
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key.isdigit() and \
+         int(key) < len(container):
+        container[int(key)] = None
+
+
+def _array(document, path, operator):
+    value, exists = _get(document, path)
+    if not exists:
+        value = []
+        _set(document, path, value)
+    if not isinstance(value, list):
+        raise EngineError("Cannot apply %s modifier to non-array" % operator)
+    return value
+
+
+def _each(operand):
+    if isinstance(operand, dict) and '$each' in operand:
+        return list(operand['$each'])
+    return [operand]
+
+
+def is_replacement(update):
+    return not [key for key in update if key.startswith('$')]
+
+
+def apply_update(document, update, inserting=False):
+    """apply the modifiers in `update` to a copy of `document` and return
+    the copy. A document without modifiers replaces all but the `_id`."""
+    if is_replacement(update):
+        if ('_id' in update and '_id' in document and
+            update['_id'] != document['_id']):
+            raise EngineError("Mod on _id not allowed", MOD_ON_ID)
+        result = SON()
+        if '_id' in document:
+            result['_id'] = document['_id']
+        for key, value in update.items():
+            if key != '_id':
+                result[key] = deepcopy(value)
+        return result
+
+    document = deepcopy(document)
+    for operator, changes in update.items():
+        for path, operand in changes.items():
+            if path == '_id' or path.startswith('_id.'):
+                current, exists = _get(document, '_id')
+                if not (operator == '$set' and operand == current):
+                    if not (operator == '$setOnInsert' and inserting):
+                        raise EngineError("Mod on _id not allowed",
+                                          MOD_ON_ID)
+            _modify(document, operator, path, deepcopy(operand), inserting)
+    return document
+
+
+def _modify(document, operator, path, operand, inserting):
+    if operator == '$set':
+        _set(document, path, operand)
+    elif operator == '$setOnInsert':
+        if inserting:
+            _set(document, path, operand)
+    elif operator == '$unset':
+        _unset(document, path)
+    elif operator in ('$inc', '$mul'):
+        if not _is_number(operand):
+            raise EngineError("Cannot %s with non-numeric argument" %
+                              operator[1:])
+        value, exists = _get(document, path)
+        if exists and not _is_number(value):
+            raise EngineError("Cannot apply %s modifier to non-number" %
+                              operator)
+        if operator == '$inc':
+            _set(document, path, (value or 0) + operand)
+        else:
+            _set(document, path, (value or 0) * operand)
+    elif operator in ('$min', '$max'):
+        value, exists = _get(document, path)
+        smaller = sort_value(operand) < sort_value(value)
+        if not exists or (operator == '$min') == smaller:
+            _set(document, path, operand)
+    elif operator == '$rename':
+        value, exists = _get(document, path)
+        if exists:
+            _unset(document, path)
+            _set(document, operand, value)
+    elif operator == '$currentDate':
+        _set(document, path, datetime.datetime.utcnow())
+    elif operator == '$push':
+        array = _array(document, path, operator)
+        array.extend(_each(operand))
+        if isinstance(operand, dict) and '$each' in operand:
+            if '$sort' in operand:
+                sort = operand['$sort']
+                if isinstance(sort, dict):
+                    sort_documents(array, sort.items())
+                else:
+                    array.sort(key=sort_value, reverse=sort < 0)
+            if '$slice' in operand:
+                limit = operand['$slice']
+                array[:] = limit < 0 and array[limit:] or array[:limit]
+    elif operator == '$pushAll':
+        _array(document, path, operator).extend(operand)
+    elif operator == '$addToSet':
+        array = _array(document, path, operator)
+        for value in _each(operand):
+            if not [each for each in array if _equals(each, value)]:
+                array.append(value)
+    elif operator == '$pop':
+        array = _array(document, path, operator)
+        if array:
+            if operand < 0:
+                array.pop(0)
+            else:
+                array.pop()
+    elif operator == '$pull':
+        array = _array(document, path, operator)
+        array[:] = [item for item in array
+                    if not _pulls(item, operand)]
+    elif operator == '$pullAll':
+        array = _array(document, path, operator)
+        array[:] = [item for item in array
+                    if not [each for each in operand if _equals(item, each)]]
+    else:
+        raise EngineError("Invalid modifier specified %s" % operator)
+
+
+def _pulls(item, condition):
+    if isinstance(condition, dict) and condition:
+        if [key for key in condition if key.startswith('$')]:
+            return _matches_value([item], condition)
+        return isinstance(item, dict) and matches(item, condition)
+    return _equals(item, condition)
+
+
+def upsert_document(spec):
+    """the document an upsert starts from: the equality parts of `spec`"""
+    document = SON()
+    for key, value in spec.items():
+        if key == '$and':
+            for sub_spec in value:
+                for sub_key, sub_value in upsert_document(sub_spec).items():
+                    document[sub_key] = sub_value
+        elif key.startswith('$'):
+            continue
+        elif (isinstance(value, dict) and
+              [op for op in value if op.startswith('$')]):
+            if '$eq' in value:
+                _set(document, key, deepcopy(value['$eq']))
+        else:
+            _set(document, key, deepcopy(value))
+    return document
+
+
+def distinct_values(documents, key):
+    values = []
+    for document in documents:
+        for value in _expanded(resolve(document, key.split('.'))):
+            if isinstance(value, list):
+                continue
+            if not [each for each in values if _equals(each, value)]:
+                values.append(value)
+    return values
+
+
+def id_key(value):
+    """a hashable version of an `_id`"""
+    if isinstance(value, dict):
+        return ('dict', tuple((key, id_key(sub_value))
+                              for key, sub_value in value.items()))
+    if isinstance(value, list):
+        return ('list', tuple(id_key(each) for each in value))
+    if _is_number(value):
+        return ('number', value)
+    return (type(value).__name__, value)
+
+
+# aggregation
+
+def _field_value(value, parts):
+    # like resolve() but the way aggregation expressions see a path:
+    # arrays of embedded documents give an array of their values
+    for i, key in enumerate(parts):
+        if isinstance(value, list):
+            return [each for each in
+                    [_field_value(item, parts[i:]) for item in value
+                     if isinstance(item, dict)]
+                    if each is not None]
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def evaluate(document, expression):
+    """the value of an aggregation `expression` for `document`:
+    '$field.path' references, embedded documents of expressions and
+    literals"""
+    if isinstance(expression, basestring) and expression.startswith('$'):
+        return _field_value(document, expression[1:].split('.'))
+    if isinstance(expression, dict):
+        operators = [key for key in expression if key.startswith('$')]
+        if operators:
+            if operators == ['$literal']:
+                return expression['$literal']
+            raise EngineError("unsupported expression %s" % operators[0],
+                              15999)
+        return SON([(key, evaluate(document, value))
+                    for key, value in expression.items()])
+    if isinstance(expression, list):
+        return [evaluate(document, each) for each in expression]
+    return expression
+
+
+def _accumulate(operator, values):
+    if operator == '$sum':
+        return sum(value for value in values if _is_number(value))
+    if operator == '$avg':
+        numbers = [value for value in values if _is_number(value)]
+        return numbers and float(sum(numbers)) / len(numbers) or None
+    if operator in ('$min', '$max'):
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        pick = operator == '$min' and min or max
+        return pick(values, key=sort_value)
+    if operator == '$first':
+        return values[0] if values else None
+    if operator == '$last':
+        return values[-1] if values else None
+    if operator == '$push':
+        return list(values)
+    if operator == '$addToSet':
+        unique = []
+        for value in values:
+            if not [each for each in unique if _equals(each, value)]:
+                unique.append(value)
+        return unique
+    raise EngineError("unknown group operator '%s'" % operator, 15952)
+
+
+def _group(documents, specification):
+    if '_id' not in specification:
+        raise EngineError("a group specification must include an _id",
+                          15955)
+    groups = OrderedDict()
+    for document in documents:
+        _id = evaluate(document, specification['_id'])
+        key = id_key(_id)
+        if key not in groups:
+            groups[key] = (_id, [])
+        groups[key][1].append(document)
+    results = []
+    for _id, members in groups.values():
+        result = SON([('_id', _id)])
+        for name, accumulator in specification.items():
+            if name == '_id':
+                continue
+            operator, expression = accumulator.items()[0]
+            result[name] = _accumulate(operator,
+                                       [evaluate(member, expression)
+                                        for member in members])
+        results.append(result)
+    return results
+
+
+def _unwind(documents, path):
+    if isinstance(path, dict):
+        path = path['path']
+    path = path[1:]
+    results = []
+    for document in documents:
+        values, found = _get(document, path)
+        if not found or values is None or values == []:
+            continue
+        if not isinstance(values, list):
+            results.append(document)
+            continue
+        for value in values:
+            unwound = deepcopy(document)
+            _set(unwound, path, deepcopy(value))
+            results.append(unwound)
+    return results
+
+
+def _project(document, specification):
+    specification = dict(specification)
+    if not [value for key, value in specification.items()
+            if key != '_id' and value not in (0, False)]:
+        return project(document, specification)
+    include_id = specification.pop('_id', 1)
+    result = SON()
+    if include_id in (1, True) and '_id' in document:
+        result['_id'] = document['_id']
+    elif include_id not in (0, False):
+        result['_id'] = evaluate(document, include_id)
+    for path, value in specification.items():
+        if value in (0, False):
+            continue
+        if isinstance(value, bool) or _is_number(value):
+            _copy_path(document, result, path.split('.'))
+        else:
+            _set(result, path, evaluate(document, value))
+    return result
+
+
+def aggregate(documents, pipeline):
+    """run the stages of an aggregation `pipeline` over `documents`, which
+    are left as they are"""
+    documents = list(documents)
+    for stage in pipeline:
+        if len(stage) != 1:
+            raise EngineError("A pipeline stage specification object must "
+                              "contain exactly one field.", 16435)
+        name, specification = stage.items()[0]
+        if name == '$match':
+            documents = [document for document in documents
+                         if matches(document, specification)]
+        elif name == '$project':
+            documents = [_project(document, specification)
+                         for document in documents]
+        elif name == '$group':
+            documents = _group(documents, specification)
+        elif name == '$unwind':
+            documents = _unwind(documents, specification)
+        elif name == '$sort':
+            documents = sort_documents(list(documents),
+                                       specification.items())
+        elif name == '$skip':
+            documents = documents[int(specification):]
+        elif name == '$limit':
+            documents = documents[:int(specification)]
+        elif name == '$count':
+            documents = [SON([(specification, len(documents))])]
+        else:
+            raise EngineError("Unrecognized pipeline stage name: '%s'" %
+                              name, 16436)
+    return documents
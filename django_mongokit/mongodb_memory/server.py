@@ -0,0 +1,662 @@
+"""
+A MongoDB "server" that lives in the Python process.
+
+It takes the same messages pymongo would write to a socket and returns the
+same replies a mongod (2.4 or so) would, so everything above the socket --
+pymongo's collections and cursors, mongokit and django_mongokit -- works
+unchanged. Writes use the legacy opcodes followed by getLastError since the
+client says the server speaks wire version 0.
+"""
+
+import itertools
+import struct
+import threading
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+import bson
+from bson.objectid import ObjectId
+from bson.son import SON
+
+from engine import (
+    COMMAND_NOT_FOUND,
+    DUPLICATE_KEY,
+    EngineError,
+    aggregate,
+    apply_update,
+    distinct_values,
+    id_key,
+    is_replacement,
+    matches,
+    project,
+    resolve,
+    sort_documents,
+    upsert_document,
+)
+
+OP_REPLY = 1
+OP_UPDATE = 2001
+OP_INSERT = 2002
+OP_QUERY = 2004
+OP_GET_MORE = 2005
+OP_DELETE = 2006
+OP_KILL_CURSORS = 2007
+
+# flags
+REPLY_CURSOR_NOT_FOUND = 1
+REPLY_QUERY_FAILURE = 2
+QUERY_EXHAUST = 64
+UPDATE_UPSERT = 1
+UPDATE_MULTI = 2
+INSERT_CONTINUE_ON_ERROR = 1
+DELETE_SINGLE = 1
+
+VERSION = '2.4.0'
+MAX_BSON_SIZE = 16 * 1024 * 1024
+# what a command cursor returns at first unless it's told otherwise
+FIRST_BATCH_SIZE = 101
+
+
+def _cstring(data, position):
+    end = data.index('\x00', position)
+    return data[position:end], end + 1
+
+
+def _int(data, position):
+    return struct.unpack('<i', data[position:position + 4])[0], position + 4
+
+
+def _document(data, position):
+    length = _int(data, position)[0]
+    document = bson.BSON(data[position:position + length]).decode(
+        as_class=SON
+    )
+    return document, position + length
+
+
+def _split_namespace(namespace):
+    database, __, collection = namespace.partition('.')
+    return database, collection
+
+
+def reply(documents, cursor_id=0, starting_from=0, flags=0):
+    """an OP_REPLY without its header like pymongo expects it"""
+    return (struct.pack('<iqii', flags, cursor_id, starting_from,
+                        len(documents)) +
+            ''.join(bson.BSON.encode(document) for document in documents))
+
+
+class Collection(object):
+
+    def __init__(self, name):
+        self.name = name
+        # in insertion order, keyed by id_key(_id)
+        self.documents = OrderedDict()
+
+    def find(self, spec):
+        """the stored documents matching `spec` (not copies)"""
+        if '_id' in spec and len(spec) == 1 and not (
+            isinstance(spec['_id'], dict) and
+            [key for key in spec['_id'] if key.startswith('$')]
+        ):
+            # the most common query there is
+            document = self.documents.get(id_key(spec['_id']))
+            return document is not None and [document] or []
+        if not spec:
+            return self.documents.values()
+        return [each for each in self.documents.values()
+                if matches(each, spec)]
+
+
+class Database(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.collections = {}
+
+
+class MemoryServer(object):
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.databases = {}
+        # cursor id -> (namespace, documents still to be returned)
+        self.cursors = {}
+        self._cursor_ids = itertools.count(1)
+
+    # storage
+
+    def get_collection(self, database_name, collection_name, create=False):
+        database = self.databases.get(database_name)
+        if database is None:
+            if not create:
+                return None
+            database = self.databases[database_name] = Database(database_name)
+        collection = database.collections.get(collection_name)
+        if collection is None and create:
+            collection = Collection(collection_name)
+            database.collections[collection_name] = collection
+            if not collection_name.startswith('system.'):
+                self._add_index(database_name, collection_name,
+                                SON([('v', 1),
+                                     ('key', SON([('_id', 1)])),
+                                     ('name', '_id_'),
+                                     ('ns', '%s.%s' % (database_name,
+                                                       collection_name))]))
+        return collection
+
+    def _indexes(self, database_name, collection_name):
+        indexes = self.get_collection(database_name, 'system.indexes')
+        if indexes is None:
+            return []
+        namespace = '%s.%s' % (database_name, collection_name)
+        return [index for index in indexes.documents.values()
+                if index.get('ns') == namespace]
+
+    def _add_index(self, database_name, collection_name, index):
+        namespace = '%s.%s' % (database_name, collection_name)
+        for existing in self._indexes(database_name, collection_name):
+            if existing['name'] == index['name']:
+                return
+        index = SON(index)
+        index['ns'] = namespace
+        index.setdefault('v', 1)
+        if index.get('unique'):
+            collection = self.get_collection(database_name, collection_name,
+                                             create=True)
+            self._check_unique(database_name, collection,
+                               list(collection.documents.values()), [index])
+        indexes = self.get_collection(database_name, 'system.indexes',
+                                      create=True)
+        index['_id'] = ObjectId()
+        indexes.documents[id_key(index['_id'])] = index
+        # make sure the collection exists
+        self.get_collection(database_name, collection_name, create=True)
+
+    def _check_unique(self, database_name, collection, documents,
+                      indexes=None):
+        """raise a duplicate key error if storing `documents` would break a
+        unique index"""
+        if indexes is None:
+            indexes = self._indexes(database_name, collection.name)
+        for index in indexes:
+            if not index.get('unique') or index['name'] == '_id_':
+                continue
+            fields = index['key'].keys()
+            seen = {}
+            ids = set(id_key(document.get('_id')) for document in documents)
+            candidates = [document for key, document
+                          in collection.documents.items() if key not in ids]
+            for document in candidates + documents:
+                values = [resolve(document, field.split('.'))
+                          for field in fields]
+                if index.get('sparse') and not [each for each in values
+                                                if each]:
+                    continue
+                key = tuple(id_key(each[0]) for each in
+                            [each or [None] for each in values])
+                if key in seen and seen[key] != id_key(document.get('_id')):
+                    raise EngineError(
+                        "E11000 duplicate key error index: %s.$%s  dup key" %
+                        (index['ns'], index['name']),
+                        DUPLICATE_KEY
+                    )
+                seen[key] = id_key(document.get('_id'))
+
+    # the protocol
+
+    def process(self, data):
+        """process one or more messages and return the reply to the last one
+        (or None if it didn't get one)"""
+        self.lock.acquire()
+        try:
+            last_error = {'err': None, 'n': 0}
+            response = None
+            position = 0
+            while position < len(data):
+                length = _int(data, position)[0]
+                message = data[position:position + length]
+                response = self._process_one(message, last_error)
+                position += length
+            return response
+        finally:
+            self.lock.release()
+
+    def _process_one(self, message, last_error):
+        operation = _int(message, 12)[0]
+        if operation == OP_QUERY:
+            return self._query(message, last_error)
+        if operation == OP_GET_MORE:
+            return self._get_more(message)
+        if operation == OP_KILL_CURSORS:
+            count, position = _int(message, 20)
+            for i in range(count):
+                cursor_id = struct.unpack(
+                    '<q', message[position + i * 8:position + i * 8 + 8]
+                )[0]
+                self.cursors.pop(cursor_id, None)
+            return None
+
+        last_error.clear()
+        last_error.update({'err': None, 'n': 0})
+        try:
+            if operation == OP_INSERT:
+                self._insert(message, last_error)
+            elif operation == OP_UPDATE:
+                self._update(message, last_error)
+            elif operation == OP_DELETE:
+                self._delete(message, last_error)
+            else:
+                raise EngineError("unknown opcode %s" % operation)
+        except EngineError, exception:
+            last_error['err'] = exception.message
+            last_error['code'] = exception.code
+        return None
+
+    def _insert(self, message, last_error):
+        flags, position = _int(message, 16)
+        namespace, position = _cstring(message, position)
+        database_name, collection_name = _split_namespace(namespace)
+        documents = []
+        while position < len(message):
+            document, position = _document(message, position)
+            documents.append(document)
+        if collection_name == 'system.indexes':
+            for index in documents:
+                __, indexed = _split_namespace(index['ns'])
+                self._add_index(database_name, indexed, index)
+            return
+        collection = self.get_collection(database_name, collection_name,
+                                         create=True)
+        error = None
+        for document in documents:
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+                # like the server, _id goes first
+                document = SON([('_id', document.pop('_id'))] +
+                               document.items())
+            try:
+                if id_key(document['_id']) in collection.documents:
+                    raise EngineError(
+                        "E11000 duplicate key error index: %s.$_id_  "
+                        "dup key: { : %r }" % (namespace, document['_id']),
+                        DUPLICATE_KEY
+                    )
+                self._check_unique(database_name, collection, [document])
+            except EngineError, exception:
+                if not flags & INSERT_CONTINUE_ON_ERROR:
+                    raise
+                # the server reports the last error
+                error = exception
+                continue
+            collection.documents[id_key(document['_id'])] = document
+        if error is not None:
+            raise error
+
+    def _update(self, message, last_error):
+        position = 20
+        namespace, position = _cstring(message, position)
+        flags, position = _int(message, position)
+        spec, position = _document(message, position)
+        update, position = _document(message, position)
+        database_name, collection_name = _split_namespace(namespace)
+        collection = self.get_collection(database_name, collection_name,
+                                         create=bool(flags & UPDATE_UPSERT))
+
+        found = collection is not None and collection.find(spec) or []
+        if found and not flags & UPDATE_MULTI:
+            found = found[:1]
+        if found and flags & UPDATE_MULTI and is_replacement(update):
+            raise EngineError("multi update only works with $ operators",
+                              10158)
+        updated = [apply_update(document, update) for document in found]
+        if updated:
+            self._check_unique(database_name, collection, updated)
+        for document in updated:
+            collection.documents[id_key(document['_id'])] = document
+        last_error['n'] = len(updated)
+        last_error['updatedExisting'] = bool(updated)
+
+        if not found and flags & UPDATE_UPSERT:
+            document = upsert_document(spec)
+            if is_replacement(update):
+                replacement = apply_update(SON(), update)
+                if '_id' in document:
+                    replacement['_id'] = document['_id']
+                document = replacement
+            else:
+                document = apply_update(document, update, inserting=True)
+            if '_id' not in document:
+                document['_id'] = ObjectId()
+            document = SON([('_id', document.pop('_id'))] + document.items())
+            if id_key(document['_id']) in collection.documents:
+                raise EngineError("E11000 duplicate key error index: "
+                                  "%s.$_id_" % namespace, DUPLICATE_KEY)
+            self._check_unique(database_name, collection, [document])
+            collection.documents[id_key(document['_id'])] = document
+            last_error['n'] = 1
+            last_error['upserted'] = document['_id']
+
+    def _delete(self, message, last_error):
+        position = 20
+        namespace, position = _cstring(message, position)
+        flags, position = _int(message, position)
+        spec, position = _document(message, position)
+        database_name, collection_name = _split_namespace(namespace)
+        collection = self.get_collection(database_name, collection_name)
+        if collection is None:
+            return
+        found = collection.find(spec)
+        if flags & DELETE_SINGLE:
+            found = found[:1]
+        for document in list(found):
+            del collection.documents[id_key(document['_id'])]
+        last_error['n'] = len(found)
+
+    def _query(self, message, last_error):
+        flags, position = _int(message, 16)
+        namespace, position = _cstring(message, position)
+        skip, position = _int(message, position)
+        limit, position = _int(message, position)
+        query, position = _document(message, position)
+        fields = None
+        if position < len(message):
+            fields, position = _document(message, position)
+        database_name, collection_name = _split_namespace(namespace)
+
+        if collection_name == '$cmd':
+            if '$query' in query:
+                query = query['$query']
+            return reply([self.command(database_name, query, last_error)])
+
+        try:
+            if '$query' in query or '$orderby' in query:
+                spec = query.get('$query', {})
+                sort = query.get('$orderby')
+                explain = query.get('$explain')
+            else:
+                spec, sort, explain = query, None, False
+            documents = self.find(database_name, collection_name, spec,
+                                  sort=sort and sort.items() or None)
+        except EngineError, exception:
+            return reply([{'$err': exception.message,
+                           'code': exception.code}],
+                         flags=REPLY_QUERY_FAILURE)
+
+        documents = documents[skip:]
+        if explain:
+            if limit:
+                documents = documents[:abs(limit)]
+            return reply([self._explain(database_name, collection_name,
+                                        spec, documents)])
+        documents = [project(document, fields) for document in documents]
+        close = limit < 0 or limit == 1 or flags & QUERY_EXHAUST
+        limit = abs(limit)
+        if not limit or flags & QUERY_EXHAUST:
+            return reply(documents)
+        batch, rest = documents[:limit], documents[limit:]
+        if close or not rest:
+            return reply(batch)
+        cursor_id = self._cursor_ids.next()
+        self.cursors[cursor_id] = (namespace, rest, len(batch))
+        return reply(batch, cursor_id=cursor_id)
+
+    def _get_more(self, message):
+        position = 20
+        namespace, position = _cstring(message, position)
+        limit, position = _int(message, position)
+        cursor_id = struct.unpack('<q', message[position:position + 8])[0]
+        if cursor_id not in self.cursors:
+            return reply([], flags=REPLY_CURSOR_NOT_FOUND)
+        namespace, documents, starting_from = self.cursors.pop(cursor_id)
+        limit = abs(limit)
+        if not limit:
+            return reply(documents, starting_from=starting_from)
+        batch, rest = documents[:limit], documents[limit:]
+        if not rest:
+            return reply(batch, starting_from=starting_from)
+        self.cursors[cursor_id] = (namespace, rest,
+                                   starting_from + len(batch))
+        return reply(batch, cursor_id=cursor_id, starting_from=starting_from)
+
+    def find(self, database_name, collection_name, spec, sort=None):
+        if collection_name == 'system.namespaces':
+            database = self.databases.get(database_name)
+            names = database and sorted(database.collections) or []
+            documents = [SON([('name', '%s.%s' % (database_name, name))])
+                         for name in names]
+            return [document for document in documents
+                    if matches(document, spec)]
+        collection = self.get_collection(database_name, collection_name)
+        if collection is None:
+            return []
+        documents = list(collection.find(spec))
+        if sort:
+            sort_documents(documents, sort)
+        return documents
+
+    def _explain(self, database_name, collection_name, spec, documents):
+        cursor = 'BasicCursor'
+        for index in self._indexes(database_name, collection_name):
+            if index['key'].keys()[0] in spec:
+                cursor = 'BtreeCursor %s' % index['name']
+                break
+        collection = self.get_collection(database_name, collection_name)
+        scanned = collection and len(collection.documents) or 0
+        return SON([('cursor', cursor), ('n', len(documents)),
+                    ('nscannedObjects', scanned), ('nscanned', scanned),
+                    ('millis', 0), ('indexBounds', {})])
+
+    # commands
+
+    def command(self, database_name, query, last_error=None):
+        name = query.keys()[0]
+        handler = getattr(self, '_command_%s' % name.lower(), None)
+        if handler is None:
+            return SON([('ok', 0.0), ('errmsg', "no such cmd: %s" % name),
+                        ('code', COMMAND_NOT_FOUND),
+                        ('bad cmd', query)])
+        try:
+            result = handler(database_name, query[name], query, last_error)
+        except EngineError, exception:
+            return SON([('ok', 0.0), ('errmsg', exception.message),
+                        ('code', exception.code)])
+        result['ok'] = 1.0
+        return result
+
+    def _command_getlasterror(self, database_name, value, query, last_error):
+        result = SON(last_error or {'err': None, 'n': 0})
+        result.setdefault('err', None)
+        result['connectionId'] = 1
+        return result
+
+    def _command_ismaster(self, database_name, value, query, last_error):
+        return SON([('ismaster', True), ('maxBsonObjectSize', MAX_BSON_SIZE),
+                    ('maxWireVersion', 0), ('minWireVersion', 0)])
+
+    def _command_buildinfo(self, database_name, value, query, last_error):
+        return SON([('version', VERSION),
+                    ('versionArray', [int(part) for part in VERSION.split('.')]
+                     + [0]),
+                    ('maxBsonObjectSize', MAX_BSON_SIZE)])
+
+    def _command_ping(self, database_name, value, query, last_error):
+        return SON()
+
+    def _command_listdatabases(self, database_name, value, query, last_error):
+        databases = [SON([('name', name), ('sizeOnDisk', 1.0),
+                          ('empty', False)])
+                     for name in sorted(self.databases)]
+        return SON([('databases', databases), ('totalSize', 1.0)])
+
+    def _command_dropdatabase(self, database_name, value, query, last_error):
+        self.databases.pop(database_name, None)
+        return SON([('dropped', database_name)])
+
+    def _command_create(self, database_name, value, query, last_error):
+        if self.get_collection(database_name, value) is not None:
+            raise EngineError("collection already exists", 48)
+        self.get_collection(database_name, value, create=True)
+        return SON()
+
+    def _command_drop(self, database_name, value, query, last_error):
+        database = self.databases.get(database_name)
+        if database is None or value not in database.collections:
+            raise EngineError("ns not found", 26)
+        del database.collections[value]
+        self._drop_indexes(database_name, value, '*', keep_id=False)
+        return SON([('ns', '%s.%s' % (database_name, value))])
+
+    def _command_renamecollection(self, database_name, value, query,
+                                  last_error):
+        from_database, from_name = _split_namespace(value)
+        to_database, to_name = _split_namespace(query['to'])
+        collection = self.get_collection(from_database, from_name)
+        if collection is None:
+            raise EngineError("source namespace does not exist", 26)
+        if self.get_collection(to_database, to_name) is not None:
+            if not query.get('dropTarget'):
+                raise EngineError("target namespace exists", 48)
+            self._command_drop(to_database, to_name, {}, None)
+        del self.databases[from_database].collections[from_name]
+        indexes = self._indexes(from_database, from_name)
+        self._drop_indexes(from_database, from_name, '*', keep_id=False)
+        target = self.get_collection(to_database, to_name, create=True)
+        target.documents = collection.documents
+        for index in indexes:
+            if index['name'] != '_id_':
+                self._add_index(to_database, to_name, index)
+        return SON()
+
+    def _command_createindexes(self, database_name, value, query,
+                               last_error):
+        before = len(self._indexes(database_name, value))
+        for index in query['indexes']:
+            self._add_index(database_name, value, index)
+        return SON([('numIndexesBefore', before),
+                    ('numIndexesAfter',
+                     len(self._indexes(database_name, value)))])
+
+    def _drop_indexes(self, database_name, collection_name, name,
+                      keep_id=True):
+        indexes = self.get_collection(database_name, 'system.indexes')
+        if indexes is None:
+            return 0
+        dropped = 0
+        for index in self._indexes(database_name, collection_name):
+            if keep_id and index['name'] == '_id_':
+                continue
+            if name == '*' or index['name'] == name:
+                del indexes.documents[id_key(index['_id'])]
+                dropped += 1
+        return dropped
+
+    def _command_dropindexes(self, database_name, value, query, last_error):
+        before = len(self._indexes(database_name, value))
+        name = query['index']
+        if isinstance(name, dict):
+            name = [index['name']
+                    for index in self._indexes(database_name, value)
+                    if index['key'].items() == name.items()]
+            name = name and name[0] or None
+        if name == '_id_':
+            raise EngineError("cannot drop _id index", 72)
+        if not self._drop_indexes(database_name, value, name) \
+           and name != '*':
+            raise EngineError("index not found with name [%s]" % name, 27)
+        return SON([('nIndexesWas', before)])
+
+    _command_deleteindexes = _command_dropindexes
+
+    def _command_count(self, database_name, value, query, last_error):
+        documents = self.find(database_name, value, query.get('query') or {})
+        documents = documents[int(query.get('skip') or 0):]
+        if query.get('limit'):
+            documents = documents[:abs(int(query['limit']))]
+        return SON([('n', float(len(documents)))])
+
+    def _command_aggregate(self, database_name, value, query, last_error):
+        collection = self.get_collection(database_name, value)
+        documents = aggregate(collection and collection.documents.values()
+                              or [], query.get('pipeline') or [])
+        if 'cursor' not in query:
+            return SON([('result', documents)])
+        # allowDiskUse makes no difference in memory
+        batch_size = query['cursor'].get('batchSize')
+        if batch_size is None:
+            batch_size = FIRST_BATCH_SIZE
+        namespace = '%s.%s' % (database_name, value)
+        batch, rest = documents[:batch_size], documents[batch_size:]
+        cursor_id = 0
+        if rest:
+            cursor_id = self._cursor_ids.next()
+            # pymongo counts what getMore returns from 0 for command cursors
+            self.cursors[cursor_id] = (namespace, rest, 0)
+        return SON([('cursor', SON([('id', cursor_id), ('ns', namespace),
+                                    ('firstBatch', batch)]))])
+
+    def _command_distinct(self, database_name, value, query, last_error):
+        documents = self.find(database_name, value, query.get('query') or {})
+        return SON([('values', distinct_values(documents, query['key']))])
+
+    def _command_findandmodify(self, database_name, value, query,
+                               last_error):
+        sort = query.get('sort')
+        documents = self.find(database_name, value, query.get('query') or {},
+                              sort=sort and sort.items() or None)
+        namespace = '%s.%s' % (database_name, value)
+        fields = query.get('fields')
+        last_error_object = SON([('n', 0)])
+        if not documents:
+            if not query.get('upsert'):
+                return SON([('value', None),
+                            ('lastErrorObject', last_error_object)])
+            error = {'err': None}
+            self._update(self._update_message(namespace, query, True),
+                         error)
+            document = self.get_collection(database_name, value).documents[
+                id_key(error['upserted'])
+            ]
+            last_error_object.update({'n': 1, 'updatedExisting': False,
+                                      'upserted': error['upserted']})
+            return SON([('value', query.get('new') and
+                         project(document, fields) or None),
+                        ('lastErrorObject', last_error_object)])
+
+        document = documents[0]
+        collection = self.get_collection(database_name, value)
+        if query.get('remove'):
+            del collection.documents[id_key(document['_id'])]
+            last_error_object['n'] = 1
+            return SON([('value', project(document, fields)),
+                        ('lastErrorObject', last_error_object)])
+        updated = apply_update(document, query.get('update') or {})
+        self._check_unique(database_name, collection, [updated])
+        collection.documents[id_key(updated['_id'])] = updated
+        last_error_object.update({'n': 1, 'updatedExisting': True})
+        return SON([('value', project(query.get('new') and updated or
+                                      document, fields)),
+                    ('lastErrorObject', last_error_object)])
+
+    def _update_message(self, namespace, query, upsert):
+        # findAndModify upserts like an ordinary update
+        body = (struct.pack('<i', 0) + namespace + '\x00' +
+                struct.pack('<i', upsert and UPDATE_UPSERT or 0) +
+                bson.BSON.encode(query.get('query') or {}) +
+                bson.BSON.encode(query.get('update') or {}))
+        return struct.pack('<iiii', 16 + len(body), 0, 0, OP_UPDATE) + body
+
+    def _command_collstats(self, database_name, value, query, last_error):
+        collection = self.get_collection(database_name, value)
+        if collection is None:
+            raise EngineError("ns not found", 26)
+        return SON([('ns', '%s.%s' % (database_name, value)),
+                    ('count', len(collection.documents)),
+                    ('nindexes', len(self._indexes(database_name, value)))])
+
+
+# one per process like there's one mongod
+server = MemoryServer()
@@ -0,0 +1,172 @@
+"""
+Keyset (a.k.a. range based) pagination of DjangoDocument querysets.
+
+Django's Paginator, like `skip()`, has to walk past every document before
+the page you ask for and it needs a count of all documents. That gets
+slower the deeper you page. This paginator instead remembers the sort key
+and `_id` of the last document of a page and asks for the documents that
+come after it, which with an index on the sort key costs the same no matter
+how deep you are.
+
+    >>> talks = collection.Talk.objects.order_by('-when')
+    >>> paginator = KeysetPaginator(talks, 20)
+    >>> page = paginator.page(request.GET.get('cursor'))
+    >>> page.has_next()
+    True
+    >>> page.next_page_cursor()
+    'WyJuIiwgeyIkZGF0ZSI6IDEyOTM3NTM2MDAwMDB9LCB7...'
+
+The cursors are opaque strings that are safe to put in URLs. Ordering on
+more than one key is not supported, `_id` is always used as tiebreaker.
+"""
+
+import base64
+import json
+
+from bson import json_util
+from bson.errors import InvalidId
+from django.core.paginator import InvalidPage
+from pymongo import ASCENDING, DESCENDING
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def _get_value(document, key):
+    # missing values sort like null
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def encode_cursor(direction, value, _id):
+    data = json.dumps([direction, value, _id], default=json_util.default)
+    return base64.urlsafe_b64encode(data)
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(str(cursor))
+        direction, value, _id = json.loads(
+            data,
+            object_hook=json_util.object_hook
+        )
+    except (TypeError, ValueError, InvalidId):
+        raise InvalidPage("That page cursor is not valid")
+    if direction not in (NEXT, PREVIOUS):
+        raise InvalidPage("That page cursor is not valid")
+    return direction, value, _id
+
+
+class KeysetPaginator(object):
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        if len(queryset._ordering) > 1:
+            raise ValueError("Can only paginate on one sort key")
+        if queryset._ordering and queryset._ordering[0][0] != '_id':
+            self.key, self.direction = queryset._ordering[0]
+        else:
+            self.key = None
+            self.direction = (queryset._ordering and
+                              queryset._ordering[0][1] or ASCENDING)
+
+    def page(self, cursor=None):
+        """return the page after (or before) `cursor` or the first page if
+        `cursor` is empty"""
+        if cursor:
+            direction, value, _id = decode_cursor(cursor)
+        else:
+            direction, value, _id = NEXT, None, None
+
+        backwards = direction == PREVIOUS
+        queryset = self.queryset
+        if _id is not None:
+            queryset = queryset.filter(self._range_spec(value, _id, backwards))
+        queryset = queryset.order_by(*self._ordering(backwards))
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if backwards:
+            object_list.reverse()
+            return KeysetPage(object_list, self,
+                              has_next=True, has_previous=has_more)
+        return KeysetPage(object_list, self,
+                          has_next=has_more, has_previous=_id is not None)
+
+    def _ordering(self, backwards=False):
+        descending = (self.direction == DESCENDING) != backwards
+        prefix = descending and '-' or ''
+        if self.key:
+            return [prefix + self.key, prefix + '_id']
+        return [prefix + '_id']
+
+    def _range_spec(self, value, _id, backwards=False):
+        descending = (self.direction == DESCENDING) != backwards
+        operator = descending and '$lt' or '$gt'
+        if not self.key:
+            return {'_id': {operator: _id}}
+        # null (or missing) sorts before everything else and can't be
+        # compared with $lt or $gt
+        null = {'$in': [None]}
+        if value is None:
+            clauses = [{self.key: null, '_id': {operator: _id}}]
+            if not descending:
+                clauses.append({self.key: {'$ne': None}})
+        else:
+            clauses = [{self.key: {operator: value}},
+                       {self.key: value, '_id': {operator: _id}}]
+            if descending:
+                clauses.append({self.key: null})
+        return {'$or': clauses}
+
+    def _cursor_for(self, direction, document):
+        value = None
+        if self.key:
+            value = _get_value(document, self.key)
+        return encode_cursor(direction, value, document['_id'])
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage of %s documents>' % len(self)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_cursor(self):
+        if not self.has_next():
+            raise InvalidPage("There is no next page")
+        return self.paginator._cursor_for(NEXT, self.object_list[-1])
+
+    def previous_page_cursor(self):
+        if not self.has_previous():
+            raise InvalidPage("There is no previous page")
+        return self.paginator._cursor_for(PREVIOUS, self.object_list[0])
@@ -0,0 +1,376 @@
+"""
+Lazy, chainable querying of DjangoDocument collections in the style of
+Django's QuerySet.
+
+    >>> talks = collection.Talk.objects.filter(tags=u"python")
+    >>> talks = talks.exclude(duration__lt=1.0).order_by('-when')
+    >>> talks.count()
+    3
+    >>> for talk in talks[:10]:
+    ...     print talk['topic']
+
+Nothing is sent to the database until the queryset is iterated, sliced with
+a step, indexed, counted or evaluated with len() or bool().
+"""
+
+from bson.son import SON
+from pymongo import ASCENDING, DESCENDING
+
+from caching import get_cache, get_count
+from records import RecordLoader
+from shortcut import get_database
+
+LOOKUP_SEP = '__'
+
+OPERATORS = {
+    'ne': '$ne',
+    'lt': '$lt',
+    'lte': '$lte',
+    'gt': '$gt',
+    'gte': '$gte',
+    'in': '$in',
+    'nin': '$nin',
+    'all': '$all',
+    'size': '$size',
+    'exists': '$exists',
+}
+
+# how many documents to show in repr()
+REPR_OUTPUT_SIZE = 20
+
+
+def lookups_to_spec(lookups):
+    """turn Django style keyword lookups into a MongoDB spec. For example
+    `{'when__gte': d, 'author__name': u"Peter"}` becomes
+    `{'when': {'$gte': d}, 'author.name': u"Peter"}`"""
+    spec = {}
+    for lookup, value in lookups.items():
+        parts = lookup.split(LOOKUP_SEP)
+        if len(parts) > 1 and parts[-1] in OPERATORS:
+            key = '.'.join(parts[:-1])
+            spec.setdefault(key, {})[OPERATORS[parts[-1]]] = value
+        else:
+            spec['.'.join(parts)] = value
+    return spec
+
+
+def _and(specs):
+    if not specs:
+        return {}
+    if len(specs) == 1:
+        return specs[0]
+    return {'$and': specs}
+
+
+class QuerySet(object):
+    """
+    Wraps a registered document (e.g. `collection.Talk`) and builds up a
+    query lazily. Every chaining method returns a new QuerySet.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self._where = []
+        self._ordering = []
+        self._fields = None
+        # 'documents', 'values' or 'records'
+        self._hydration = 'documents'
+        self._low_mark = 0
+        self._high_mark = None
+        self._result_cache = None
+
+    def __repr__(self):
+        data = list(self[:REPR_OUTPUT_SIZE + 1])
+        if len(data) > REPR_OUTPUT_SIZE:
+            data[-1] = "...(remaining elements truncated)..."
+        return '<QuerySet %r>' % data
+
+    def __len__(self):
+        self._fetch_all()
+        return len(self._result_cache)
+
+    def __iter__(self):
+        self._fetch_all()
+        return iter(self._result_cache)
+
+    def __nonzero__(self):
+        self._fetch_all()
+        return bool(self._result_cache)
+
+    def __getitem__(self, k):
+        if not isinstance(k, (slice, int, long)):
+            raise TypeError
+        assert ((not isinstance(k, slice) and (k >= 0)) or
+                (isinstance(k, slice) and (k.start is None or k.start >= 0) and
+                 (k.stop is None or k.stop >= 0))), \
+            "Negative indexing is not supported."
+
+        if self._result_cache is not None:
+            return self._result_cache[k]
+
+        if isinstance(k, slice):
+            clone = self._clone()
+            clone._set_limits(k.start, k.stop)
+            if k.step:
+                return list(clone)[::k.step]
+            return clone
+
+        clone = self._clone()
+        clone._set_limits(k, k + 1)
+        return list(clone)[0]
+
+    @property
+    def spec(self):
+        """the MongoDB spec this queryset will be sent with"""
+        return _and(self._where)
+
+    def all(self):
+        return self._clone()
+
+    def filter(self, *specs, **lookups):
+        """narrow the query down. Takes MongoDB spec dicts, Django style
+        keyword lookups or both"""
+        self._assert_not_sliced("filter")
+        clone = self._clone()
+        clone._where.extend(specs)
+        if lookups:
+            clone._where.append(lookups_to_spec(lookups))
+        return clone
+
+    def exclude(self, *specs, **lookups):
+        """the opposite of `filter()`"""
+        self._assert_not_sliced("exclude")
+        specs = list(specs)
+        if lookups:
+            specs.append(lookups_to_spec(lookups))
+        clone = self._clone()
+        if specs:
+            clone._where.append({'$nor': [_and(specs)]})
+        return clone
+
+    def order_by(self, *keys):
+        """e.g. `order_by('-when', 'topic')`"""
+        self._assert_not_sliced("order_by")
+        clone = self._clone()
+        clone._ordering = []
+        for key in keys:
+            if key.startswith('-'):
+                clone._ordering.append((key[1:], DESCENDING))
+            else:
+                clone._ordering.append((key, ASCENDING))
+        return clone
+
+    def only(self, *fields):
+        """only load these fields from the database"""
+        clone = self._clone()
+        clone._fields = dict((field, 1) for field in fields)
+        return clone
+
+    def defer(self, *fields):
+        """load everything but these fields from the database"""
+        clone = self._clone()
+        if clone._fields and 1 in clone._fields.values():
+            for field in fields:
+                clone._fields.pop(field, None)
+        else:
+            clone._fields = clone._fields or {}
+            for field in fields:
+                clone._fields[field] = 0
+        return clone
+
+    def values(self, *fields):
+        """return plain dicts, as pymongo decoded them, instead of documents.
+        If `fields` are given only they are loaded."""
+        return self._hydrate('values', fields)
+
+    def raw(self, *fields):
+        """return read-only Records, whose fields are attributes too,
+        instead of documents. If `fields` are given only they are loaded."""
+        return self._hydrate('records', fields)
+
+    def _hydrate(self, hydration, fields):
+        clone = self.only(*fields) if fields else self._clone()
+        clone._hydration = hydration
+        return clone
+
+    def aggregate(self):
+        """an aggregation pipeline (see `DjangoDocument.aggregate()`) that
+        starts with the documents this queryset matches, in its order, with
+        just the fields only() and defer() leave"""
+        # aggregation builds on this module
+        from aggregation import Aggregation
+        if self._is_empty():
+            # $limit has to be positive
+            return Aggregation(self.document,
+                               [{'$match': {'_id': {'$in': []}}}])
+        stages = []
+        if self._where:
+            stages.append({'$match': self.spec})
+        if self._ordering:
+            stages.append({'$sort': SON(self._ordering)})
+        if self._low_mark:
+            stages.append({'$skip': self._low_mark})
+        if self._high_mark is not None:
+            stages.append({'$limit': self._high_mark - self._low_mark})
+        if self._fields:
+            # leaving fields out like defer() does needs MongoDB 3.4
+            stages.append({'$project': self._fields.copy()})
+        return Aggregation(self.document, stages)
+
+    def count(self):
+        """the number of documents this queryset matches. Uses the result
+        cache if the queryset has already been evaluated and Django's cache
+        if the document class has a `Meta.count_cache_timeout`."""
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        if self._is_empty():
+            return 0
+        meta = self.document._meta
+        if meta.count_cache_timeout is None:
+            return self._count()
+        return get_count(get_cache(meta.cache_alias),
+                         self.document.collection, self.spec,
+                         self._low_mark, self._high_mark, self._count,
+                         meta.count_cache_timeout)
+
+    def _count(self):
+        return self._cursor().count(with_limit_and_skip=True)
+
+    def estimated_count(self):
+        """like count() but, if the queryset isn't filtered or sliced, the
+        number of documents in the collection's metadata is used. See
+        `DjangoDocument.estimated_count()`"""
+        if (self._result_cache is not None or self._where or
+            self._low_mark or self._high_mark is not None):
+            return self.count()
+        return self.document.estimated_count()
+
+    def exists(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        if self._is_empty():
+            return False
+        cursor = self.document.collection.find(self.spec, fields=['_id'])
+        return bool(list(cursor.skip(self._low_mark).limit(1)))
+
+    def delete(self, send_signals=False):
+        """delete every matching document on the server without loading
+        them. See `DjangoDocument.delete_where()`"""
+        self._assert_not_sliced("delete")
+        self._result_cache = None
+        return self.document.delete_where(self.spec,
+                                          send_signals=send_signals)
+
+    def update(self, changes=None, send_signals=False, **fields):
+        """update every matching document on the server without loading
+        them. Takes a MongoDB update document and/or keyword arguments that
+        are `$set`, e.g. `update({'$inc': {'views': 1}}, seen=True)`. See
+        `DjangoDocument.update_where()`"""
+        self._assert_not_sliced("update")
+        changes = dict(changes or {})
+        if changes and not [key for key in changes if key.startswith('$')]:
+            changes = {'$set': changes}
+        if fields:
+            to_set = dict(changes.get('$set', {}))
+            for key, value in fields.items():
+                to_set[key.replace(LOOKUP_SEP, '.')] = value
+            changes['$set'] = to_set
+        self._result_cache = None
+        return self.document.update_where(self.spec, changes,
+                                          send_signals=send_signals)
+
+    def iterator(self, chunk_size=100):
+        """stream the documents from the database `chunk_size` at a time
+        without filling up the result cache"""
+        if self._is_empty():
+            return iter([])
+        return self._cursor().batch_size(chunk_size)
+
+    def _cursor(self):
+        kwargs = {}
+        if self._fields is not None:
+            kwargs['fields'] = self._fields
+        if self._hydration == 'documents':
+            cursor = self.document.find(self.spec, **kwargs)
+        else:
+            # no documents, no validation and no deferred loading
+            kwargs['wrap'] = RecordLoader(
+                self.document._obj_class, partial=self._fields is not None,
+                as_records=self._hydration == 'records'
+            )
+            cursor = self.document.collection.find(self.spec, **kwargs)
+        if self._ordering:
+            cursor.sort(self._ordering)
+        if self._low_mark:
+            cursor.skip(self._low_mark)
+        if self._high_mark is not None:
+            cursor.limit(self._high_mark - self._low_mark)
+        return cursor
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+
+    def _is_empty(self):
+        # pymongo treats limit(0) as no limit at all
+        return (self._high_mark is not None and
+                self._high_mark <= self._low_mark)
+
+    def _set_limits(self, low=None, high=None):
+        if high is not None:
+            if self._high_mark is not None:
+                self._high_mark = min(self._high_mark, self._low_mark + high)
+            else:
+                self._high_mark = self._low_mark + high
+        if low is not None:
+            if self._high_mark is not None:
+                self._low_mark = min(self._high_mark, self._low_mark + low)
+            else:
+                self._low_mark = self._low_mark + low
+
+    def _assert_not_sliced(self, method):
+        assert not self._low_mark and self._high_mark is None, \
+            "Cannot %s a query once a slice has been taken." % method
+
+    def _clone(self):
+        clone = self.__class__(self.document)
+        clone._where = self._where[:]
+        clone._ordering = self._ordering[:]
+        clone._fields = self._fields and self._fields.copy()
+        clone._hydration = self._hydration
+        clone._low_mark = self._low_mark
+        clone._high_mark = self._high_mark
+        return clone
+
+
+class Manager(object):
+    """
+    Gives DjangoDocument classes an `objects` attribute like Django models.
+
+    It works through the collection the document was registered on, e.g.
+    `collection.Talk.objects`, or straight on the class, e.g.
+    `Talk.objects`, if the class has a `collection_name` (or mongokit's
+    `__collection__`) and has been registered on the connection.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is not None and hasattr(instance, '_obj_class'):
+            # already a registered document bound to a collection
+            return QuerySet(instance)
+        if instance is not None:
+            collection = instance.collection
+        else:
+            collection_name = (getattr(owner, '__collection__', None) or
+                               getattr(owner, 'collection_name', None))
+            if not collection_name:
+                raise AttributeError(
+                    "%s needs a collection_name to be used as %s.objects" %
+                    (owner.__name__, owner.__name__)
+                )
+            collection = get_database()[collection_name]
+        if owner.__name__ not in collection._registered_documents:
+            raise AttributeError(
+                "%s has not been registered on the connection" %
+                owner.__name__
+            )
+        return QuerySet(getattr(collection, owner.__name__))
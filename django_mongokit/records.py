@@ -0,0 +1,80 @@
+"""
+Read-only records for pages that only show documents and never save them.
+
+Turning every document that comes out of a cursor into a mongokit
+Document is a lot of work: the structure is walked for custom types and
+dot notation and `validate()` may run. A Record is just the dict pymongo
+decoded, embedded documents included, with the fields as attributes too:
+
+    >>> talk = collection.Talk.objects.raw()[0]
+    >>> talk.topic, talk['topic'], talk.author.name
+    (u'Mongo', u'Mongo', u'Peter')
+"""
+
+
+class Record(dict):
+    """A document as it's stored in MongoDB that can't be changed. Lists
+    become tuples and embedded documents are Records as well."""
+
+    __slots__ = ()
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("%s is read-only" % self.__class__.__name__)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # copying and pickling would otherwise set the items one by one
+        return (self.__class__, (dict(self),))
+
+    @property
+    def pk(self):
+        return str(self['_id'])
+
+
+def freeze(value):
+    """`value` with every dict in it turned into a Record and every list
+    into a tuple"""
+    if isinstance(value, dict):
+        record = Record(value)
+        for key, each in value.iteritems():
+            if isinstance(each, (dict, list)):
+                dict.__setitem__(record, key, freeze(each))
+        return record
+    if isinstance(value, list):
+        return tuple([freeze(each) if isinstance(each, (dict, list))
+                      else each for each in value])
+    return value
+
+
+class RecordLoader(object):
+    """Used as the `wrap` of cursors to get Records (or, if `as_records` is
+    False, the plain dicts) instead of documents. Documents saved with an
+    older Meta.schema_version are still upgraded, unless only some of the
+    fields were loaded, but never written back."""
+
+    # mongokit's cursor looks for this to load subclasses
+    type_field = None
+
+    def __init__(self, document_class=None, partial=False, as_records=True):
+        self.meta = getattr(document_class, '_meta', None)
+        self.partial = partial
+        self.as_records = as_records
+
+    def __call__(self, son, collection=None):
+        if (self.meta is not None and not self.partial and
+            self.meta.needs_upgrade(son)):
+            son = self.meta.upgrade(son)
+        if self.as_records:
+            return freeze(son)
+        return son
@@ -9,30 +9,77 @@ except ImportError:
 
 
 if __django_12__:
-    try:
-        connection = connections['mongodb'].connection
-    except ConnectionDoesNotExist:
-        # Need to raise a better error
-        print connections.databases
-        raise
+    def _get_database_wrapper():
+        try:
+            return connections['mongodb']
+        except ConnectionDoesNotExist:
+            # Need to raise a better error
+            print connections.databases
+            raise
 else:
     # because this is Django <1.2 doesn't load all the engines so we have to
     # do it manually.
     # Since with Django <1.2 we have to first define a normal backend engine
     # like sqlite so then the base backend for mongodb is never called
-    from django.db import load_backend
-    backend = load_backend('django_mongokit.mongodb')
-    connection = backend.DatabaseWrapper({
-        'DATABASE_HOST': getattr(settings, 'MONGO_DATABASE_HOST', None),
-        'DATABASE_NAME': settings.MONGO_DATABASE_NAME,
-        'DATABASE_OPTIONS': getattr(settings, 'MONGO_DATABASE_OPTIONS', None),
-        'DATABASE_PASSWORD': getattr(settings, 'MONGO_DATABASE_PASSWORD',
-                                     None),
-        'DATABASE_PORT': getattr(settings, 'MONGO_DATABASE_PORT', None),
-        'DATABASE_USER': getattr(settings, 'MONGO_DATABASE_USER', None),
-        'TIME_ZONE': settings.TIME_ZONE,
-    })
-    connection = connection.connection
+    def _get_database_wrapper():
+        from django.db import load_backend
+        backend = load_backend('django_mongokit.mongodb')
+        return backend.DatabaseWrapper({
+            'DATABASE_HOST': getattr(settings, 'MONGO_DATABASE_HOST', None),
+            'DATABASE_NAME': settings.MONGO_DATABASE_NAME,
+            'DATABASE_OPTIONS': getattr(settings, 'MONGO_DATABASE_OPTIONS',
+                                        None),
+            'DATABASE_PASSWORD': getattr(settings, 'MONGO_DATABASE_PASSWORD',
+                                         None),
+            'DATABASE_PORT': getattr(settings, 'MONGO_DATABASE_PORT', None),
+            'DATABASE_USER': getattr(settings, 'MONGO_DATABASE_USER', None),
+            'TIME_ZONE': settings.TIME_ZONE,
+        })
+
+
+class LazyConnection(object):
+    """
+    Stands in for the mongokit connection of the 'mongodb' database.
+
+    Importing this module doesn't connect to anything. The connection is
+    made the first time it's used and made again after the process has
+    forked so prefork workers don't share the sockets of their parent.
+    """
+
+    def __init__(self, get_database_wrapper):
+        self.__dict__['_get_database_wrapper'] = get_database_wrapper
+        self.__dict__['_database_wrapper'] = None
+
+    def _get_connection(self):
+        # The database wrapper is looked up once because Django keeps one per
+        # thread and all threads should share the same connection pool and
+        # registered documents.
+        if self._database_wrapper is None:
+            self.__dict__['_database_wrapper'] = self._get_database_wrapper()
+        return self._database_wrapper.connection
+
+    def __getattr__(self, key):
+        return getattr(self._get_connection(), key)
+
+    def __setattr__(self, key, value):
+        setattr(self._get_connection(), key, value)
+
+    def __getitem__(self, key):
+        return self._get_connection()[key]
+
+    def __eq__(self, other):
+        if isinstance(other, LazyConnection):
+            other = other._get_connection()
+        return self._get_connection() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<LazyConnection %r>' % self._get_connection()
+
+
+connection = LazyConnection(_get_database_wrapper)
 
 
 # The reason this is a function rather than an instance is that you're supposed
@@ -0,0 +1,5 @@
+# The same as test_settings but with the in-memory engine so that the tests
+# can run without a mongod.
+from test_settings import *
+
+DATABASES['mongodb']['ENGINE'] = 'django_mongokit.mongodb_memory'
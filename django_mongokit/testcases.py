@@ -0,0 +1,100 @@
+"""
+A TestCase that cleans up after every test by emptying only the
+collections the test wrote to, instead of dropping the whole database.
+"""
+
+try:
+    from django.utils import unittest
+except ImportError:
+    # Django >= 1.9
+    import unittest
+
+from django.db import connections
+
+
+class MongoTestCase(unittest.TestCase):
+    """
+    Every collection a test writes to through the `using` database is
+    emptied when the test is done. The indexes are kept unless
+    `keep_indexes` is False, then the collections are dropped.
+
+    Documents that are the same for every test in the class can be saved
+    once in `setUpMongoData()`. What it wrote is kept in memory and put
+    back after each test that changed it.
+
+    Only what goes through the Django connection (e.g. get_database() or
+    `django_mongokit.shortcut.connection`) is noticed.
+    """
+
+    using = 'mongodb'
+    keep_indexes = True
+
+    _snapshot = {}
+
+    @classmethod
+    def setUpMongoData(cls):
+        """save the documents all the tests in the class need"""
+
+    @classmethod
+    def _get_connection(cls):
+        return connections[cls.using].connection
+
+    @classmethod
+    def _get_written_collections(cls):
+        return connections[cls.using]._written_collections
+
+    @classmethod
+    def setUpClass(cls):
+        super(MongoTestCase, cls).setUpClass()
+        written_collections = cls._get_written_collections()
+        written_collections.start()
+        try:
+            cls.setUpMongoData()
+        except:
+            cls._empty(written_collections.stop())
+            raise
+        connection = cls._get_connection()
+        cls._snapshot = {}
+        for database, collection in written_collections.stop():
+            cls._snapshot[(database, collection)] = list(
+                connection[database][collection].find()
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._empty(cls._snapshot.keys())
+        cls._snapshot = {}
+        super(MongoTestCase, cls).tearDownClass()
+
+    @classmethod
+    def _empty(cls, collections):
+        connection = cls._get_connection()
+        for database, collection in collections:
+            collection = connection[database][collection]
+            if cls.keep_indexes:
+                collection.remove({})
+            else:
+                collection.drop()
+
+    def __call__(self, result=None):
+        self._pre_setup()
+        try:
+            super(MongoTestCase, self).__call__(result)
+        finally:
+            self._post_teardown()
+
+    def _pre_setup(self):
+        self._get_written_collections().start()
+
+    def _post_teardown(self):
+        written = self._get_written_collections().stop()
+        self._empty([each for each in written if each not in self._snapshot])
+        connection = self._get_connection()
+        for key in written:
+            if key not in self._snapshot:
+                continue
+            collection = connection[key[0]][key[1]]
+            # the indexes setUpMongoData() made are always kept
+            collection.remove({})
+            if self._snapshot[key]:
+                collection.insert(self._snapshot[key], manipulate=False)
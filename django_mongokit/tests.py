@@ -3,6 +3,14 @@ import unittest
 from document import DjangoDocument
 
 
+def in_memory():
+    """True when the tests run against the in-memory engine"""
+    from django.conf import settings
+    databases = getattr(settings, 'DATABASES', {})
+    return (databases.get('mongodb', {}).get('ENGINE') ==
+            'django_mongokit.mongodb_memory')
+
+
 class Talk(DjangoDocument):
     structure = {'topic': unicode}
 
@@ -20,16 +28,25 @@ class CrazyTwo(DjangoDocument):
     structure = {'names': unicode}
 
 
+class TrackedTalk(Talk):
+    track_changes = True
+
+
 class LighteningTalk(Talk):
     structure = {'has_slides': bool}
     default_values = {'has_slides': True}
 
 
+class CommentedTalk(Talk):
+    structure = {'comments': [{'author': unicode, 'text': unicode}]}
+
+
 class DocumentTest(unittest.TestCase):
 
     def setUp(self):
         from shortcut import connection
-        connection.register([Talk, CrazyOne, CrazyTwo, LighteningTalk])
+        connection.register([Talk, CrazyOne, CrazyTwo, LighteningTalk,
+                             TrackedTalk])
 
         self.connection = connection
         self.database = connection['django_mongokit_test_database']
@@ -148,6 +165,987 @@ class DocumentTest(unittest.TestCase):
         talk.save()
         self.assertTrue('post_save not created' in _fired)
 
+    def test_bulk_save(self):
+        _created = []
+
+        def trigger_post_save(sender, instance, created=False, **__):
+            _created.append(created)
+
+        from django.db.models import signals
+        signals.post_save.connect(trigger_post_save, sender=Talk)
+
+        collection = self.database.talks
+        talks = []
+        for i in range(5):
+            talk = collection.Talk()
+            talk['topic'] = u"Talk %d" % i
+            talks.append(talk)
+        collection.Talk.bulk_save(talks, batch_size=2)
+        self.assertEqual(_created, [True] * 5)
+        self.assertTrue(all(talk['_id'] for talk in talks))
+        self.assertEqual(collection.Talk.find().count(), 5)
+
+        for talk in talks:
+            talk['topic'] += u"!"
+        collection.Talk.bulk_save(talks, batch_size=2)
+        self.assertEqual(_created[5:], [False] * 5)
+        self.assertEqual(collection.Talk.find().count(), 5)
+        self.assertEqual(collection.Talk.find({'topic': u"Talk 0!"}).count(),
+                         1)
+
+        signals.post_save.disconnect(trigger_post_save, sender=Talk)
+
+    def test_bulk_save_validates_everything_first(self):
+        collection = self.database.talks
+        good = collection.Talk()
+        good['topic'] = u"Good"
+        bad = collection.Talk()
+        bad['topic'] = 123
+        _fired = []
+
+        def trigger_pre_save(sender, instance, **__):
+            _fired.append(instance)
+
+        from django.db.models import signals
+        from mongokit import SchemaTypeError
+        signals.pre_save.connect(trigger_pre_save, sender=Talk)
+        try:
+            self.assertRaises(SchemaTypeError,
+                              collection.Talk.bulk_save, [good, bad])
+        finally:
+            signals.pre_save.disconnect(trigger_pre_save, sender=Talk)
+        self.assertEqual(collection.Talk.find().count(), 0)
+        # no pre_save without a post_save
+        self.assertEqual(_fired, [])
+
+    def test_save_only_sends_changes(self):
+        collection = self.database.talks
+        talk = collection.TrackedTalk()
+        talk['topic'] = u"Peter"
+        talk.save()
+        # only classes that ask for it
+        self.assertEqual(collection.Talk.one({'_id': talk['_id']})._snapshot,
+                         None)
+
+        talk = collection.TrackedTalk.one({'_id': talk['_id']})
+        # change something behind the loaded document's back
+        collection.update({'_id': talk['_id']},
+                          {'$set': {'other': u"Untouched"}})
+        talk['topic'] = u"Peter and Paul"
+        talk.save()
+
+        raw = collection.find_one({'_id': talk['_id']})
+        self.assertEqual(raw['topic'], u"Peter and Paul")
+        self.assertEqual(raw['other'], u"Untouched")
+
+        # deleted documents are written in full when saved again
+        talk.delete()
+        talk.save()
+        raw = collection.find_one({'_id': talk['_id']})
+        self.assertEqual(raw['topic'], u"Peter and Paul")
+
+    def test_string_ids(self):
+        collection = self.database.talks
+        talk = collection.Talk()
+        talk['topic'] = u"By pk"
+        talk.save()
+        self.assertEqual(collection.Talk.find_one(talk.pk)['_id'],
+                         talk['_id'])
+        self.assertEqual(collection.Talk.one({'_id': talk.pk})['_id'],
+                         talk['_id'])
+        self.assertEqual(collection.Talk.get_from_id(talk.pk)['_id'],
+                         talk['_id'])
+
+    def test_get_many(self):
+        collection = self.database.talks
+        talks = []
+        for i in range(5):
+            talk = collection.Talk()
+            talk['topic'] = u"Talk %d" % i
+            talk.save()
+            talks.append(talk)
+
+        from bson import ObjectId
+        unknown = ObjectId()
+        ids = [talks[3].pk, talks[0]['_id'], unknown, talks[4].pk,
+               talks[3].pk]
+        found, missing = collection.Talk.get_many(ids, chunk_size=2)
+        self.assertEqual([each['topic'] for each in found],
+                         [u"Talk 3", u"Talk 0", u"Talk 4", u"Talk 3"])
+        self.assertEqual(missing, [unknown])
+
+
+class QuerySetTest(unittest.TestCase):
+
+    def setUp(self):
+        from shortcut import connection
+        connection.register([Talk, LighteningTalk, CommentedTalk])
+
+        self.connection = connection
+        self.database = connection['django_mongokit_test_database']
+        self.collection = self.database.talks
+        for i in range(10):
+            talk = self.collection.LighteningTalk()
+            talk['topic'] = u"Talk %d" % i
+            talk['has_slides'] = bool(i % 2)
+            talk.save()
+
+    def tearDown(self):
+        self.connection.drop_database('django_mongokit_test_database')
+
+    def test_filter_exclude_and_order_by(self):
+        talks = self.collection.LighteningTalk.objects.filter(has_slides=True)
+        self.assertEqual(talks.count(), 5)
+        talks = talks.exclude(topic__in=[u"Talk 1", u"Talk 3"])
+        self.assertEqual(talks.count(), 3)
+        self.assertEqual([talk['topic'] for talk in talks.order_by('-topic')],
+                         [u"Talk 9", u"Talk 7", u"Talk 5"])
+
+    def test_slicing(self):
+        talks = self.collection.LighteningTalk.objects.order_by('topic')
+        self.assertEqual([talk['topic'] for talk in talks[2:4]],
+                         [u"Talk 2", u"Talk 3"])
+        self.assertEqual(talks[2:6][1:2].count(), 1)
+        self.assertEqual(talks[5]['topic'], u"Talk 5")
+        self.assertEqual(talks[3:3].count(), 0)
+        self.assertRaises(IndexError, lambda: talks[100])
+
+    def test_result_cache(self):
+        talks = self.collection.LighteningTalk.objects.all()
+        self.assertEqual(len(talks), 10)
+        self.collection.remove()
+        # served from the cache
+        self.assertEqual(talks.count(), 10)
+        self.assertEqual(self.collection.LighteningTalk.objects.count(), 0)
+
+    def test_only(self):
+        talks = self.collection.LighteningTalk.objects.only('topic')
+        talk = talks[0]
+        self.assertTrue('topic' in talk)
+        self.assertTrue('has_slides' not in talk)
+
+    def test_deferred_fields(self):
+        from django.db import connections
+        connection = connections['mongodb']
+        talks = list(self.collection.LighteningTalk.objects
+                     .defer('has_slides').order_by('topic'))
+        self.assertTrue('has_slides' not in talks[0])
+        connection.settings_dict['RECORD_QUERIES'] = True
+        try:
+            connection.reset_queries()
+            # the rest of the result set is loaded at the same time
+            self.assertEqual(talks[1]['has_slides'], True)
+            self.assertEqual([talk.get('has_slides') for talk in talks],
+                             [bool(i % 2) for i in range(10)])
+            self.assertEqual(len(connection.queries), 1)
+        finally:
+            del connection.settings_dict['RECORD_QUERIES']
+
+        talk = self.collection.LighteningTalk.objects.only('topic')[0]
+        talk['topic'] = u"Renamed"
+        talk.save()
+        saved = self.collection.find_one({'_id': talk['_id']})
+        self.assertEqual(saved['topic'], u"Renamed")
+        self.assertTrue('has_slides' in saved)
+
+    def test_deferred_fields_in_lists(self):
+        comments = [{'author': u"Ann", 'text': u"Nice"},
+                    {'author': u"Bob", 'text': u"Thanks"}]
+        _id = self.collection.insert({'topic': u"Commented",
+                                      'comments': comments})
+        talk = self.collection.CommentedTalk.find_one(
+            _id, fields=['comments.author'])
+        self.assertEqual(talk['comments'][0], {'author': u"Ann"})
+        talk['topic'] = u"Renamed"
+        talk.save()
+        saved = self.collection.find_one(_id)
+        self.assertEqual(saved['topic'], u"Renamed")
+        self.assertEqual(saved['comments'], comments)
+        self.assertEqual(talk['comments'], comments)
+
+        # the rest of a list that was changed can't be filled in
+        talk = self.collection.CommentedTalk.find_one(
+            _id, fields=['comments.author'])
+        talk['comments'].append({'author': u"Cecil"})
+        self.assertRaises(ValueError, talk.save)
+        self.assertRaises(ValueError,
+                          self.collection.CommentedTalk.bulk_save, [talk])
+        self.assertEqual(self.collection.find_one(_id)['comments'], comments)
+
+    def test_deferred_fields_one_at_a_time(self):
+        LighteningTalk.load_deferred = 'instance'
+        try:
+            talks = list(self.collection.LighteningTalk.objects
+                         .only('topic').order_by('topic'))
+            self.assertEqual(talks[3]['has_slides'], True)
+            self.assertTrue('has_slides' not in talks[2])
+        finally:
+            del LighteningTalk.load_deferred
+
+    def test_values_and_raw(self):
+        from records import Record
+        talks = self.collection.LighteningTalk.objects.order_by('topic')
+        values = talks.values('topic')
+        self.assertEqual(type(values[0]), dict)
+        self.assertEqual(sorted(values[0].keys()), ['_id', 'topic'])
+
+        self.collection.update({'topic': u"Talk 0"},
+                               {'$set': {'author': {'name': u"Peter"},
+                                         'tags': [{'name': u"mongo"}]}})
+        talk = talks.raw()[0]
+        self.assertTrue(isinstance(talk, Record))
+        self.assertEqual(talk.topic, u"Talk 0")
+        self.assertEqual(talk.author.name, u"Peter")
+        self.assertEqual(talk.tags[0].name, u"mongo")
+        self.assertEqual(talk.pk, str(talk['_id']))
+        self.assertRaises(AttributeError, lambda: talk.speaker)
+        self.assertRaises(TypeError, talk.__setitem__, 'topic', u"Changed")
+        self.assertRaises(TypeError, talk.author.update, {})
+        self.assertRaises(AttributeError, setattr, talk, 'topic', u"Changed")
+        self.assertEqual(sorted(talks.raw('topic')[1].keys()),
+                         ['_id', 'topic'])
+        import copy
+        self.assertEqual(copy.deepcopy(talk), talk)
+
+    def test_aggregate(self):
+        from aggregation import Avg, Push, Sum
+        from records import Record
+        self.collection.update({}, {'$set': {'tags': [u"mongo"]}},
+                               multi=True)
+        self.collection.update({'has_slides': True},
+                               {'$push': {'tags': u"slides"}}, multi=True)
+        tags = (self.collection.LighteningTalk.aggregate()
+                .unwind('tags')
+                .group('tags', talks=Sum(1))
+                .sort('-talks')
+                .batch_size(1)
+                .allow_disk_use())
+        self.assertEqual([(tag['_id'], tag['talks']) for tag in tags],
+                         [(u"mongo", 10), (u"slides", 5)])
+
+        talks = (self.collection.LighteningTalk.objects
+                 .filter(has_slides=True).order_by('topic')[1:3]
+                 .aggregate()
+                 .project('topic', slides='has_slides', _id=False)
+                 .records())
+        talks = list(talks)
+        self.assertTrue(isinstance(talks[0], Record))
+        self.assertEqual([(talk.topic, talk.slides) for talk in talks],
+                         [(u"Talk 3", True), (u"Talk 5", True)])
+
+        (summary,) = (self.collection.LighteningTalk.aggregate()
+                      .match(has_slides=False)
+                      .group(None, topics=Push('topic'),
+                             average=Avg({'$literal': 2})))
+        self.assertEqual(len(summary['topics']), 5)
+        self.assertEqual(summary['average'], 2)
+
+        talks = self.collection.LighteningTalk.objects.order_by('topic')
+        self.assertEqual(list(talks[3:3].aggregate()), [])
+        self.assertEqual(sorted(list(talks.only('topic').aggregate())[0]),
+                         ['_id', 'topic'])
+        self.assertEqual(sorted(list(talks.defer('tags').aggregate())[0]),
+                         ['_id', 'has_slides', 'topic'])
+
+    def test_delete(self):
+        talks = self.collection.LighteningTalk.objects.filter(has_slides=True)
+        self.assertEqual(talks.delete(), 5)
+        self.assertEqual(self.collection.LighteningTalk.objects.count(), 5)
+
+    def test_delete_with_signals(self):
+        _deleted = []
+
+        def trigger_post_delete(sender, instance, **__):
+            _deleted.append(instance['_id'])
+
+        from django.db.models import signals
+        signals.post_delete.connect(trigger_post_delete,
+                                    sender=LighteningTalk)
+        collection = self.collection
+        ids = [talk['_id'] for talk in
+               collection.LighteningTalk.find({'has_slides': False})]
+        deleted = collection.LighteningTalk.delete_where(
+            {'has_slides': False}, send_signals=True, chunk_size=2)
+        signals.post_delete.disconnect(trigger_post_delete,
+                                       sender=LighteningTalk)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(sorted(_deleted), sorted(ids))
+
+    def test_update(self):
+        talks = self.collection.LighteningTalk.objects.filter(has_slides=True)
+        self.assertEqual(talks.update(topic=u"Slides!"), 5)
+        self.assertEqual(
+            self.collection.LighteningTalk.objects.filter(
+                topic=u"Slides!").count(),
+            5
+        )
+        updated = self.collection.LighteningTalk.update_where(
+            {'has_slides': False},
+            {'$set': {'topic': u"No slides"}},
+            send_signals=True
+        )
+        self.assertEqual(updated, 5)
+        self.assertEqual(
+            self.collection.LighteningTalk.find(
+                {'topic': u"No slides"}).count(),
+            5
+        )
+
+    def test_iterator(self):
+        talks = self.collection.LighteningTalk.objects.all()
+        self.assertEqual(len(list(talks.iterator(chunk_size=3))), 10)
+        self.assertEqual(talks._result_cache, None)
+
+
+class KeysetPaginatorTest(unittest.TestCase):
+
+    def setUp(self):
+        from shortcut import connection
+        connection.register([LighteningTalk])
+
+        self.connection = connection
+        self.database = connection['django_mongokit_test_database']
+        self.collection = self.database.talks
+        for i in range(25):
+            talk = self.collection.LighteningTalk()
+            talk['topic'] = u"Talk %02d" % i
+            # lots of duplicates to sort on
+            talk['has_slides'] = bool(i % 3)
+            talk.save()
+
+    def tearDown(self):
+        self.connection.drop_database('django_mongokit_test_database')
+
+    def test_paging_forwards_and_backwards(self):
+        from paginator import KeysetPaginator
+        talks = self.collection.LighteningTalk.objects.order_by('-has_slides')
+        paginator = KeysetPaginator(talks, 10)
+
+        pages = [paginator.page()]
+        self.assertFalse(pages[0].has_previous())
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_page_cursor()))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+        topics = [talk['topic'] for page in pages for talk in page]
+        self.assertEqual(len(set(topics)), 25)
+        self.assertEqual(topics, [talk['topic'] for talk in
+                                  talks.order_by('-has_slides', '-_id')])
+
+        previous = paginator.page(pages[2].previous_page_cursor())
+        self.assertEqual([talk['topic'] for talk in previous],
+                         [talk['topic'] for talk in pages[1]])
+        self.assertTrue(previous.has_next())
+        previous = paginator.page(previous.previous_page_cursor())
+        self.assertFalse(previous.has_previous())
+
+    def test_null_sort_keys(self):
+        from paginator import KeysetPaginator
+        self.collection.update({'topic': {'$in': [u"Talk 01", u"Talk 07"]}},
+                               {'$unset': {'has_slides': 1}}, multi=True)
+        self.collection.update({'topic': u"Talk 13"},
+                               {'$set': {'has_slides': None}})
+        for ordering in ('has_slides', '-has_slides'):
+            talks = self.collection.LighteningTalk.objects.order_by(ordering)
+            paginator = KeysetPaginator(talks, 2)
+            pages = [paginator.page()]
+            while pages[-1].has_next():
+                pages.append(paginator.page(pages[-1].next_page_cursor()))
+            topics = [talk['topic'] for page in pages for talk in page]
+            prefix = ordering.startswith('-') and '-' or ''
+            self.assertEqual(topics, [talk['topic'] for talk in
+                                      talks.order_by(ordering,
+                                                     prefix + '_id')])
+
+            previous = paginator.page(pages[-1].previous_page_cursor())
+            self.assertEqual([talk['topic'] for talk in previous],
+                             [talk['topic'] for talk in pages[-2]])
+
+    def test_bad_cursor(self):
+        from paginator import KeysetPaginator
+        from django.core.paginator import InvalidPage
+        paginator = KeysetPaginator(
+            self.collection.LighteningTalk.objects.all(), 10)
+        self.assertRaises(InvalidPage, paginator.page, 'junk')
+
+
+class IndexedTalk(DjangoDocument):
+    __database__ = 'django_mongokit_test_database'
+    collection_name = 'indexed_talks'
+    structure = {'topic': unicode, 'slug': unicode}
+
+    class Meta:
+        indexes = [
+            {'fields': ['-topic', '_id']},
+            {'fields': 'slug', 'unique': True, 'sparse': True},
+        ]
+
+
+class IndexesTest(unittest.TestCase):
+
+    def tearDown(self):
+        from shortcut import connection
+        connection.drop_database('django_mongokit_test_database')
+
+    def test_meta_indexes(self):
+        self.assertEqual(
+            [index['name'] for index in IndexedTalk._meta.indexes],
+            ['topic_-1__id_1', 'slug_1']
+        )
+        self.assertTrue(IndexedTalk._meta.indexes[1]['unique'])
+        self.assertEqual(Talk._meta.indexes, [])
+
+    def test_sync_indexes(self):
+        from indexes import (create_index, declared_indexes, drop_index,
+                             plan_indexes)
+        [(collection, declared)] = declared_indexes([Talk, IndexedTalk])
+        self.assertEqual(collection.name, 'indexed_talks')
+        collection.create_index('old')
+
+        to_create, to_drop = plan_indexes(collection, declared)
+        self.assertEqual(len(to_create), 2)
+        self.assertEqual([index['name'] for index in to_drop], ['old_1'])
+        for index in to_drop:
+            drop_index(collection, index)
+        for index in to_create:
+            create_index(collection, index)
+
+        self.assertEqual(plan_indexes(collection, declared), ([], []))
+        info = collection.index_information()
+        self.assertTrue(info['slug_1']['unique'])
+        self.assertTrue('old_1' not in info)
+
+    def test_recommend_indexes(self):
+        try:
+            from django.db import connections
+        except ImportError:
+            # Django <1.2
+            return  # :(
+        from advisor import recommend_indexes
+        from indexes import create_index, get_collection
+        collection = get_collection(IndexedTalk)
+        for index in IndexedTalk._meta.indexes:
+            create_index(collection, index)
+        collection.create_index('old')
+
+        connection = connections['mongodb']
+        connection.settings_dict['INDEX_ADVISOR_WINDOW'] = 60
+        try:
+            connection.reset_query_shapes()
+            list(collection.find({'topic': u"Foo"}).sort('_id'))
+            list(collection.find({'speaker': u"Peter"}))
+            list(collection.find({'speaker': u"Paul"}))
+            shapes = connection.query_shapes()
+        finally:
+            del connection.settings_dict['INDEX_ADVISOR_WINDOW']
+        self.assertEqual(sorted(shape['count'] for shape in shapes), [1, 2])
+
+        recommendations = recommend_indexes(shapes,
+                                            classes=[Talk, IndexedTalk])
+        actions = [(each['action'], each['key'], each['count'])
+                   for each in recommendations]
+        self.assertTrue(('create', [('speaker', 1)], 2) in actions)
+        self.assertTrue(('drop', [('old', 1)], 0) in actions)
+        # served by an index or unique
+        self.assertEqual(len(actions), 2)
+
+
+class FixturesTest(unittest.TestCase):
+
+    def tearDown(self):
+        from shortcut import connection
+        connection.drop_database('django_mongokit_test_database')
+
+    def test_dump_and_load(self):
+        import datetime
+        from cStringIO import StringIO
+        from fixtures import (document_label, dump_documents,
+                              get_document_classes, load_documents)
+        from indexes import get_collection
+        label = document_label(IndexedTalk)
+        self.assertEqual(get_document_classes([label.lower()]),
+                         [IndexedTalk])
+        self.assertRaises(LookupError, get_document_classes, ['nope.Talk'])
+
+        collection = get_collection(IndexedTalk)
+        when = datetime.datetime(2010, 1, 1, 12, 30)
+        ids = collection.insert([{'topic': u"Tal\xe4k %s" % i, 'when': when}
+                                 for i in range(5)])
+
+        stream = StringIO()
+        self.assertEqual(dump_documents([IndexedTalk, IndexedTalk], stream),
+                         [(label, 5)])
+        self.assertEqual(len(stream.getvalue().splitlines()), 5)
+
+        collection.remove({'_id': {'$in': ids[:2]}})
+        collection.update({'_id': ids[2]}, {'$set': {'topic': u"Changed"}})
+        stream.seek(0)
+        self.assertEqual(load_documents(stream, batch_size=2), [(label, 5)])
+        documents = list(collection.find().sort('_id'))
+        self.assertEqual([document['_id'] for document in documents], ids)
+        self.assertEqual(documents[2]['topic'], u"Tal\xe4k 2")
+        self.assertEqual(documents[0]['when'], when)
+
+    def test_failed_load_keeps_documents(self):
+        import json
+        from cStringIO import StringIO
+        from fixtures import document_label, load_documents
+        from indexes import get_collection
+        from pymongo.errors import OperationFailure
+        collection = get_collection(IndexedTalk)
+        collection.create_index('slug', unique=True)
+        ids = collection.insert([{'topic': u"One", 'slug': u"one"},
+                                 {'topic': u"Two", 'slug': u"two"}])
+        label = document_label(IndexedTalk)
+        stream = StringIO('\n'.join(json.dumps({
+            'model': label,
+            'document': {'_id': {'$oid': str(_id)}, 'topic': topic,
+                         'slug': u"two"},
+        }) for _id, topic in zip(ids, [u"Uno", u"Dos"])))
+        self.assertRaises(OperationFailure, load_documents, stream)
+        # the one that clashed is still there as it was
+        self.assertEqual(collection.find_one(ids[0])['topic'], u"One")
+        self.assertEqual(collection.find_one(ids[1])['topic'], u"Dos")
+
+
+    def test_load_on_python_26(self):
+        import datetime
+        import fixtures
+        from bson import ObjectId
+        from cStringIO import StringIO
+        from indexes import get_collection
+        _id = ObjectId()
+        stream = StringIO('{"model": "%s", "document": {"_id": {"$oid": '
+                          '"%s"}, "when": {"$date": 1262349000000}}}' %
+                          (fixtures.document_label(IndexedTalk), _id))
+        # json without object_pairs_hook
+        fixtures._ordered_json = False
+        try:
+            fixtures.load_documents(stream)
+        finally:
+            fixtures._ordered_json = True
+        document = get_collection(IndexedTalk).find_one(_id)
+        self.assertEqual(document['when'],
+                         datetime.datetime(2010, 1, 1, 12, 30))
+
+
+class ImporterTest(unittest.TestCase):
+
+    def tearDown(self):
+        from shortcut import connection
+        connection.drop_database('django_mongokit_test_database')
+
+    def test_coerce_value(self):
+        import datetime
+        from importer import coerce_value
+        self.assertEqual(coerce_value('2010-03-01 18:30', datetime.datetime),
+                         datetime.datetime(2010, 3, 1, 18, 30))
+        self.assertEqual(coerce_value('2010-03-01', datetime.datetime),
+                         datetime.datetime(2010, 3, 1))
+        self.assertEqual(coerce_value('python, django', [unicode]),
+                         [u"python", u"django"])
+        self.assertEqual(coerce_value('["a"]', [unicode]), [u"a"])
+        self.assertEqual(coerce_value('1.5', float), 1.5)
+        self.assertEqual(coerce_value('No', bool), False)
+        self.assertEqual(coerce_value(u'{"name": "P"}', {'name': unicode}),
+                         {u'name': u"P"})
+        self.assertRaises(ValueError, coerce_value, 'soon', datetime.datetime)
+        self.assertRaises(ValueError, coerce_value, 'maybe', bool)
+
+    def test_import_csv(self):
+        from indexes import create_index, get_collection
+        from importer import Importer, read_rows, run_import
+        collection = get_collection(IndexedTalk)
+        for index in IndexedTalk._meta.indexes:
+            create_index(collection, index)
+        rows = read_rows([
+            'topic,slug\n',
+            'Python,python\n',
+            'Django,\n',
+            'Duplicate,python\n',
+            'Too,many,columns\n',
+        ], 'csv')
+        importer = Importer(IndexedTalk, 'csv', header=rows.next()[1])
+        results = list(run_import(importer, rows, batch_size=3))
+        self.assertEqual(sum(imported for imported, __ in results), 2)
+        rejected = [each[0] for __, batch in results for each in batch]
+        self.assertEqual(rejected, [4, 5])
+        self.assertEqual(sorted(talk['topic'] for talk in collection.find()),
+                         [u"Django", u"Python"])
+
+    def test_import_existing_ids(self):
+        from indexes import get_collection
+        from importer import Importer, read_rows, run_import
+        collection = get_collection(IndexedTalk)
+        _id = collection.insert({'topic': u"Already there"})
+        rows = read_rows([
+            '{"_id": {"$oid": "%s"}, "topic": "Again"}\n' % _id,
+            '{"topic": "New"}\n',
+        ], 'json')
+        importer = Importer(IndexedTalk, 'json')
+        results = list(run_import(importer, rows))
+        self.assertEqual(sum(imported for imported, __ in results), 1)
+        rejected = [each[0] for __, batch in results for each in batch]
+        self.assertEqual(rejected, [1])
+        self.assertEqual(collection.find_one(_id)['topic'], u"Already there")
+
+
+class MigrateTest(unittest.TestCase):
+
+    def tearDown(self):
+        from shortcut import connection, get_database
+        from migrate import BOOKKEEPING_COLLECTION
+        connection.drop_database('django_mongokit_test_database')
+        get_database().drop_collection(BOOKKEEPING_COLLECTION)
+
+    def test_update_migration(self):
+        from indexes import get_collection
+        from migrate import (DocumentMigration, applied_migrations,
+                             plan_ranges, run_migration)
+
+        class Migration(DocumentMigration):
+            document_class = IndexedTalk
+            spec = {'slug': {'$exists': False}}
+            update = {'$set': {'slug': None}}
+            batch_size = 2
+
+        collection = get_collection(IndexedTalk)
+        collection.insert([{'topic': u"Talk %s" % i} for i in range(5)])
+        collection.insert({'topic': u"Migrated", 'slug': u"migrated"})
+        self.assertEqual(len(plan_ranges(Migration(), 3)), 3)
+
+        self.assertEqual(run_migration('tests.0001_slug', Migration()), 5)
+        self.assertEqual(collection.find({'slug': None}).count(), 5)
+        self.assertEqual(applied_migrations(), set(['tests.0001_slug']))
+        # already applied
+        self.assertEqual(run_migration('tests.0001_slug', Migration()), 5)
+
+    def test_migration_needs_update_or_transform(self):
+        from migrate import DocumentMigration
+
+        class Migration(DocumentMigration):
+            document_class = IndexedTalk
+
+        self.assertRaises(ValueError, Migration)
+        Migration.update = {'$set': {'slug': None}}
+        Migration.transform = lambda self, document: document
+        self.assertRaises(ValueError, Migration)
+
+    def test_resume_transform_migration(self):
+        from indexes import get_collection
+        from migrate import (DocumentMigration, applied_migrations,
+                             get_bookkeeping_collection, run_migration)
+        transformed = []
+
+        class Migration(DocumentMigration):
+            document_class = IndexedTalk
+            batch_size = 2
+
+            def transform(self, document):
+                if len(transformed) == 3:
+                    raise KeyboardInterrupt
+                transformed.append(document['_id'])
+                document['topic'] = document['topic'].upper()
+                return document
+
+        collection = get_collection(IndexedTalk)
+        ids = collection.insert([{'topic': u"talk %s" % i}
+                                 for i in range(5)])
+        self.assertRaises(KeyboardInterrupt, run_migration,
+                          'tests.0002_upper', Migration())
+        self.assertEqual(applied_migrations(), set())
+        record = get_bookkeeping_collection().find_one('tests.0002_upper')
+        self.assertEqual(record['ranges'][0]['checkpoint'], ids[1])
+
+        del transformed[:]
+        self.assertEqual(run_migration('tests.0002_upper', Migration()), 5)
+        self.assertEqual(transformed, ids[2:])
+        self.assertEqual([talk['topic'] for talk in
+                          collection.find().sort('_id')],
+                         [u"TALK %s" % i for i in range(5)])
+
+
+def _split_name(document):
+    first, __, last = document.pop('name').partition(u" ")
+    document['first_name'] = first
+    document['last_name'] = last
+    return document
+
+
+class Speaker(DjangoDocument):
+    __database__ = 'django_mongokit_test_database'
+    collection_name = 'speakers'
+    structure = {'first_name': unicode, 'last_name': unicode,
+                 'talks': int}
+
+    class Meta:
+        schema_version = 3
+        upgrades = {1: _split_name}
+
+
+class EagerSpeaker(Speaker):
+    class Meta:
+        upgrade_write_back = 'immediate'
+
+
+class UpgradeTest(unittest.TestCase):
+
+    def setUp(self):
+        from shortcut import connection
+        connection.register([Speaker, EagerSpeaker])
+        self.collection = (connection['django_mongokit_test_database']
+                           .speakers)
+
+    def tearDown(self):
+        from shortcut import connection
+        connection.drop_database('django_mongokit_test_database')
+
+    def test_new_documents(self):
+        speaker = self.collection.Speaker()
+        self.assertEqual(speaker['schema_version'], 3)
+        self.assertEqual(EagerSpeaker._meta.schema_version, 3)
+
+    def test_upgrade_on_read(self):
+        _id = self.collection.insert({'name': u"Peter Bengtsson",
+                                      'talks': 1})
+        speaker = self.collection.Speaker.find_one(_id)
+        self.assertEqual(speaker['first_name'], u"Peter")
+        self.assertEqual(speaker['schema_version'], 3)
+        # not written back
+        self.assertTrue('name' in self.collection.find_one(_id))
+        # but saving saves the upgrade too
+        speaker['talks'] += 1
+        speaker.save()
+        stored = self.collection.find_one(_id)
+        self.assertEqual(stored, dict(speaker))
+
+        # partial documents aren't upgraded
+        _id = self.collection.insert({'name': u"Paul", 'talks': 0})
+        speaker = self.collection.Speaker.find_one(_id, fields=['talks'])
+        self.assertTrue('schema_version' not in speaker)
+
+    def test_write_back(self):
+        from document import flush_upgrades
+        ids = self.collection.insert([{'name': u"Ann Other", 'talks': 1},
+                                      {'name': u"Some One", 'talks': 2}])
+        self.collection.EagerSpeaker.find_one(ids[0])
+        self.assertEqual(self.collection.find_one(ids[0])['last_name'],
+                         u"Other")
+
+        Speaker._meta.upgrade_write_back = 'batched'
+        try:
+            self.collection.Speaker.find_one(ids[1])
+            self.assertTrue('name' in self.collection.find_one(ids[1]))
+            flush_upgrades()
+        finally:
+            Speaker._meta.upgrade_write_back = None
+        self.assertEqual(self.collection.find_one(ids[1])['schema_version'],
+                         3)
+
+
+class CachedTalk(DjangoDocument):
+    __database__ = 'django_mongokit_test_database'
+    collection_name = 'cached_talks'
+    structure = {'topic': unicode}
+    track_changes = True
+
+    class Meta:
+        cache_timeout = 60
+        count_cache_timeout = 60
+
+
+class CachingTest(unittest.TestCase):
+
+    def setUp(self):
+        from shortcut import connection
+        connection.register([CachedTalk])
+        self.collection = (connection['django_mongokit_test_database']
+                           .cached_talks)
+
+    def tearDown(self):
+        from shortcut import connection
+        from caching import get_cache
+        connection.drop_database('django_mongokit_test_database')
+        get_cache().clear()
+
+    def test_cached_by_id(self):
+        from caching import get_cache
+        talk = self.collection.CachedTalk()
+        talk['topic'] = u"Cached"
+        talk.save()
+        # as if the marker the save left had run out
+        get_cache().clear()
+        loaded = self.collection.CachedTalk.one({'_id': talk['_id']})
+        self.assertEqual(loaded['topic'], u"Cached")
+
+        # behind the cache's back
+        self.collection.update({'_id': talk['_id']},
+                               {'$set': {'topic': u"Changed"}})
+        self.assertEqual(
+            self.collection.CachedTalk.find_one(talk['_id'])['topic'],
+            u"Cached"
+        )
+        self.assertEqual(
+            self.collection.CachedTalk.one({'topic': u"Changed"})['_id'],
+            talk['_id']
+        )
+
+        loaded['topic'] = u"Saved"
+        loaded.save()
+        cached = self.collection.CachedTalk.get_cached(str(talk['_id']))
+        self.assertEqual(cached['topic'], u"Saved")
+        # loaded documents still only save what changed
+        self.assertEqual(cached._snapshot, dict(cached))
+
+        cached.delete()
+        self.assertEqual(
+            self.collection.CachedTalk.get_cached(talk['_id']), None
+        )
+
+    def test_counts(self):
+        talks = self.collection.CachedTalk.objects
+        self.assertEqual(talks.estimated_count(), 0)
+        for topic in (u"One", u"Two", u"Two"):
+            talk = self.collection.CachedTalk()
+            talk['topic'] = topic
+            talk.save()
+        self.assertEqual(talks.estimated_count(), 3)
+        self.assertEqual(talks.filter(topic=u"Two").count(), 2)
+        self.assertEqual(talks.filter(topic=u"Two")[1:].count(), 1)
+
+        # behind the cache's back
+        self.collection.remove({'topic': u"Two"})
+        self.assertEqual(talks.filter(topic=u"Two").count(), 2)
+        # any save makes all the counts of the collection stale
+        talk.save()
+        self.assertEqual(talks.filter(topic=u"Two").count(), 0)
+        self.assertEqual(talks.filter(topic=u"One").count(), 1)
+        talks.filter(topic=u"One").delete()
+        self.assertEqual(talks.filter(topic=u"One").count(), 0)
+        self.assertEqual(talks.estimated_count(), 0)
+
+    def test_updates_without_signals(self):
+        from caching import get_cache
+        talk = self.collection.CachedTalk()
+        talk['topic'] = u"Cached"
+        talk.save()
+        get_cache().clear()
+        self.assertEqual(
+            self.collection.CachedTalk.find_one(talk['_id'])['topic'],
+            u"Cached"
+        )
+
+        talks = self.collection.CachedTalk.objects
+
+        talks.filter(topic=u"Cached").update(topic=u"Updated")
+        self.assertEqual(
+            self.collection.CachedTalk.find_one(talk['_id'])['topic'],
+            u"Updated"
+        )
+        talks.filter(topic=u"Updated").delete()
+        self.assertEqual(
+            self.collection.CachedTalk.get_cached(talk['_id']), None
+        )
+
+    def test_stampede_guard(self):
+        import caching
+        cache = caching.get_cache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return 'document'
+
+        self.assertEqual(caching.get_or_load(cache, 'key', load, 60),
+                         'document')
+        self.assertEqual(caching.get_or_load(cache, 'key', load, 60),
+                         'document')
+        self.assertEqual(len(loads), 1)
+
+        # someone else is loading it but taking too long
+        cache.add('other:lock', 1)
+        old_wait_time, caching.WAIT_TIME = caching.WAIT_TIME, 0.1
+        try:
+            self.assertEqual(caching.get_or_load(cache, 'other', load, 60),
+                             'document')
+        finally:
+            caching.WAIT_TIME = old_wait_time
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(cache.get('other'), 'document')
+
+        # it changed while someone was loading the old version
+        cache.delete('key')
+        caching.invalidate_documents(cache, self.collection, ['id'])
+        key = caching.cache_key(self.collection, 'id')
+        cache.add(key + ':lock', 1)
+        self.assertEqual(caching.get_or_load(cache, key, load, 60),
+                         'document')
+        cache.delete(key + ':lock')
+        self.assertEqual(caching.get_or_load(cache, key, lambda: 'old', 60),
+                         'old')
+        self.assertEqual(cache.get(key), caching.INVALIDATED)
+
+
+class IdentityMapTest(unittest.TestCase):
+
+    def setUp(self):
+        from shortcut import connection
+        connection.register([Talk, LighteningTalk])
+        self.collection = (connection['django_mongokit_test_database']
+                           .talks)
+
+    def tearDown(self):
+        from shortcut import connection
+        connection.drop_database('django_mongokit_test_database')
+
+    def test_middleware(self):
+        from identity import identity_map
+        from middleware import IdentityMapMiddleware
+        _id = self.collection.insert({'topic': u"Once", 'has_slides': True})
+        loaded = []
+
+        def view(request):
+            talk = self.collection.Talk.one({'_id': _id})
+            self.assertTrue(self.collection.Talk.find_one(_id) is talk)
+            self.assertTrue(self.collection.Talk.get_from_id(_id) is talk)
+            # not the same class
+            other = self.collection.LighteningTalk.one({'_id': _id})
+            self.assertTrue(isinstance(other, LighteningTalk))
+            talk.delete()
+            loaded.append(self.collection.Talk.find_one(_id))
+            return 'response'
+
+        self.assertEqual(IdentityMapMiddleware(view)(None), 'response')
+        self.assertEqual(loaded, [None])
+        self.assertFalse(identity_map.active)
+
+        _id = self.collection.insert({'topic': u"Twice"})
+        middleware = IdentityMapMiddleware()
+        middleware.process_request(None)
+        try:
+            self.assertTrue(self.collection.Talk.one({'_id': _id}) is
+                            self.collection.Talk.one({'_id': _id}))
+        finally:
+            middleware.process_response(None, 'response')
+        self.assertFalse(self.collection.Talk.one({'_id': _id}) is
+                         self.collection.Talk.one({'_id': _id}))
+
+    def test_updates_without_signals(self):
+        from identity import identity_map
+        _id = self.collection.insert({'topic': u"Before"})
+        identity_map.start()
+        try:
+            talks = self.collection.Talk.objects
+            self.assertEqual(self.collection.Talk.get_from_id(_id)['topic'],
+                             u"Before")
+            talks.filter(topic=u"Before").update(topic=u"After")
+            self.assertEqual(self.collection.Talk.get_from_id(_id)['topic'],
+                             u"After")
+            talks.filter(topic=u"After").delete()
+            self.assertEqual(self.collection.Talk.get_from_id(_id), None)
+        finally:
+            identity_map.stop()
+
 
 class ShortcutTestCase(unittest.TestCase):
 
@@ -159,6 +1157,25 @@ class ShortcutTestCase(unittest.TestCase):
         db = get_database(connection)
         self.assertEqual(db.connection, connection)
 
+    def test_connection_is_made_again_after_fork(self):
+        try:
+            from django.db import connections
+        except ImportError:
+            # Django <1.2
+            return  # :(
+        from shortcut import connection
+        connection.register([Talk])
+        wrapper = connections['mongodb']
+        before = wrapper.connection
+        self.assertTrue(wrapper.connection is before)
+
+        # pretend we're in a forked child process
+        wrapper._connection_pid = -1
+        after = wrapper.connection
+        self.assertTrue(after is not before)
+        self.assertTrue('Talk' in after._registered_documents)
+        self.assertEqual(connection, after)
+
     def test_get_version(self):
         from shortcut import get_version
         version = get_version()
@@ -193,6 +1210,93 @@ class MongoDBBaseTestCase(unittest.TestCase):
         # needed attribute
         self.assertTrue(hasattr(connection.connection, 'autocommit'))
 
+    def test_pool_stats(self):
+        try:
+            from django.db import connections
+        except ImportError:
+            # Django <1.2
+            return  # :(
+        if in_memory():
+            return  # no sockets to pool
+        connection = connections['mongodb']
+        connection.reset_pool_stats()
+        list(connection.connection['django_mongokit_test_database']
+             .test_collection_name.find())
+        stats = connection.pool_stats()
+        self.assertTrue(stats['checkouts'] >= 1)
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertTrue(stats['idle'] >= 1)
+        self.assertEqual(stats['waits'], 0)
+
+    def test_queries(self):
+        try:
+            from django.db import connections
+        except ImportError:
+            # Django <1.2
+            return  # :(
+        connection = connections['mongodb']
+        collection = (connection.connection['django_mongokit_test_database']
+                      .test_collection_name)
+        connection.settings_dict['RECORD_QUERIES'] = True
+        try:
+            connection.reset_queries()
+            collection.insert({'topic': u"Foo"})
+            collection.find_one({'topic': u"Foo"})
+            collection.find({'topic': u"Bar"}).count()
+            operations = [(query['operation'], query['collection'])
+                          for query in connection.queries]
+            self.assertEqual(operations[-2:], [
+                ('find', 'test_collection_name'),
+                ('count', 'test_collection_name'),
+            ])
+            find = connection.queries[-2]
+            self.assertEqual(find['filter'], {'topic': '?'})
+            self.assertEqual(find['documents'], 1)
+            self.assertTrue(float(find['time']) >= 0)
+
+            connection.reset_queries()
+            self.assertEqual(connection.queries, [])
+        finally:
+            del connection.settings_dict['RECORD_QUERIES']
+            collection.drop()
+
+    def test_slow_queries(self):
+        try:
+            from django.db import connections
+        except ImportError:
+            # Django <1.2
+            return  # :(
+        import logging
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        handler = Handler()
+        logger = logging.getLogger('django_mongokit.slow_queries')
+        logger.addHandler(handler)
+        connection = connections['mongodb']
+        collection = (connection.connection['django_mongokit_test_database']
+                      .test_collection_name)
+        collection.insert({'topic': u"Foo"})
+        # everything is slow
+        connection.settings_dict['SLOW_QUERY_TIME'] = 0
+        connection.settings_dict['SLOW_QUERY_EXPLAIN'] = 1.0
+        try:
+            collection.find_one({'topic': u"Foo"})
+        finally:
+            del connection.settings_dict['SLOW_QUERY_TIME']
+            del connection.settings_dict['SLOW_QUERY_EXPLAIN']
+            logger.removeHandler(handler)
+            collection.drop()
+        # the explain itself isn't logged
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].operation, 'find')
+        self.assertEqual(records[0].filter, {'topic': '?'})
+        self.assertTrue(records[0].explain)
+        self.assertTrue('Slow find' in records[0].getMessage())
+
     def test_create_test_database(self):
         from django.conf import settings
         try:
@@ -200,6 +1304,8 @@ class MongoDBBaseTestCase(unittest.TestCase):
         except AttributeError:
             # Django <1.2
             return  # :(
+        if in_memory():
+            return  # talks to a real mongod with Connection()
         old_database_name = settings.DATABASES['mongodb']['NAME']
         assert 'test_' not in old_database_name
         # pretend we're the Django 'test' command
@@ -254,6 +1360,8 @@ class MongoDBBaseTestCase(unittest.TestCase):
         except AttributeError:
             # Django <1.2
             return
+        if in_memory():
+            return  # talks to a real mongod with Connection()
         settings.DATABASES['mongodb']['TEST_NAME'] = "test_mustard"
         old_database_name = settings.DATABASES['mongodb']['NAME']
         from django.db import connections
@@ -281,6 +1389,139 @@ class MongoDBBaseTestCase(unittest.TestCase):
                         settings.DATABASES['mongodb']['NAME'])
         self.assertTrue(test_database_name not in con.database_names())
 
+    def test_clone_test_database(self):
+        from django.conf import settings
+        try:
+            assert 'mongodb' in settings.DATABASES
+        except AttributeError:
+            # Django <1.2
+            return
+        from django.db import connections
+        connection = connections['mongodb']
+        client = connection.connection
+        old_database_name = settings.DATABASES['mongodb']['NAME']
+        test_database_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            collection = client[test_database_name].test_collection_name
+            collection.create_index('topic', unique=True)
+            collection.insert([{'topic': u"One"}, {'topic': u"Two"}])
+
+            connection.creation.clone_test_db(suffix='1', verbosity=0)
+            creation = connection.creation
+            clone_settings = creation.get_test_db_clone_settings('1')
+            self.assertEqual(clone_settings['NAME'], test_database_name + '_1')
+            # the settings still point at the test database
+            self.assertEqual(settings.DATABASES['mongodb']['NAME'],
+                             test_database_name)
+
+            clone = client[clone_settings['NAME']].test_collection_name
+            self.assertEqual(sorted(x['topic'] for x in clone.find()),
+                             [u"One", u"Two"])
+            self.assertTrue(
+                clone.index_information()['topic_1'].get('unique')
+            )
+
+            connection.creation.destroy_test_db(suffix='1', verbosity=0)
+            self.assertTrue(clone_settings['NAME'] not in
+                            client.database_names())
+        finally:
+            connection.creation.destroy_test_db(old_database_name,
+                                                verbosity=0)
+        self.assertEqual(settings.DATABASES['mongodb']['NAME'],
+                         old_database_name)
+
+
+class MongoTestCaseTest(unittest.TestCase):
+
+    def test_cleanup(self):
+        from shortcut import connection
+        from testcases import MongoTestCase
+        database = connection['django_mongokit_test_database']
+        database.untouched.insert({'name': u"Keep me"})
+        counts = []
+
+        class Inner(MongoTestCase):
+
+            @classmethod
+            def setUpMongoData(cls):
+                database.fixtures.create_index('name')
+                database.fixtures.insert({'name': u"Fixture"})
+
+            def test_1_write(self):
+                database.fixtures.insert({'name': u"More"})
+                database.fixtures.remove({'name': u"Fixture"})
+                database.scratch.insert({'name': u"Scratch"})
+
+            def test_2_restored(self):
+                counts.append((database.fixtures.find({'name': u"Fixture"})
+                               .count(),
+                               database.fixtures.count(),
+                               database.scratch.count()))
+
+        try:
+            result = unittest.TestResult()
+            unittest.TestLoader().loadTestsFromTestCase(Inner).run(result)
+            self.assertTrue(result.wasSuccessful())
+            self.assertEqual(counts, [(1, 1, 0)])
+            self.assertEqual(database.fixtures.count(), 0)
+            self.assertTrue('name_1' in database.fixtures.index_information())
+            self.assertEqual(database.untouched.count(), 1)
+        finally:
+            connection.drop_database('django_mongokit_test_database')
+
+
+class MemoryEngineTest(unittest.TestCase):
+
+    def test_matches(self):
+        from mongodb_memory.engine import matches
+        document = {'topic': u"Python", 'tags': [u"a", u"b"],
+                    'author': {'name': u"Peter"}, 'duration': 1.5}
+        self.assertTrue(matches(document, {'topic': u"Python"}))
+        self.assertTrue(matches(document, {'tags': u"b"}))
+        self.assertTrue(matches(document, {'author.name': u"Peter"}))
+        self.assertTrue(matches(document, {'duration': {'$gt': 1,
+                                                        '$lte': 1.5}}))
+        self.assertTrue(matches(document, {'$or': [
+            {'topic': u"Django"},
+            {'tags': {'$all': [u"a"]}},
+        ]}))
+        self.assertTrue(matches(document, {'missing': {'$exists': False}}))
+        self.assertFalse(matches(document, {'tags': {'$nin': [u"a"]}}))
+        self.assertFalse(matches(document, {'topic': {'$regex': '^py'}}))
+        self.assertTrue(matches(document, {'topic': {'$regex': '^py',
+                                                     '$options': 'i'}}))
+
+    def test_apply_update(self):
+        from mongodb_memory.engine import apply_update
+        document = {'_id': 1, 'views': 1, 'tags': [u"a"]}
+        document = apply_update(document, {'$inc': {'views': 2},
+                                           '$addToSet': {'tags': u"a"},
+                                           '$push': {'comments': u"Nice"},
+                                           '$set': {'author.name': u"Peter"}})
+        self.assertEqual(document, {'_id': 1, 'views': 3, 'tags': [u"a"],
+                                    'comments': [u"Nice"],
+                                    'author': {'name': u"Peter"}})
+
+    def test_sort_documents(self):
+        from mongodb_memory.engine import sort_documents
+        documents = [{'a': 2, 'b': 1}, {'a': 1}, {'a': 2, 'b': 2}, {}]
+        self.assertEqual(sort_documents(documents, [('a', -1), ('b', 1)]),
+                         [{'a': 2, 'b': 1}, {'a': 2, 'b': 2}, {'a': 1}, {}])
+
+    def test_unique_index(self):
+        from pymongo.errors import DuplicateKeyError
+        from mongodb_memory.base import MemoryClient
+        client = MemoryClient(_connect=False)
+        collection = client['django_mongokit_test_memory'].test_unique
+        try:
+            collection.create_index('slug', unique=True)
+            collection.insert({'slug': u"a"})
+            self.assertRaises(DuplicateKeyError, collection.insert,
+                              {'slug': u"a"})
+            self.assertEqual(collection.find({'slug': u"a"}).count(), 1)
+        finally:
+            client.drop_database('django_mongokit_test_memory')
+
 #
 # DocumentForm tests follow
 #
@@ -4,10 +4,6 @@ import datetime
 import random
 from cStringIO import StringIO
 from time import time, sleep
-try:
-    from bson import ObjectId
-except ImportError:  # old pymongo
-    from pymongo.objectid import ObjectId
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.conf import settings
 from django.core.urlresolvers import reverse
@@ -97,29 +93,27 @@ def __random_duration():
 def _create_talks(how_many):
     # 1 Create 1,000 talks
     collection = get_database()[Talk.collection_name]
-    ids = set()
+    talks = []
     for i in range(how_many):
         talk = collection.Talk()
         talk.topic = __random_topic()
         talk.when = __random_when()
         talk.tags = __random_tags()
         talk.duration = __random_duration()
-        talk.save()
-        ids.add(talk.pk)
-    return ids
+        talks.append(talk)
+    collection.Talk.bulk_save(talks)
+    return set(talk['_id'] for talk in talks)
 
 def _edit_talks(ids):
     collection = get_database()[Talk.collection_name]
-    for id_ in ids:
-        talk = collection.Talk.one({'_id': ObjectId(id_)})
+    talks, __ = collection.Talk.get_many(ids)
+    for talk in talks:
         talk.topic += "extra"
-        talk.save()
+    collection.Talk.bulk_save(talks)
 
 def _delete_talks(ids):
     collection = get_database()[Talk.collection_name]
-    for id_ in ids:
-        talk = collection.Talk.one({'_id': ObjectId(id_)})
-        talk.delete()
+    collection.Talk.delete_where({'_id': {'$in': list(ids)}})
 
 
 
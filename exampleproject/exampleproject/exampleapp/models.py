@@ -17,4 +17,10 @@ class Talk(DjangoDocument):
 
     use_dot_notation = True
 
+    class Meta:
+        # the homepage pages through the talks newest first
+        indexes = [
+            {'fields': ['-when', '-_id']},
+        ]
+
 connection.register([Talk])
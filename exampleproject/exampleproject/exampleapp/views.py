@@ -2,12 +2,14 @@ try:
     from bson import ObjectId
 except ImportError:  # old pymongo
     from pymongo.objectid import ObjectId
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
 from django_mongokit import get_database
+from django_mongokit.paginator import KeysetPaginator
 
 from models import Talk
 from forms import TalkForm
@@ -16,9 +18,12 @@ from forms import TalkForm
 def homepage(request):
 
     collection = get_database()[Talk.collection_name]
-    talks = collection.Talk.find()
-    talks.sort('when', -1)
-    talks_count = talks.count()
+    talks = collection.Talk.objects.order_by('-when')
+    talks_count = talks.estimated_count()
+    try:
+        page = KeysetPaginator(talks, 20).page(request.GET.get('cursor'))
+    except InvalidPage:
+        raise Http404("No such page")
 
     if request.method == "POST":
         form = TalkForm(request.POST, collection=collection)
@@ -30,7 +35,7 @@ def homepage(request):
 
     return render_to_response(
         "exampleapp/home.html", {
-            'talks': talks,
+            'talks': page,
             'form': form,
             'talks_count': talks_count,
         },
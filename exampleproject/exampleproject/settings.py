@@ -121,6 +121,7 @@ INSTALLED_APPS = (
     'django.contrib.sites',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django_mongokit',
     'exampleproject.exampleapp',
     'exampleproject.exampleapp_sql',
     'exampleproject.benchmarker',
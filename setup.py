@@ -16,7 +16,10 @@ setup(
     packages=[
         'django_mongokit',
         'django_mongokit.forms',
+        'django_mongokit.management',
+        'django_mongokit.management.commands',
         'django_mongokit.mongodb',
+        'django_mongokit.mongodb_memory',
     ],
     package_data={'django_mongokit': ['version.txt']},
     classifiers=[